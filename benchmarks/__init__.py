@@ -0,0 +1,10 @@
+""" Benchmarks for the paypal client, run against a local stub server
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.bench_transport
+
+The whole suite, writing JSON results to compare across releases::
+
+    python -m benchmarks.suite --output results.json
+"""
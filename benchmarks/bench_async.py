@@ -0,0 +1,47 @@
+""" Throughput of the non-blocking API with 1, 10 and 100 calls in flight
+
+Calls `AsyncAdaptivePayments.payment_details` against a local stub that
+adds a fixed latency to every response, like PayPal's processing time
+
+    python -m benchmarks.bench_async [calls] [latency]
+"""
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from paypal import Configuration, Transport
+from paypal.api.asynchronous import AsyncAdaptivePayments, bounded
+
+from . import stub
+
+
+def main(calls=1000, latency=0.02):
+    with stub.StubServer(latency=float(latency)) as server:
+        for in_flight in (1, 10, 100):
+            transport = Transport(pool_size=in_flight)
+            config = Configuration(
+                stub.environment(server), 'userid', 'password', 'signature',
+                transport=transport,
+            )
+            executor = ThreadPoolExecutor(max_workers=in_flight)
+            api = AsyncAdaptivePayments(config, executor=executor)
+
+            start = time.time()
+            for paykey, future in bounded(
+                lambda paykey: api.payment_details(paykey=paykey),
+                ('AP-{}'.format(i) for i in xrange(int(calls))),
+                max_in_flight=in_flight,
+            ):
+                future.result()
+            elapsed = time.time() - start
+
+            executor.shutdown()
+            transport.close()
+            print('{in_flight:>4} in flight: {rate:8.1f} calls/s'.format(
+                in_flight=in_flight, rate=int(calls) / elapsed,
+            ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
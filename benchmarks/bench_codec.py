@@ -0,0 +1,73 @@
+""" Encode and decode times of the JSON codecs on realistic payloads
+
+Encodes a Pay request to six receivers and decodes the PaymentDetails
+response of the same payment, with the previous `json.dumps` and
+`response.json()` path and each available codec
+
+    python -m benchmarks.bench_codec
+"""
+import json
+import timeit
+from decimal import Decimal
+
+from paypal import JSONCodec, UJSONCodec
+from paypal.codec import ujson
+
+from .stub import payment_details_body
+
+
+def pay_payload(receivers=6):
+    return {
+        'receiverList': {'receiver': [
+            {
+                'email': 'receiver{}@example.com'.format(i),
+                'amount': Decimal('{}.{:02d}'.format(10 + i, i)),
+                'invoiceId': 'INV-2014-{:06d}'.format(i),
+                'primary': False,
+            }
+            for i in range(receivers)
+        ]},
+        'returnUrl': 'https://example.com/paypal/return?order=123456',
+        'cancelUrl': 'https://example.com/paypal/cancel?order=123456',
+        'ipnNotificationUrl': 'https://example.com/paypal/ipn',
+        'memo': u'Payout for orders 123456 \u2013 123461',
+        'trackingId': '5f0c1c6e-8a34-4d6c-9b1e-0d3a0f6d2a7e',
+        'reverseAllParallelPaymentsOnError': True,
+        'actionType': 'PAY',
+        'currencyCode': 'USD',
+        'senderEmail': 'merchant@example.com',
+        'requestEnvelope': {'errorLanguage': 'en_US', 'detailLevel': 'ReturnAll'},
+    }
+
+
+def legacy_encode(data):
+    # Receivers used to carry amounts as strings
+    return json.dumps(data, default=str)
+
+
+def report(name, func, number=20000):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    print('{name:>28}: {usec:8.2f} usec per call'.format(name=name, usec=best / number * 1e6))
+
+
+def main():
+    payload = pay_payload()
+    body = payment_details_body()
+
+    codecs = [('JSONCodec', JSONCodec())]
+    if ujson is not None:
+        codecs.append(('UJSONCodec', UJSONCodec()))
+    else:
+        print('ujson is not installed, skipping UJSONCodec')
+
+    report('encode Pay, json.dumps', lambda: legacy_encode(payload))
+    for name, codec in codecs:
+        report('encode Pay, ' + name, lambda: codec.encode(payload))
+
+    report('decode details, json.loads', lambda: json.loads(body))
+    for name, codec in codecs:
+        report('decode details, ' + name, lambda: codec.decode(body))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+""" Aggregating fees and net amounts over transaction search results
+
+Compares summing `Decimal` amounts over the per-row dicts of
+`TransactionSearchResponse.transactions` with summing the integer cent
+arrays of `TransactionSearchResponse.columns`
+
+    python -m benchmarks.bench_columns [responses]
+"""
+import sys
+import time
+from decimal import Decimal
+
+from paypal import Configuration, Environment, TransactionSearchResponse, TransactionColumns
+
+from .bench_records import Response
+from .stub import transaction_search_body
+
+
+def per_row(responses):
+    fees = net = Decimal(0)
+    for response in responses:
+        for transaction in response.zipped_response(exclude=response.error_arrays):
+            fees += Decimal(transaction['FEEAMT'])
+            net += Decimal(transaction['NETAMT'])
+    return int(fees * 100), int(net * 100)
+
+
+def columnar(responses):
+    columns = TransactionColumns.concatenate(response.columns() for response in responses)
+    return sum(columns.amounts('FEEAMT')), sum(columns.amounts('NETAMT'))
+
+
+def main(responses=1000):
+    config = Configuration(Environment.Sandbox, 'userid', 'password', 'signature')
+    response = TransactionSearchResponse(config, Response(transaction_search_body(100)))
+    responses = [response] * int(responses)
+
+    results = []
+    for name, aggregate in [('per-row zip', per_row), ('columns', columnar)]:
+        start = time.time()
+        results.append(aggregate(responses))
+        elapsed = time.time() - start
+        print('{name:>12}: {rate:10.0f} rows/s'.format(
+            name=name, rate=len(responses) * 100 / elapsed,
+        ))
+
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,77 @@
+""" Cost of preparing request headers and resolving the configuration
+
+Compares rebuilding the six authentication headers and copying them on
+every call, as `headers()` and `post` used to, with the headers compiled
+once by `Configuration`.  Allocations are reported with tracemalloc where
+available (Python 3.4+)
+
+    python -m benchmarks.bench_config
+"""
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from paypal import AdaptivePayments, Configuration, Environment
+
+from .bench_dispatch import CannedTransport, PAY_RESPONSE
+
+
+def legacy_headers(config):
+    headers = {
+        'X-PAYPAL-SECURITY-USERID': config.userid,
+        'X-PAYPAL-SECURITY-PASSWORD': config.password,
+        'X-PAYPAL-SECURITY-SIGNATURE': config.signature,
+
+        'X-PAYPAL-APPLICATION-ID': config.application_id,
+
+        'X-PAYPAL-REQUEST-DATA-FORMAT': 'JSON',
+        'X-PAYPAL-RESPONSE-DATA-FORMAT': 'JSON',
+    }
+    final_headers = {}
+    final_headers.update(headers)
+    return final_headers
+
+
+def allocated(func, number=1000):
+    """ Bytes allocated per call and still alive when the calls finish """
+    kept = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(number):
+        kept.append(func())
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return float(after - before) / number
+
+
+def main():
+    config = Configuration(
+        Environment.Sandbox, 'userid', 'password', 'signature',
+        transport=CannedTransport(PAY_RESPONSE),
+    )
+    Configuration.configure(
+        Environment.Sandbox, 'userid', 'password', 'signature',
+        transport=CannedTransport(PAY_RESPONSE),
+    )
+
+    api = AdaptivePayments(config)
+
+    for name, func in [
+        ('legacy headers', lambda: legacy_headers(config)),
+        ('compiled headers', lambda: api.headers()),
+        ('global configuration', lambda: AdaptivePayments.config),
+        ('payment_details', lambda: AdaptivePayments.payment_details(paykey='AP-1')),
+    ]:
+        number = 20000
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        line = '{name:>22}: {usec:8.2f} usec per call'.format(name=name, usec=best / number * 1e6)
+        if tracemalloc is not None:
+            line += ', {:8.0f} bytes allocated'.format(allocated(func))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+""" Per-call overhead of the API layer, with the network stubbed out
+
+Measures `mixedmethod` attribute access with the previous wrapper-per-access
+implementation and the current one, and the full `payment_details` and
+`pay` call chains over a transport returning a canned response
+
+    python -m benchmarks.bench_dispatch
+"""
+import functools
+import json
+import timeit
+
+from paypal import AdaptivePayments, Configuration, Environment, Receiver
+from paypal.utils import mixedmethod
+
+
+class LegacyMixedMethod(object):
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, instance, cls):
+        @functools.wraps(self.func)
+        def wrapper(*args, **kwargs):
+            return self.func(instance or cls, *args, **kwargs)
+
+        return wrapper
+
+
+class Legacy(object):
+    @LegacyMixedMethod
+    def method(self):
+        return self
+
+
+class Cached(object):
+    @mixedmethod
+    def method(self):
+        return self
+
+
+class CannedResponse(object):
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = json.dumps(body)
+        self._json = body
+
+    def json(self):
+        return self._json
+
+
+class CannedTransport(object):
+    """ Transport answering every request with the same response """
+
+    def __init__(self, body):
+        self.response = CannedResponse(body)
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        return self.response
+
+
+PAY_RESPONSE = {
+    'responseEnvelope': {
+        'timestamp': '2014-10-21T11:15:53.861-07:00',
+        'ack': 'Success',
+        'correlationId': '6e4b1d2b5f1f3',
+        'build': '13414382',
+    },
+    'payKey': 'AP-1234567890',
+    'paymentExecStatus': 'COMPLETED',
+    'paymentInfoList': {'paymentInfo': [{
+        'transactionId': '9JH12345678900000',
+        'transactionStatus': 'COMPLETED',
+        'receiver': {'amount': '10.00', 'email': 'receiver@example.com', 'primary': 'false'},
+        'senderTransactionId': '1AB12345678900000',
+        'senderTransactionStatus': 'COMPLETED',
+    }]},
+}
+
+
+def report(name, statement, number):
+    best = min(timeit.repeat(statement, number=number, repeat=5))
+    print('{name:>36}: {usec:8.2f} usec per call'.format(name=name, usec=best / number * 1e6))
+
+
+def main():
+    legacy, cached = Legacy(), Cached()
+    report('legacy mixedmethod, class', lambda: Legacy.method(), 200000)
+    report('bound mixedmethod, class', lambda: Cached.method(), 200000)
+    report('legacy mixedmethod, instance', lambda: legacy.method(), 200000)
+    report('bound mixedmethod, instance', lambda: cached.method(), 200000)
+
+    config = Configuration(
+        Environment.Sandbox, 'userid', 'password', 'signature',
+        transport=CannedTransport(PAY_RESPONSE),
+    )
+    api = AdaptivePayments(config)
+    receivers = [Receiver(email='receiver@example.com', amount='10.00')]
+
+    report('AdaptivePayments().payment_details', lambda: api.payment_details(paykey='AP-1234567890'), 5000)
+    report('AdaptivePayments().pay', lambda: api.pay(receivers=receivers, implicit=True), 5000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+""" Notifications per second of the IPN pipeline
+
+Parses Adaptive Payments notifications to six receivers with `parse_ipn`
+and `urlparse.parse_qs`, then handles them against the local verification
+stub: one at a time with `requests.post`, as a blocking view does, and
+with `IPNHandler.process`, de-duplicating in SQLite and verifying
+concurrently over pooled connections
+
+    python -m benchmarks.bench_ipn [notifications] [workers]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import urllib
+import urlparse
+
+import requests
+
+from paypal import Configuration, IPNDeduplicator, IPNHandler, IPNResult, Transport, parse_ipn
+
+from . import stub
+
+
+def ipn_body(n, receivers=6):
+    pairs = [
+        ('transaction_type', 'Adaptive Payment PAY'),
+        ('payment_request_date', 'Tue Oct 21 11:15:53 PDT 2014'),
+        ('return_url', 'https://example.com/paypal/return?order=123456'),
+        ('cancel_url', 'https://example.com/paypal/cancel?order=123456'),
+        ('ipn_notification_url', 'https://example.com/paypal/ipn'),
+        ('sender_email', 'merchant@example.com'),
+        ('verify_sign', 'AFcWxV21C7fd0v3bYYYRCpSSRl31A7yDhhsPUU2XhtMoZXsWHFxu-RWy'),
+        ('test_ipn', '1'),
+        ('fees_payer', 'EACHRECEIVER'),
+        ('pay_key', 'AP-{:013d}'.format(n)),
+        ('action_type', 'PAY'),
+        ('memo', 'Payout for order {}'.format(n)),
+        ('tracking_id', 'payout-{:06d}'.format(n)),
+        ('notify_version', 'UNVERSIONED'),
+        ('reverse_all_parallel_payments_on_error', 'false'),
+        ('charset', 'windows-1252'),
+        ('status', 'COMPLETED'),
+    ]
+    for i in range(receivers):
+        pairs.extend([
+            ('transaction[{}].id_for_sender_txn'.format(i), '1AB1234567890{:04d}'.format(i)),
+            ('transaction[{}].receiver'.format(i), 'receiver{}@example.com'.format(i)),
+            ('transaction[{}].is_primary_receiver'.format(i), 'false'),
+            ('transaction[{}].id'.format(i), '9JH1234567890{:04d}'.format(i)),
+            ('transaction[{}].status'.format(i), 'Completed'),
+            ('transaction[{}].paymentType'.format(i), 'SERVICE'),
+            ('transaction[{}].status_for_sender_txn'.format(i), 'Completed'),
+            ('transaction[{}].pending_reason'.format(i), 'NONE'),
+            ('transaction[{}].amount'.format(i), 'USD 10.00'),
+            ('transaction[{}].invoiceId'.format(i), 'INV-2014-{:06d}'.format(i)),
+        ])
+    return urllib.urlencode(pairs)
+
+
+def blocking(bodies, url):
+    """ Previous approach: parse and verify every notification in turn """
+    for body in bodies:
+        urlparse.parse_qs(body)
+        response = requests.post(url, data='cmd=_notify-validate&' + body)
+        assert response.content == 'VERIFIED'
+
+
+def main(notifications=2000, workers=20):
+    body = ipn_body(0)
+    for name, parse in [('parse_qs', urlparse.parse_qs), ('parse_ipn', parse_ipn)]:
+        number = 5000
+        best = min(timeit.repeat(lambda: parse(body), number=number, repeat=5))
+        print('{name:>22}: {rate:8.0f} notifications/s'.format(name=name, rate=number / best))
+
+    bodies = [ipn_body(n) for n in range(notifications)]
+    directory = tempfile.mkdtemp()
+    try:
+        with stub.StubServer(routes=stub.paypal_routes()) as server:
+            environment = stub.environment(server)
+
+            start = time.time()
+            blocking(bodies, environment.IPN.verify_endpoint)
+            print('{name:>22}: {rate:8.0f} notifications/s'.format(
+                name='blocking requests.post', rate=notifications / (time.time() - start),
+            ))
+
+            transport = Transport(pool_size=workers)
+            config = Configuration(
+                environment, 'userid', 'password', 'signature', transport=transport,
+            )
+            handler = IPNHandler(
+                config,
+                deduplicator=IPNDeduplicator(os.path.join(directory, 'ipn.db')),
+                max_workers=workers,
+            )
+
+            # Every notification twice, as PayPal does when not acknowledged
+            start = time.time()
+            statuses = {}
+            for result in handler.process(bodies + bodies):
+                statuses[result.status] = statuses.get(result.status, 0) + 1
+            print('{name:>22}: {rate:8.0f} notifications/s {statuses}'.format(
+                name='IPNHandler.process', rate=2 * notifications / (time.time() - start),
+                statuses=statuses,
+            ))
+            assert statuses == {IPNResult.HANDLED: notifications, IPNResult.DUPLICATE: notifications}
+            transport.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
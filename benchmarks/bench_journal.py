@@ -0,0 +1,76 @@
+""" Durable intents per second of the write-ahead journal
+
+Compares appending every intent to a file and syncing it on its own with
+`WriteAheadJournal`, whose concurrent intents share a sync (group commit)
+
+    python -m benchmarks.bench_journal [intents] [threads]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from paypal import WriteAheadJournal
+
+
+class FsyncJournal(object):
+    """ Previous approach: append and fsync every record """
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        self.commits = 0
+        self._lock = threading.Lock()
+
+    def intent(self, operation_id, **fields):
+        record = json.dumps(dict(fields, op='intent', id=operation_id)) + '\n'
+        with self._lock:
+            self.file.write(record)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.commits += 1
+
+    def outcome(self, operation_id, **fields):
+        record = json.dumps(dict(fields, op='outcome', id=operation_id)) + '\n'
+        with self._lock:
+            self.file.write(record)
+
+
+def run(journal, intents, threads):
+    per_thread = intents // threads
+    receivers = [{'email': 'receiver@example.com', 'amount': '10.00'}] * 6
+
+    def worker(n):
+        for i in range(per_thread):
+            operation_id = '{}-{}'.format(n, i)
+            journal.intent(operation_id, receivers=receivers)
+            journal.outcome(operation_id, paykey='AP-1234567890', ack='Success')
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return per_thread * threads / (time.time() - start)
+
+
+def main(intents=2000, threads=16):
+    directory = tempfile.mkdtemp()
+    try:
+        for name, journal in [
+            ('fsync per record', FsyncJournal(os.path.join(directory, 'fsync'))),
+            ('WriteAheadJournal', WriteAheadJournal(os.path.join(directory, 'wal'))),
+        ]:
+            rate = run(journal, intents, threads)
+            print('{name:>18}: {rate:8.0f} intents/s, {commits} syncs ({threads} threads)'.format(
+                name=name, rate=rate, commits=journal.commits, threads=threads,
+            ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
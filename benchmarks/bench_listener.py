@@ -0,0 +1,146 @@
+""" Acknowledgement latency of IPN notifications during a burst
+
+Posts notifications from concurrent clients, as PayPal does during a
+payout, to a view verifying every notification with `requests.post` before
+answering, and to `IPNListener`, which answers once the notification is
+queued.  Verification postbacks go to the local stub, answering after
+`latency` milliseconds
+
+    python -m benchmarks.bench_listener [notifications] [clients] [latency]
+"""
+import BaseHTTPServer
+import multiprocessing
+import sys
+import threading
+import time
+
+import requests
+
+from paypal import (
+    Configuration, Histogram, IPNHandler, IPNListener, MemoryIPNQueue, Transport, parse_ipn,
+)
+
+from . import stub
+from .bench_ipn import ipn_body
+
+
+class BlockingView(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Previous approach: verify and handle before answering """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length')))
+        parse_ipn(body)
+        response = requests.post(
+            self.server.verify_endpoint, data='cmd=_notify-validate&' + body,
+        )
+        assert response.content == 'VERIFIED'
+
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def burst(url, bodies, clients):
+    """ Post `bodies` from `clients` threads, returning the acknowledgement
+    latencies, the rate and the number of rejections
+    """
+    latencies = []
+    rejected = [0]
+    lock = threading.Lock()
+    pending = iter(bodies)
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                body = next(pending, None)
+            if body is None:
+                return
+            start = time.time()
+            response = session.post(url, data=body)
+            latencies.append(time.time() - start)
+            if response.status_code != 200:
+                with lock:
+                    rejected[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(bodies) / (time.time() - start), rejected[0]
+
+
+def report(name, url, bodies, clients, processes=4):
+    """ Run a burst from other `processes`, so that clients don't compete
+    with the server for the interpreter lock
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        bursts = [
+            pool.apply_async(burst, (url, bodies[n::processes], clients // processes))
+            for n in range(processes)
+        ]
+        results = [result.get() for result in bursts]
+    finally:
+        pool.close()
+        pool.join()
+
+    histogram = Histogram()
+    for latencies, _, _ in results:
+        for latency in latencies:
+            histogram.record(latency)
+    rate = sum(rate for _, rate, _ in results)
+    rejected = sum(rejected for _, _, rejected in results)
+    summary = histogram.summary()
+    print('{name:>14}: {rate:7.0f} acks/s, p50 {p50:7.1f} ms, p99 {p99:7.1f} ms, {rejected} rejected'.format(
+        name=name, rate=rate, p50=summary['p50'] * 1000, p99=summary['p99'] * 1000,
+        rejected=rejected,
+    ))
+
+
+def main(notifications=1000, clients=50, latency=100):
+    bodies = [ipn_body(n) for n in range(notifications)]
+
+    with stub.StubServer(routes=stub.paypal_routes(), latency=latency / 1000.0) as server:
+        environment = stub.environment(server)
+
+        httpd = stub.ThreadingHTTPServer(('127.0.0.1', 0), BlockingView)
+        httpd.verify_endpoint = environment.IPN.verify_endpoint
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            host, port = httpd.server_address
+            report('blocking view', 'http://{}:{}/ipn'.format(host, port), bodies, clients)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+        transport = Transport(pool_size=20)
+        config = Configuration(environment, 'userid', 'password', 'signature', transport=transport)
+        handler = IPNHandler(config, max_workers=20)
+        queue = MemoryIPNQueue(maxsize=notifications)
+        with IPNListener(handler, queue=queue, address=('127.0.0.1', 0)) as listener:
+            report('IPNListener', listener.url(), bodies, clients)
+
+            start = time.time()
+            while sum(listener.metrics()['statuses'].values()) < notifications:
+                time.sleep(0.01)
+            metrics = listener.metrics()
+            print('{name:>14}: drained in {drain:.1f} s, latency p50 {p50:.0f} ms, p99 {p99:.0f} ms'.format(
+                name='IPNListener', drain=time.time() - start,
+                p50=metrics['latency']['p50'] * 1000, p99=metrics['latency']['p99'] * 1000,
+            ))
+        transport.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
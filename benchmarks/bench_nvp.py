@@ -0,0 +1,71 @@
+""" Decoding a 100 row TransactionSearch response
+
+Compares the single pass `decode_nvp` with the previous path of
+`parse_nvp`, regex based collapsing and zipping of the arrays
+
+    python -m benchmarks.bench_nvp [rows]
+"""
+import itertools
+import sys
+import timeit
+from collections import OrderedDict
+
+from paypal.utils import decode_nvp, parse_nvp, nvp_array_re
+
+from .stub import transaction_search_body
+
+
+def legacy(body):
+    response = parse_nvp(body)
+
+    collapsed_response = OrderedDict()
+    for key, value in response.iteritems():
+        match = nvp_array_re.match(key)
+        if match:
+            key, index = match.groups()
+            if key not in collapsed_response:
+                collapsed_response[key] = []
+            keys = len(collapsed_response[key])
+            if int(index) < keys:
+                raise IndexError('Index mismatch parsing NVP response, perhaps lost order?')
+            if int(index) > keys:
+                collapsed_response[key].extend([None] * (int(index) - keys))
+            collapsed_response[key].append(value)
+        else:
+            collapsed_response[key] = value
+    collapsed_response = dict(collapsed_response)
+
+    transaction_keys = tuple(
+        key.lstrip('L_')
+        for key, value in collapsed_response.iteritems()
+        if isinstance(value, list)
+    )
+    transaction_values = itertools.izip(*(
+        value
+        for value in collapsed_response.itervalues()
+        if isinstance(value, list)
+    ))
+    return [
+        dict(itertools.izip(keys, values))
+        for keys, values in itertools.izip(itertools.repeat(transaction_keys), transaction_values)
+    ]
+
+
+def single_pass(body):
+    return decode_nvp(body)[2]
+
+
+def main(rows=100):
+    body = transaction_search_body(int(rows))
+    assert legacy(body) == single_pass(body)
+
+    for name, decode in [('legacy', legacy), ('decode_nvp', single_pass)]:
+        number = 200
+        best = min(timeit.repeat(lambda: decode(body), number=number, repeat=5))
+        print('{name:>12}: {usec:8.1f} usec per response'.format(
+            name=name, usec=best / number * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,92 @@
+""" Signatures per second of the Merchant OAuth header
+
+Compares the previous implementation, rebuilding the key and encoding the
+url and parameters with a regex on every call, with a reused `OAuthSigner`,
+after checking that both produce the same header
+
+    python -m benchmarks.bench_oauth
+"""
+import base64
+import hashlib
+import hmac
+import re
+import timeit
+
+from paypal.utils import OAuthSigner, oauth_header
+
+
+legacy_encode_re = re.compile(r'([A-Za-z0-9_ ]+)')
+
+
+def legacy_encode(raw):
+    translate = {' ': '+'}
+    return ''.join(
+        "%" + hex(ord(c))[2:] if not re.match(legacy_encode_re, c) else translate.get(c, c)
+        for c in raw
+    )
+
+
+def legacy_header(consumer_key, consumer_secret, token, token_secret, http_method, url, timestamp):
+    key = '{consumer_secret}&{token_secret}'.format(
+        consumer_secret=consumer_secret,
+        token_secret=legacy_encode(token_secret)
+    )
+
+    params = '&'.join(
+        '{}={}'.format(key, value)
+        for key, value in [
+            ('oauth_consumer_key', consumer_key),
+            ('oauth_signature_method', 'HMAC-SHA1'),
+            ('oauth_timestamp', timestamp),
+            ('oauth_token', token),
+            ('oauth_version', '1.0'),
+        ]
+    )
+
+    raw = '{http_method}&{url}&{params}'.format(
+        http_method=http_method,
+        url=legacy_encode(url),
+        params=legacy_encode(params)
+    )
+
+    hashed = hmac.new(str(key), str(raw), hashlib.sha1)
+    signature = base64.b64encode(hashed.digest())
+
+    return {
+        'X-PP-AUTHORIZATION': 'token={token},signature={signature},timestamp={timestamp}'.format(
+            timestamp=timestamp,
+            token=token,
+            signature=signature,
+        ),
+    }
+
+
+CREDENTIALS = (
+    'merchant_api1.example.com',
+    'K8SDZ9RX4WQ3ALPB',
+    'Ay1Lx.Eg2sVJ-wD4nUuXHnmtT0cBJwbT8aQz3s5iB7r9z.lYPdFkMx',
+    'Zv0S3kqBdM-7Hf~aP/9e+Q',
+)
+URL = 'https://api-3t.sandbox.paypal.com/nvp'
+
+
+def main():
+    signer = OAuthSigner(*CREDENTIALS)
+    for timestamp in (0, 1413915353, 9999999999):
+        expected = legacy_header(*CREDENTIALS + ('POST', URL, timestamp))
+        assert signer.header('POST', URL, timestamp) == expected, 'headers differ'
+        assert OAuthSigner(*CREDENTIALS).header('POST', URL, timestamp) == expected, 'headers differ'
+    print('headers are identical')
+
+    for name, func in [
+        ('legacy oauth_header', lambda: legacy_header(*CREDENTIALS + ('POST', URL, 1413915353))),
+        ('oauth_header', lambda: oauth_header(*CREDENTIALS + ('POST', URL))),
+        ('OAuthSigner.header', lambda: signer.header('POST', URL)),
+    ]:
+        number = 20000
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{name:>20}: {rate:10.0f} signatures per second'.format(name=name, rate=number / best))
+
+
+if __name__ == '__main__':
+    main()
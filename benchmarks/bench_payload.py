@@ -0,0 +1,71 @@
+""" Cost of building and encoding the body of a Pay request
+
+Compares the previous path, building the whole payload, stripping `None`
+values and encoding everything, with `AdaptivePayments.pay_template`,
+encoding only the variable fields.  Allocations are reported with
+tracemalloc where available (Python 3.4+)
+
+    python -m benchmarks.bench_payload
+"""
+import timeit
+
+from paypal import AdaptivePayments, Receiver
+from paypal.codec import default_codec
+
+from .bench_config import allocated, tracemalloc
+
+
+def fields(receivers):
+    return {
+        'receiverList': {
+            'receiver': [receiver.as_dict() for receiver in receivers]
+        },
+        'returnUrl': 'https://example.com/paypal/return?order=123456',
+        'cancelUrl': 'https://example.com/paypal/cancel?order=123456',
+        'ipnNotificationUrl': 'https://example.com/paypal/ipn',
+        'memo': None,
+        'trackingId': '5f0c1c6e-8a34-4d6c-9b1e-0d3a0f6d2a7e',
+        'reverseAllParallelPaymentsOnError': None,
+    }
+
+
+def legacy_body(receivers):
+    payload = fields(receivers)
+    payload.update({
+        'actionType': AdaptivePayments.ActionType.PAY,
+        'currencyCode': AdaptivePayments.CurrencyCode.USD,
+        'requestEnvelope': {
+            'errorLanguage': 'en_US',
+            'detailLevel': 'ReturnAll',
+        },
+    })
+    final_data = {k: v for k, v in payload.items() if v is not None}
+    return default_codec.encode(final_data)
+
+
+def template_body(receivers):
+    return AdaptivePayments.pay_template.encode(default_codec, fields(receivers))
+
+
+def main():
+    for count in (1, 6):
+        receivers = [
+            Receiver(email='receiver{}@example.com'.format(i), amount='10.00')
+            for i in range(count)
+        ]
+        for name, func in [
+            ('{} receivers, legacy'.format(count), lambda: legacy_body(receivers)),
+            ('{} receivers, template'.format(count), lambda: template_body(receivers)),
+        ]:
+            number = 5000
+            best = min(timeit.repeat(func, number=number, repeat=20))
+            line = '{name:>22}: {usec:8.2f} usec per call, {size} bytes'.format(
+                name=name, usec=best / number * 1e6, size=len(func()),
+            )
+            if tracemalloc is not None:
+                line += ', {:8.0f} bytes allocated'.format(allocated(func))
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+""" Overhead per call of the rate limiter backends
+
+Acquires tokens from a bucket with a rate high enough to never wait, so
+only the bookkeeping is measured
+
+    python -m benchmarks.bench_ratelimit [calls] [threads]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from paypal import RateLimits
+
+
+def run(limits, calls, threads):
+    per_thread = calls // threads
+
+    def worker():
+        for _ in xrange(per_thread):
+            limits.acquire('APP-80W284485P519543T', 'https://svcs.paypal.com/AdaptivePayments/Pay')
+
+    workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.time() - start) / (per_thread * threads)
+
+
+def main(calls=20000, threads=1):
+    directory = tempfile.mkdtemp()
+    try:
+        for name, limits in [
+            ('in-process', RateLimits(rate=1e9)),
+            ('sqlite', RateLimits(rate=1e9, path=os.path.join(directory, 'limits.db'))),
+        ]:
+            overhead = run(limits, int(calls), int(threads))
+            print('{name:>12}: {usec:8.2f} usec per call ({threads} threads)'.format(
+                name=name, usec=overhead * 1e6, threads=threads,
+            ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,61 @@
+""" Memory held by 1M transaction search results
+
+Compares a dict per transaction (`TransactionSearchResponse.transactions`)
+with compact records (`TransactionSearchResponse.records`).  Each variant
+runs in its own process and reports the growth of its peak RSS
+
+    python -m benchmarks.bench_records [records]
+"""
+import multiprocessing
+import resource
+import sys
+import time
+
+from paypal import Configuration, Environment, TransactionSearchResponse
+
+from .stub import transaction_search_body
+
+
+class Response(object):
+    def __init__(self, content):
+        self.content = content
+
+
+def build(variant, count):
+    config = Configuration(Environment.Sandbox, 'userid', 'password', 'signature')
+    response = TransactionSearchResponse(config, Response(transaction_search_body(100)))
+    repeat = count // 100
+
+    if variant == 'dicts':
+        return [dict(row) for _ in xrange(repeat) for row in response.transactions]
+    if variant == 'records':
+        return [record for _ in xrange(repeat) for record in response.records(typed=False)]
+    if variant == 'typed records':
+        return [record for _ in xrange(repeat) for record in response.records()]
+
+
+def measure(variant, count, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    results = build(variant, count)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((len(results), (after - before) * 1024, elapsed))
+
+
+def main(count=1000000):
+    count = int(count)
+    queue = multiprocessing.Queue()
+
+    for variant in ('dicts', 'records', 'typed records'):
+        process = multiprocessing.Process(target=measure, args=(variant, count, queue))
+        process.start()
+        built, size, elapsed = queue.get()
+        process.join()
+        print('{variant:>14}: {mb:8.1f} MB, {per:5.0f} bytes per transaction, built in {elapsed:.2f}s'.format(
+            variant=variant, mb=size / 1e6, per=float(size) / built, elapsed=elapsed,
+        ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
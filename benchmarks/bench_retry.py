@@ -0,0 +1,61 @@
+""" Success rate and latency of payment_details calls against a faulty stub
+
+Compares calls without retries and with a `RetryPolicy`, against a stub
+answering a fraction of requests with 500 errors or dropping them
+
+    python -m benchmarks.bench_retry [calls] [error_rate] [drop_rate]
+"""
+import sys
+import time
+
+import requests
+
+from paypal import AdaptivePayments, PaypalAPIError, Configuration, RetryPolicy, RetryBudget, Transport
+
+from . import stub
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main(calls=500, error_rate=0.1, drop_rate=0.05):
+    with stub.StubServer(error_rate=float(error_rate), drop_rate=float(drop_rate)) as server:
+        for name, policy in [
+            ('no retries', None),
+            ('retries', RetryPolicy(
+                max_attempts=4, backoff=0.005, deadline=5,
+                budget=RetryBudget(ratio=0.5, minimum=50, maximum=500),
+            )),
+        ]:
+            transport = Transport()
+            config = Configuration(
+                stub.environment(server), 'userid', 'password', 'signature',
+                transport=transport, retry_policy=policy,
+            )
+            api = AdaptivePayments(config)
+
+            succeeded = 0
+            latencies = []
+            for i in xrange(int(calls)):
+                start = time.time()
+                try:
+                    succeeded += api.payment_details(paykey='AP-{}'.format(i)).success
+                except requests.RequestException:
+                    pass
+                except PaypalAPIError:
+                    pass  # 500 error page instead of JSON
+                latencies.append(time.time() - start)
+            transport.close()
+
+            print('{name:>12}: {rate:6.1%} succeeded, p50 {p50:6.1f} ms, p99 {p99:6.1f} ms'.format(
+                name=name,
+                rate=float(succeeded) / int(calls),
+                p50=percentile(latencies, 0.5) * 1000,
+                p99=percentile(latencies, 0.99) * 1000,
+            ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
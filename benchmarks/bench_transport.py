@@ -0,0 +1,54 @@
+""" Requests per second with and without connection pooling
+
+Posts to a local HTTPS stub using `UnpooledTransport` (a new TCP+TLS
+connection per call, as `requests.post` does) and the pooled `Transport`
+
+    python -m benchmarks.bench_transport [requests] [threads]
+"""
+import sys
+import threading
+import time
+import warnings
+
+from paypal.transport import Transport, UnpooledTransport
+
+from .stub import StubServer
+
+
+def run(transport, url, requests, threads):
+    per_thread = requests // threads
+
+    def worker():
+        for _ in xrange(per_thread):
+            transport.post(url, data='{}', headers={'Content-Type': 'application/json'})
+
+    workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+
+    return per_thread * threads / elapsed
+
+
+def main(requests=500, threads=1):
+    warnings.simplefilter('ignore')  # Self-signed stub certificate
+
+    with StubServer(tls=True) as server:
+        url = server.url('/AdaptivePayments/PaymentDetails')
+
+        for name, transport in [
+            ('unpooled', UnpooledTransport(verify=False)),
+            ('pooled', Transport(pool_size=threads, verify=False)),
+        ]:
+            rate = run(transport, url, requests, threads)
+            transport.close()
+            print('{name:>10}: {rate:8.1f} requests/s ({requests} requests, {threads} threads)'.format(
+                name=name, rate=rate, requests=requests, threads=threads,
+            ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,306 @@
+""" Local HTTP(S) server standing in for the PayPal endpoints
+
+Usage::
+
+    with StubServer(tls=True) as server:
+        transport.post(server.url('/AdaptivePayments/PaymentDetails'), ...)
+
+    # Answering like PayPal, for the API classes
+    with StubServer(routes=paypal_routes(receivers=6, rows=100)) as server:
+        config = Configuration(environment(server), ...)
+"""
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import random
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+
+from paypal.environment import Environment
+
+
+DEFAULT_BODY = (
+    '{"responseEnvelope": {"timestamp": "2014-10-21T11:15:53.861-07:00",'
+    ' "ack": "Success", "correlationId": "6e4b1d2b5f1f3", "build": "13414382"}}'
+)
+
+
+RESPONSE_ENVELOPE = {
+    'timestamp': '2014-10-21T11:15:53.861-07:00',
+    'ack': 'Success',
+    'correlationId': '6e4b1d2b5f1f3',
+    'build': '13414382',
+}
+
+
+def payment_details_body(receivers=6):
+    """ PaymentDetails response of a completed payment to `receivers` """
+    return json.dumps({
+        'responseEnvelope': RESPONSE_ENVELOPE,
+        'cancelUrl': 'https://example.com/paypal/cancel?order=123456',
+        'currencyCode': 'USD',
+        'ipnNotificationUrl': 'https://example.com/paypal/ipn',
+        'memo': u'Payout for orders 123456 \u2013 123461',
+        'paymentInfoList': {'paymentInfo': [
+            {
+                'transactionId': '9JH1234567890{:04d}'.format(i),
+                'transactionStatus': 'COMPLETED',
+                'receiver': {
+                    'amount': '{}.{:02d}'.format(10 + i, i),
+                    'email': 'receiver{}@example.com'.format(i),
+                    'primary': 'false',
+                    'invoiceId': 'INV-2014-{:06d}'.format(i),
+                    'paymentType': 'SERVICE',
+                    'accountId': 'ACCOUNT{:06d}'.format(i),
+                },
+                'refundedAmount': '0.00',
+                'pendingRefund': 'false',
+                'senderTransactionId': '1AB1234567890{:04d}'.format(i),
+                'senderTransactionStatus': 'COMPLETED',
+            }
+            for i in range(receivers)
+        ]},
+        'returnUrl': 'https://example.com/paypal/return?order=123456',
+        'senderEmail': 'merchant@example.com',
+        'status': 'COMPLETED',
+        'trackingId': '5f0c1c6e-8a34-4d6c-9b1e-0d3a0f6d2a7e',
+        'payKey': 'AP-1234567890',
+        'actionType': 'PAY',
+        'feesPayer': 'EACHRECEIVER',
+        'reverseAllParallelPaymentsOnError': 'true',
+        'sender': {'email': 'merchant@example.com', 'accountId': 'SENDER0000001', 'useCredentials': 'false'},
+    })
+
+
+def transaction_search_body(rows=100):
+    """ TransactionSearch response finding `rows` transactions """
+    pairs = [
+        ('TIMESTAMP', '2014-10-21T18:15:53Z'),
+        ('CORRELATIONID', '6e4b1d2b5f1f3'),
+        ('ACK', 'Success'),
+        ('VERSION', '119'),
+        ('BUILD', '13414382'),
+    ]
+    for i in xrange(rows):
+        pairs.extend([
+            ('L_TIMESTAMP{}'.format(i), '2014-10-21T18:{:02}:53Z'.format(i % 60)),
+            ('L_TIMEZONE{}'.format(i), 'GMT'),
+            ('L_TYPE{}'.format(i), 'Payment'),
+            ('L_EMAIL{}'.format(i), 'buyer{}@example.com'.format(i)),
+            ('L_NAME{}'.format(i), 'Buyer Number {}'.format(i)),
+            ('L_TRANSACTIONID{}'.format(i), '9JH1234567890{:04}'.format(i)),
+            ('L_STATUS{}'.format(i), 'Completed'),
+            ('L_AMT{}'.format(i), '10.00'),
+            ('L_FEEAMT{}'.format(i), '-0.59'),
+            ('L_NETAMT{}'.format(i), '9.41'),
+            ('L_CURRENCYCODE{}'.format(i), 'USD'),
+        ])
+    return urllib.urlencode(pairs)
+
+
+def verify_ipn(body):
+    """ Answer IPN verification requests, accepting every notification
+    posted back as PayPal expects
+    """
+    if body.startswith('cmd=_notify-validate&'):
+        return 200, 'text/plain', 'VERIFIED'
+    return 200, 'text/plain', 'INVALID'
+
+
+def paypal_routes(receivers=1, rows=100):
+    """ Routes answering like the Adaptive Payments Pay and PaymentDetails,
+    Permissions GetAccessToken and GetPermissions, Merchant NVP and IPN
+    verification endpoints
+
+    The size of the responses grows with the number of `receivers` of the
+    payments, and of transaction `rows` found by TransactionSearch
+    """
+    details = json.loads(payment_details_body(receivers))
+    pay = {
+        'responseEnvelope': RESPONSE_ENVELOPE,
+        'payKey': details['payKey'],
+        'paymentExecStatus': 'COMPLETED',
+        'paymentInfoList': details['paymentInfoList'],
+    }
+    access_token = {
+        'responseEnvelope': RESPONSE_ENVELOPE,
+        'scope': ['TRANSACTION_SEARCH', 'TRANSACTION_DETAILS'],
+        'token': 'AAAAAAAbCdEfGhIjKlMn',
+        'tokenSecret': 'Zv0S3kqBdM-7Hf~aP/9e+Q',
+    }
+    permissions = {
+        'responseEnvelope': RESPONSE_ENVELOPE,
+        'scope': ['TRANSACTION_SEARCH', 'TRANSACTION_DETAILS'],
+    }
+
+    return {
+        '/AdaptivePayments/Pay': (200, 'application/json', json.dumps(pay)),
+        '/AdaptivePayments/PaymentDetails': (200, 'application/json', json.dumps(details)),
+        '/Permissions/GetAccessToken/': (200, 'application/json', json.dumps(access_token)),
+        '/Permissions/GetPermissions/': (200, 'application/json', json.dumps(permissions)),
+        '/nvp': (200, 'text/plain', transaction_search_body(rows)),
+        '/cgi-bin/webscr': verify_ipn,
+    }
+
+
+class StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        server = self.server.stub
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.drop_rate and random.random() < server.drop_rate:
+            # Hang up without answering
+            self.close_connection = True
+            return
+
+        if server.error_rate and random.random() < server.error_rate:
+            answer = 500, 'text/plain', 'Internal Server Error'
+        else:
+            answer = server.respond(self.path, body)
+
+        if answer is None:
+            # Hang up once the request was received
+            self.close_connection = True
+            return
+        status, content_type, content = answer
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections without a TLS close_notify are expected
+        pass
+
+
+class StubServer(object):
+    """ Threaded HTTP/1.1 server answering every POST through `respond`
+
+    `routes` maps request paths to `(status, content_type, body)` tuples,
+    or to functions of the request body returning them, or `None` to hang
+    up without answering; unknown paths get a successful JSON response
+    envelope
+
+    `error_rate` and `drop_rate` are the fractions of requests answered with
+    a 500 error, and dropped without an answer
+
+    With `tls=True` a throwaway self-signed certificate is generated using
+    the `openssl` command line tool, so clients must not verify certificates
+    """
+
+    def __init__(self, routes=None, tls=False, latency=0, error_rate=0, drop_rate=0):
+        self.routes = routes or {}
+        self.tls = tls
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.requests = 0
+
+        self._httpd = None
+        self._thread = None
+        self._certdir = None
+
+    def respond(self, path, body):
+        self.requests += 1
+        route = self.routes.get(path, (200, 'application/json', DEFAULT_BODY))
+        if callable(route):
+            return route(body)
+        return route
+
+    def url(self, path=''):
+        host, port = self._httpd.server_address
+        return '{scheme}://{host}:{port}{path}'.format(
+            scheme='https' if self.tls else 'http',
+            host=host,
+            port=port,
+            path=path,
+        )
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubRequestHandler)
+        self._httpd.stub = self
+
+        if self.tls:
+            self._certdir = tempfile.mkdtemp()
+            certfile = os.path.join(self._certdir, 'stub.pem')
+            subprocess.check_call(
+                [
+                    'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                    '-subj', '/CN=127.0.0.1', '-days', '1',
+                    '-keyout', certfile, '-out', certfile,
+                ],
+                stdout=open(os.devnull, 'w'),
+                stderr=subprocess.STDOUT,
+            )
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.load_cert_chain(certfile)
+            self._httpd.socket = context.wrap_socket(self._httpd.socket, server_side=True)
+
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        if self._certdir:
+            shutil.rmtree(self._certdir)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def environment(server, base=Environment.Sandbox):
+    """ Return a copy of the `base` environment with every endpoint
+    pointing at the stub `server`
+    """
+    stub = urlparse.urlsplit(server.url())
+
+    def rewrite(service):
+        attrs = {}
+        for name in dir(service):
+            value = getattr(service, name)
+            if name.endswith('_endpoint'):
+                value = urlparse.urlunsplit(stub[:2] + urlparse.urlsplit(value)[2:])
+            if not name.startswith('__'):
+                attrs[name] = value
+        return type(service.__name__, (object,), attrs)
+
+    return type('Stub', (object,), {
+        'application_id': base.application_id,
+        'AdaptivePayments': rewrite(base.AdaptivePayments),
+        'Permissions': rewrite(base.Permissions),
+        'Merchant': rewrite(base.Merchant),
+        'IPN': rewrite(base.IPN),
+    })
@@ -0,0 +1,275 @@
+""" Offline benchmark suite, writing machine-readable results
+
+Runs the API calls end to end against a local stub answering like PayPal,
+measuring throughput and latency percentiles, and microbenchmarks of the
+hot paths with the network left out.  Results are written as JSON, along
+with the versions they were measured on, to be compared across releases::
+
+    python -m benchmarks.suite --output results-0.1.0.json
+    python -m benchmarks.suite --latency 0.05 --error-rate 0.01 --threads 8
+    python -m benchmarks.suite --compare results-0.1.0.json results-0.2.0.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import warnings
+
+import requests
+
+from paypal import (
+    AdaptivePayments, Configuration, Environment, Merchant, Permissions,
+    PaypalAPIError, Receiver, Transport,
+)
+from paypal.api.merchant import TransactionSearchResponse
+from paypal.utils import oauth_header, parse_nvp
+
+from . import stub
+from .bench_dispatch import CannedResponse
+from .bench_oauth import CREDENTIALS, URL
+
+
+def percentile(latencies, q):
+    """ `q`th percentile (0-100) of sorted `latencies` """
+    return latencies[min(int(len(latencies) * q / 100.0), len(latencies) - 1)]
+
+
+def end_to_end(call, calls, threads):
+    """ Make `calls` calls spread over `threads` threads, returning the
+    throughput and latency percentiles in milliseconds
+    """
+    per_thread = calls // threads
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        measured = []
+        failed = 0
+        for i in xrange(per_thread):
+            start = time.time()
+            try:
+                call(i)
+            except (requests.RequestException, PaypalAPIError):
+                failed += 1
+            measured.append(time.time() - start)
+        with lock:
+            latencies.extend(measured)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'errors': errors[0],
+        'throughput': len(latencies) / elapsed,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) * 1000,
+            'p50': percentile(latencies, 50) * 1000,
+            'p90': percentile(latencies, 90) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'max': latencies[-1] * 1000,
+        },
+    }
+
+
+def run_end_to_end(args):
+    routes = stub.paypal_routes(receivers=args.receivers, rows=args.rows)
+    server = stub.StubServer(
+        routes=routes, tls=args.tls,
+        latency=args.latency, error_rate=args.error_rate,
+    )
+
+    results = {}
+    with server:
+        transport = Transport(pool_size=args.threads, verify=not args.tls)
+        config = Configuration(
+            stub.environment(server), 'userid', 'password', 'signature',
+            transport=transport,
+        )
+        receivers = [
+            Receiver(email='receiver{}@example.com'.format(i), amount='10.00')
+            for i in range(args.receivers)
+        ]
+        token, token_secret = CREDENTIALS[2:]
+        start_date = datetime.datetime(2014, 10, 1)
+
+        for name, call in [
+            ('pay', lambda i: AdaptivePayments(config).pay(
+                receivers=receivers, implicit=True,
+            )),
+            ('payment_details', lambda i: AdaptivePayments(config).payment_details(
+                paykey='AP-{}'.format(i),
+            ).response),
+            ('get_access_token', lambda i: Permissions(config).get_access_token(
+                'AAAAAAA{}'.format(i), 'verifier',
+            ).token),
+            ('transaction_search', lambda i: Merchant(config).transaction_search(
+                token, token_secret, start_date=start_date,
+            ).zipped_response()),
+        ]:
+            # Warm up the connection pool and lazy imports
+            for i in xrange(args.threads):
+                try:
+                    call(i)
+                except (requests.RequestException, PaypalAPIError):
+                    pass
+            results[name] = end_to_end(call, args.calls, args.threads)
+        transport.close()
+
+    return results
+
+
+def micro(func, number):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    return {'number': number, 'usec': best / number * 1e6}
+
+
+def run_micro(args):
+    body = stub.transaction_search_body(args.rows)
+    response = CannedResponse({})
+    response.content = body
+    config = Configuration(Environment.Sandbox, 'userid', 'password', 'signature')
+    merchant = Merchant(config)
+    signer = config.oauth_signer(*CREDENTIALS[2:])
+
+    def collapsed():
+        return TransactionSearchResponse(config, response).collapsed_response
+
+    def zipped():
+        return list(TransactionSearchResponse(config, response).zipped_response())
+
+    return {
+        'parse_nvp': micro(lambda: parse_nvp(body), 200),
+        'collapsed_response': micro(collapsed, 200),
+        'zipped_response': micro(zipped, 200),
+        'oauth_header': micro(lambda: oauth_header(*CREDENTIALS + ('POST', URL)), 20000),
+        'oauth_signer_header': micro(lambda: signer.header('POST', URL), 20000),
+        'mixedmethod_class': micro(lambda: Merchant.headers(), 200000),
+        'mixedmethod_instance': micro(lambda: merchant.headers(), 200000),
+    }
+
+
+def metadata(args):
+    try:
+        import pkg_resources
+        version = pkg_resources.get_distribution('paypal').version
+    except Exception:
+        version = None
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+            ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'version': version,
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'parameters': {
+            'calls': args.calls,
+            'threads': args.threads,
+            'tls': args.tls,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'receivers': args.receivers,
+            'rows': args.rows,
+        },
+    }
+
+
+def metrics(results):
+    """ Flatten `results` to `(name, value, higher_is_better)` tuples """
+    for name, result in sorted(results.get('end_to_end', {}).items()):
+        yield '{} throughput'.format(name), result['throughput'], True
+        for q in ('p50', 'p99'):
+            yield '{} {} ms'.format(name, q), result['latency_ms'][q], False
+    for name, result in sorted(results.get('micro', {}).items()):
+        yield '{} usec'.format(name), result['usec'], False
+
+
+def compare(baseline, current):
+    """ Print the change of every metric from the `baseline` to the `current`
+    results files, flagging regressions of more than 10%
+    """
+    with open(baseline) as f:
+        baseline = json.load(f)
+    with open(current) as f:
+        current = json.load(f)
+
+    if baseline.get('parameters') != current.get('parameters'):
+        print('Warning: the results were measured with different parameters')
+
+    baseline = dict((name, value) for name, value, _ in metrics(baseline))
+    current = list(metrics(current))
+
+    for name, value, higher_is_better in current:
+        before = baseline.get(name)
+        if not before:
+            print('{name:>32}: {value:12.2f}'.format(name=name, value=value))
+            continue
+        change = value / before - 1
+        regressed = -change if higher_is_better else change
+        print('{name:>32}: {before:12.2f} -> {value:12.2f} {change:+7.1%}{flag}'.format(
+            name=name, before=before, value=value, change=change,
+            flag='  REGRESSION' if regressed > 0.1 else '',
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='results file, default standard output')
+    parser.add_argument('--calls', type=int, default=500, help='calls per API method')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--tls', action='store_true', help='serve the stub over HTTPS')
+    parser.add_argument('--latency', type=float, default=0, help='stub latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of 500 errors')
+    parser.add_argument('--receivers', type=int, default=6, help='receivers per payment')
+    parser.add_argument('--rows', type=int, default=100, help='TransactionSearch rows')
+    parser.add_argument('--skip-end-to-end', action='store_true')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two results files instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    warnings.simplefilter('ignore')  # Self-signed stub certificate
+
+    results = metadata(args)
+    if not args.skip_end_to_end:
+        results['end_to_end'] = run_end_to_end(args)
+    if not args.skip_micro:
+        results['micro'] = run_micro(args)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,22 @@
 from environment import Environment
 from configuration import Configuration
+from transport import Transport, UnpooledTransport
+from retry import RetryPolicy, RetryBudget
+from cache import MemoryCache, SQLiteCache
+from codec import JSONCodec, UJSONCodec, PayloadTemplate
+from journal import JournalError, WriteAheadJournal
+from instrumentation import (
+    Instrumentation, Hook, CallEvent, Histogram, Histograms, OpenTelemetryHook,
+)
 
 from .api import *
 from .api.adaptive_payments import *
 from .api.permissions import *
 from .api.merchant import *
+from .api.asynchronous import *
+from .api.batch import *
+from .api.circuit import *
+from .api.ratelimit import *
+from .api.payout import *
+from .api.ipn import *
+from .api.listener import *
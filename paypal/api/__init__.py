@@ -1,13 +1,11 @@
 import itertools
-import json
 import logging
-from collections import OrderedDict
-
-import requests
+import time
 
 from ..configuration import Configuration
 from ..exceptions import PaypalError
-from ..utils import mixedmethod, parse_nvp, nvp_array_re
+from ..transport import pop_connect_timings
+from ..utils import mixedmethod, decode_nvp
 
 
 __all__ = [
@@ -25,9 +23,7 @@ class PaypalAPIMeta(type):
     @property
     def configuration(cls):
         """ Classproperty for PaypalAPI.configuration """
-        if not cls._configuration:
-            cls._configuration = Configuration.instantiate()
-        return cls._configuration
+        return cls._configuration or Configuration.instantiate()
 
     @property
     def config(cls):
@@ -68,9 +64,7 @@ class PaypalAPI(object):
     @property
     def configuration(self):
         """ Instance property for PaypalAPI().configuration """
-        if not self._configuration:
-            self._configuration = Configuration.instantiate()
-        return self._configuration
+        return self._configuration or Configuration.instantiate()
 
     @property
     def config(self):
@@ -92,43 +86,181 @@ class PaypalAPIRequest(PaypalAPI):
 
     @mixedmethod
     def headers(self):
+        """ Standard headers of every request, must not be modified """
         return {}
 
     @mixedmethod
-    def post(self, url, data=None, headers=None, **kwargs):
+    def cache_key(self, url, *args):
+        """ Key of a cached lookup, scoped to the API credentials """
+        return ' '.join('{}'.format(part) for part in (self.configuration.userid, url) + args)
+
+    @mixedmethod
+    def cache_tag(self, key):
+        """ Tag of the cached lookups of an access token or payment key """
+        return '{} {}'.format(self.configuration.userid, key)
+
+    @mixedmethod
+    def post(
+        self, url, data=None, headers=None,
+        idempotent=True, before_retry=None, body=None, template=None,
+        **kwargs
+    ):
         """ POSTs to the PayPal API url provided, sending along the data,
         and any required headers
 
-        `data` values of `None` will be stripped before being sent
+        `data` values of `None` will be stripped before being sent.  With a
+        JSON `PayloadTemplate`, `data` holds the variable fields of the
+        template.  A `body` already encoded is sent as is instead
 
         `headers` passed in will be added to the standard headers
 
+        The request is sent through the configured transport, which keeps
+        connections to PayPal alive between calls
+
+        With a configured `RetryPolicy`, failed requests are sent again.
+        Requests which are not `idempotent` are only sent again if they
+        failed to connect, or `before_retry` is provided to check whether a
+        previous attempt went through (see `RetryPolicy.call`)
+
+        With configured `RateLimits`, every attempt first waits for a
+        token of the application id and `url`
+
+        With configured `CircuitBreakers`, every attempt goes through the
+        breaker of `url`, and may fail immediately with a
+        `CircuitBreakerError`
+
+        With a configured `Instrumentation`, the call is measured and
+        reported to its hooks once the transport returned or raised, and
+        again when the `PaypalAPIResponse` wrapping it parses the body
+
         Returns the response as a json object
         """
-
         if data is None:
             data = {}
-        final_data = {k: v for k, v in data.items() if v is not None}
 
-        final_headers = {}
-        final_headers.update(self.headers())
-        if headers is not None:
+        instrumentation = self.config.instrumentation
+        event = None
+        if instrumentation is not None:
+            event = instrumentation.start(
+                url, data.get('METHOD') or url.rstrip('/').rsplit('/', 1)[-1],
+            )
+
+        if body is None:
+            if template is not None:
+                body = template.encode(self.config.json_codec, data)
+            else:
+                body = self.encode_data({k: v for k, v in data.items() if v is not None})
+
+        if event is not None:
+            event.encode_time = time.time() - event.started
+
+        # The standard headers are shared between calls, copy before adding
+        final_headers = self.headers()
+        if headers:
+            final_headers = dict(final_headers)
             final_headers.update(headers)
 
-        response = requests.post(
-            url,
-            data=self.encode_data(final_data),
-            headers=final_headers,
-            **kwargs
-        )
+        transport = self.config.transport
+
+        breaker = None
+        if self.config.circuit_breakers is not None:
+            breaker = self.config.circuit_breakers[url]
+
+        rate_limits = self.config.rate_limits
+
+        def send(timeout=None):
+            options = kwargs
+            if timeout is not None:
+                options = dict(kwargs, timeout=timeout)
+
+            if rate_limits is not None:
+                rate_limits.acquire(self.config.application_id, url)
+
+            deliver = lambda: transport.post(url, data=body, headers=final_headers, **options)
+            if event is not None:
+                deliver = lambda deliver=deliver: self.measure(event, deliver)
+
+            if breaker is None:
+                return deliver()
+
+            return breaker.call(
+                deliver,
+                failed=lambda response: response.status_code >= 500,
+            )
+
+        call = send
+        retry_policy = self.config.retry_policy
+        if retry_policy is not None:
+            call = lambda: retry_policy.call(
+                send, self.error_ids,
+                idempotent=idempotent, before_retry=before_retry,
+            )
+
+        if event is None:
+            return call()
+
+        sent = time.time()
+        try:
+            response = call()
+        except Exception as e:
+            event.latency = time.time() - sent
+            event.error = e
+            instrumentation.finish(event)
+            raise
+        event.latency = time.time() - sent
+        instrumentation.finish(event)
+
+        try:
+            # Reported again by `PaypalAPIResponse` once parsed
+            response.paypal_event = (instrumentation, event)
+        except AttributeError:
+            # Already decoded, e.g. returned by `before_retry`
+            pass
+        return response
+
+    @mixedmethod
+    def measure(self, event, deliver):
+        """ Send a single attempt through `deliver`, recording its timings
+        on `event`
+        """
+        event.attempts += 1
+        pop_connect_timings()
+        try:
+            response = deliver()
+        finally:
+            event.connect_time, event.tls_time = pop_connect_timings()
+
+        event.status_code = response.status_code
+        event.response_size = len(response.content)
+        elapsed = getattr(response, 'elapsed', None)
+        if elapsed is not None:
+            event.ttfb = elapsed.total_seconds()
         return response
 
+    @mixedmethod
+    def error_ids(self, response):
+        """ Return the PayPal error ids of a raw response """
+        return ()
+
 
 class PaypalJSONAPIRequest(PaypalAPIRequest):
 
     @mixedmethod
     def encode_data(self, data):
-        return json.dumps(data)
+        """ Encode `data` to bytes with the configured `json_codec` """
+        return self.config.json_codec.encode(data)
+
+    @mixedmethod
+    def error_ids(self, response):
+        if 'Failure' not in response.content:
+            return ()
+
+        try:
+            errors = self.config.json_codec.decode(response.content).get('error', ())
+        except (ValueError, AttributeError):
+            return ()
+
+        return [error.get('errorId') for error in errors]
 
 
 class PaypalNVPAPIRequest(PaypalAPIRequest):
@@ -137,6 +269,13 @@ class PaypalNVPAPIRequest(PaypalAPIRequest):
     def encode_data(self, data):
         return data
 
+    @mixedmethod
+    def error_ids(self, response):
+        if 'ACK=Failure' not in response.content:
+            return ()
+
+        return decode_nvp(response.content)[1].get('L_ERRORCODE', [])
+
 
 class PaypalAPIResponse(PaypalAPI):
     """ Wrapper around an API response from Paypal
@@ -148,28 +287,115 @@ class PaypalAPIResponse(PaypalAPI):
 
     `PaypalAPIResponse` is always instantiated, so `@mixedmethod` decorators
     are not required
+
+    The raw body is checked for the response envelope on construction,
+    raising `PaypalAPIError` as before for e.g. an HTML error page or a
+    truncated body.  It is then parsed, validated and logged on first access
+    of `response`, or right away when the INFO level is enabled, to log the
+    `correlationId` and `timestamp` as required by PayPal: only a body that
+    looks complete but does not decode, or misses its `_required_fields`,
+    raises `PaypalAPIError` on first access rather than on construction
+
+    With `check_required_fields` set, successful responses must also
+    provide the properties named in `_required_fields`
     """
 
-    response = None
+    # Properties successful responses must provide
+    _required_fields = ()
+
+    check_required_fields = False
+
+    _response = None
+    _raw_response = None
+
+    # `(instrumentation, event)` of the call, see `PaypalAPIRequest.post`
+    _paypal_event = None
 
     def __init__(self, configuration=None, response=None):
         super(PaypalAPIResponse, self).__init__(configuration=configuration)
 
-        if response:
-            self.response = self.parse_response(response)
+        if response is not None:
+            self._paypal_event = getattr(response, 'paypal_event', None)
+            content = getattr(response, 'content', None)
+            if content is not None:
+                try:
+                    self.check_envelope(content)
+                except PaypalAPIError as e:
+                    self.report_parsed(time.time(), e)
+                    raise
+            self._raw_response = response
 
-            if not self.success:
-                logging.error('Error in paypal response: {}'.format(self.response))
-            else:
-                logging.debug('Successful paypal response: {}'.format(self.response))
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                self.response
 
-            # Required by Paypal to log these two values
-            logging.info('correlationId {}'.format(self.correlation_id))
-            logging.info('timestamp {}'.format(self.timestamp))
+    @property
+    def response(self):
+        """ The parsed response body """
+        response = self._response
+        if response is None and self._raw_response is not None:
+            started = time.time() if self._paypal_event is not None else None
+            try:
+                response = self._response = self.parse_response(self._raw_response)
+                self.validate_response()
+            except Exception as e:
+                self._response = None
+                self.report_parsed(started, e)
+                raise
+            self._raw_response = None
+            self.report_parsed(started)
+            self.log_response()
+        return response
+
+    def report_parsed(self, started, error=None):
+        """ Report the parse time, ack and correlationId of an instrumented
+        response to the hooks, once
+        """
+        if self._paypal_event is None:
+            return
+        instrumentation, event = self._paypal_event
+        self._paypal_event = None
+
+        event.parse_time = time.time() - started
+        if error is not None:
+            event.error = error
+        else:
+            try:
+                event.ack = self.ack
+                event.correlation_id = self.correlation_id
+            except (KeyError, TypeError):
+                pass
+        instrumentation.parsed(event)
+
+    @response.setter
+    def response(self, value):
+        self._raw_response = None
+        self._response = value
 
     def parse_response(self, response):
         return NotImplemented
 
+    def check_envelope(self, content):
+        """ Check the raw body carries a response envelope without parsing
+        it, raising `PaypalAPIError` if not
+        """
+        pass
+
+    def validate_response(self):
+        """ Check the parsed body, raising `PaypalAPIError` if invalid """
+        if self.check_required_fields and self.success:
+            self.validate(self._required_fields)
+
+    def log_response(self):
+        if not self.success:
+            logging.error('Error in paypal response: %s', self._response)
+        else:
+            logging.debug('Successful paypal response: %s', self._response)
+
+        # Required by Paypal to log these two values
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info('correlationId %s', self.correlation_id)
+            logging.info('timestamp %s', self.timestamp)
+
     @property
     def ack(self):
         return NotImplemented
@@ -201,8 +427,8 @@ class PaypalAPIResponse(PaypalAPI):
             for key in keys:
                 getattr(self, key)
         except KeyError as e:
-            logging.debug(self.response)
-            logging.debug("KeyError: {}".format(e.message))
+            logging.debug('%s', self.response)
+            logging.debug('KeyError: %s', e)
             raise PaypalAPIError(
                 'Failed parsing PayPal response'
             )
@@ -228,17 +454,46 @@ class PaypalAPIResponse(PaypalAPI):
 
 class PaypalJSONAPIResponse(PaypalAPIResponse):
 
-    def __init__(self, *args, **kwargs):
-        super(PaypalJSONAPIResponse, self).__init__(*args, **kwargs)
-
-        self.validate(['response_envelope', 'ack', 'correlation_id', 'timestamp'])
+    def check_envelope(self, content):
+        # Only look at both ends of the body, which can be large
+        if not (
+            content[:64].lstrip().startswith(b'{') and
+            content[-64:].rstrip().endswith(b'}') and
+            all(key in content for key in (
+                b'"responseEnvelope"', b'"ack"', b'"correlationId"', b'"timestamp"',
+            ))
+        ):
+            logging.debug('%s', content)
+            raise PaypalAPIError(
+                'Failed parsing PayPal response'
+            )
 
     def parse_response(self, response):
-        try:
-            return response.json()
-        except AttributeError:
+        content = getattr(response, 'content', None)
+        if content is None:
+            # Already decoded, e.g. from a cache
             return response
 
+        try:
+            return self.config.json_codec.decode(content)
+        except ValueError:
+            # E.g. an HTML error page
+            logging.debug('%s', response.content)
+            raise PaypalAPIError(
+                'Failed parsing PayPal response'
+            )
+
+    def validate_response(self):
+        envelope = self._response.get('responseEnvelope')
+        if envelope is None or not all(
+            key in envelope for key in ('ack', 'correlationId', 'timestamp')
+        ):
+            logging.debug('%s', self._response)
+            raise PaypalAPIError(
+                'Failed parsing PayPal response'
+            )
+        super(PaypalJSONAPIResponse, self).validate_response()
+
     @property
     def response_envelope(self):
         return self.response['responseEnvelope']
@@ -258,15 +513,32 @@ class PaypalJSONAPIResponse(PaypalAPIResponse):
 
 class PaypalNVPAPIResponse(PaypalAPIResponse):
 
-    def __init__(self, *args, **kwargs):
-        super(PaypalNVPAPIResponse, self).__init__(*args, **kwargs)
-
-        self.validate(['ack', 'correlation_id', 'timestamp'])
+    def check_envelope(self, content):
+        if not all(key in content for key in (b'ACK=', b'CORRELATIONID=', b'TIMESTAMP=')):
+            logging.debug('%s', content)
+            raise PaypalAPIError(
+                'Failed parsing PayPal response'
+            )
 
     def parse_response(self, response):
-        return parse_nvp(response.content)
+        """ Decode the NVP body, collapsing arrays and zipping them into
+        rows in the same pass
+        """
+        response, self._collapsed_response, self._rows = decode_nvp(
+            response.content, exclude=self.error_arrays
+        )
+        return response
+
+    def validate_response(self):
+        if not all(key in self._response for key in ('ACK', 'CORRELATIONID', 'TIMESTAMP')):
+            logging.debug('%s', self._response)
+            raise PaypalAPIError(
+                'Failed parsing PayPal response'
+            )
+        super(PaypalNVPAPIResponse, self).validate_response()
 
     _collapsed_response = None
+    _rows = None
 
     @property
     def collapsed_response(self):
@@ -295,41 +567,13 @@ class PaypalNVPAPIResponse(PaypalAPIResponse):
 
         Note:: Assumes that the input NVP response order has been retained.
         (i.e. the key `L_TRANSACTIONID0` comes before `L_TRANSACTIONID1`)
-
-        Returns an ordered dict with the same order
         """
+        self.response
         if self._collapsed_response is None:
-            collapsed_response = OrderedDict()
-            for key, value in self.response.iteritems():
-                match = nvp_array_re.match(key)
-                if match:
-                    key, index = match.groups()
-
-                    if key not in collapsed_response:
-                        collapsed_response[key] = []
-
-                    keys = len(collapsed_response[key])
-
-                    if int(index) < keys:
-                        # E.g. we've hit a key like L_TRANSACTIONID2 after hitting a key like L_TRANSACTIONID3
-                        raise IndexError('Index mismatch parsing NVP response, perhaps lost order?')
-
-                    if int(index) > keys:
-                        # E.g. we've hit a key like L_TRANSACTIONID2 without hitting a key like L_TRANSACTIONID1
-                        # Assume L_TRANSACTIONID1 is missing and pad with None
-                        collapsed_response[key].extend([None] * (int(index) - keys))
-
-                    collapsed_response[key].append(value)
-
-                else:
-                    # Not an array
-                    collapsed_response[key] = value
-
-            self._collapsed_response = dict(collapsed_response)
-
+            return {}
         return self._collapsed_response
 
-    def zipped_response(self):
+    def zipped_response(self, exclude=None):
         """ Zips the arrays in the response and generates a dictionary
         for each element, using the keys for that array.
 
@@ -350,21 +594,32 @@ class PaypalNVPAPIResponse(PaypalAPIResponse):
                 {'TRANSACTIONID': 1, 'TIMESTAMP': 4},
             ]
 
+        Arrays named in `exclude` are left out, by default the
+        `error_arrays`.  Those rows are built while decoding the response,
+        and the same dictionaries are generated on every call.
         """
+        if exclude is None:
+            # Rows are built when the response is parsed
+            self.response
+            return iter(self._rows or ())
+
+        return self._zip_arrays(exclude)
+
+    def _zip_arrays(self, exclude):
         # Get only the keys that hold arrays
         transaction_keys = tuple(
-            key.lstrip('L_')
+            key[2:]
             for key, value
             in self.collapsed_response.iteritems()
-            if isinstance(value, list)
+            if isinstance(value, list) and key not in exclude
         )
 
         # Zip the values of those arrays
         transaction_values = itertools.izip(*(
             value
-            for value
-            in self.collapsed_response.itervalues()
-            if isinstance(value, list)
+            for key, value
+            in self.collapsed_response.iteritems()
+            if isinstance(value, list) and key not in exclude
         ))
 
         # Zip those keys and values into dicts
@@ -374,6 +629,13 @@ class PaypalNVPAPIResponse(PaypalAPIResponse):
         ):
             yield dict(itertools.izip(keys, values))
 
+    # Arrays describing errors and warnings rather than response data
+    error_arrays = ('L_ERRORCODE', 'L_SHORTMESSAGE', 'L_LONGMESSAGE', 'L_SEVERITYCODE')
+
+    @property
+    def error_codes(self):
+        return self.collapsed_response.get('L_ERRORCODE', [])
+
     @property
     def ack(self):
         return self.response['ACK']
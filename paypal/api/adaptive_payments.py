@@ -1,14 +1,20 @@
 """ https://developer.paypal.com/docs/classic/adaptive-payments/ApiCallRefLanding/ """
+import datetime
 import logging
+import uuid
+from decimal import Decimal
 
 from . import PaypalJSONAPIResponse, PaypalJSONAPIRequest
 from . import PaypalAPIError
-from ..utils import mixedmethod
+from .batch import batch
+from ..codec import PayloadTemplate
+from ..utils import mixedmethod, parse_datetime
 
 
 __all__ = [
-    'AdaptivePayments', 'AdaptivePaymentsError', 'PayResponse',
+    'AdaptivePayments', 'AdaptivePaymentsError', 'PreapprovalError', 'PayResponse',
     'PreapprovalResponse', 'PaymentDetails', 'PreapprovalDetails',
+    'CancelPreapprovalResponse',
     'Receiver'
 ]
 
@@ -17,6 +23,10 @@ class AdaptivePaymentsError(PaypalAPIError):
     pass
 
 
+class PreapprovalError(AdaptivePaymentsError):
+    pass
+
+
 class AdaptivePayments(PaypalJSONAPIRequest):
 
     class ActionType:
@@ -25,18 +35,36 @@ class AdaptivePayments(PaypalJSONAPIRequest):
     class CurrencyCode:
         USD = 'USD'
 
+    class Details:
+        """ How `pay` resolves the payment details missing from a Pay
+        response
+        """
+        EAGER = 'eager'
+        LAZY = 'lazy'
+        BACKGROUND = 'background'
+        NEVER = None
+
+    # Constant fields of the Pay and Preapproval requests, encoded once
+    pay_template = PayloadTemplate(
+        actionType=ActionType.PAY,
+        currencyCode=CurrencyCode.USD,
+        requestEnvelope={
+            'errorLanguage': 'en_US',
+            'detailLevel': 'ReturnAll',
+        },
+    )
+
+    preapproval_template = PayloadTemplate(
+        currencyCode=CurrencyCode.USD,
+        requestEnvelope={
+            'errorLanguage': 'en_US',
+            'detailLevel': 'ReturnAll',
+        },
+    )
+
     @mixedmethod
     def headers(self):
-        return {
-            'X-PAYPAL-SECURITY-USERID': self.configuration.userid,
-            'X-PAYPAL-SECURITY-PASSWORD': self.configuration.password,
-            'X-PAYPAL-SECURITY-SIGNATURE': self.configuration.signature,
-
-            'X-PAYPAL-APPLICATION-ID': self.configuration.application_id,
-
-            'X-PAYPAL-REQUEST-DATA-FORMAT': 'JSON',
-            'X-PAYPAL-RESPONSE-DATA-FORMAT': 'JSON',
-        }
+        return self.configuration.headers
 
     @mixedmethod
     def pay(
@@ -44,7 +72,8 @@ class AdaptivePayments(PaypalJSONAPIRequest):
         return_url=None, cancel_url=None, ipn_notification_url=None,
         memo=None, tracking_id=None, invoice_id=None,
         reverse_all_parallel_payments_on_error=None,
-        preapproval_key=None, implicit=None
+        preapproval_key=None, implicit=None,
+        details=Details.EAGER, detail_level='ReturnAll'
     ):
         """ Make a call to the PayPal adaptive payments Pay endpoint
 
@@ -55,12 +84,42 @@ class AdaptivePayments(PaypalJSONAPIRequest):
         If `preapproval_key` is provided, then this sender has previously
         authorized this payment request, and no redirect is required.
 
+        With a `preapproval_cache` configured, a payment that the cached
+        preapproval does not allow raises a `PreapprovalError` without
+        calling PayPal (see `PreapprovalDetails.payment_error`).  Payments
+        `COMPLETED` or `PROCESSING` are counted in the cached preapproval,
+        any other outcome drops it from the cache
+
         If `implicit` is `True`, then the API caller is also the sender,
         and no redirect is required (i.e. `Configuration.userid` is used
         as sender)
 
         In the above cases where no authorization redirect is required,
-        transaction details are available immediately in the `PayResponse`
+        transaction details are available in `PayResponse.payment_details`.
+        When the Pay response does not carry them, `details` chooses how
+        they are fetched with `payment_details`:
+
+            `Details.EAGER`: before returning (default)
+            `Details.LAZY`: on first access of `PayResponse.payment_details`
+            `Details.BACKGROUND`: on the thread pool of the async APIs,
+                waiting for the result on first access
+            `Details.NEVER`: not at all
+
+        With `Details.LAZY` and `Details.BACKGROUND`, a fetch that fails
+        raises on first access, and on every access until one succeeds:
+        lazy fetches are made again, background ones raise the same error
+
+        `detail_level` is sent as the `detailLevel` of the request envelope
+
+        With a configured `RetryPolicy`, a Pay request that may have reached
+        PayPal is only sent again if `tracking_id` is provided, and no
+        payment with that `tracking_id` exists yet.  If the lookup fails
+        otherwise, an `AdaptivePaymentsError` is raised instead
+
+        With a configured `WriteAheadJournal`, the payment is recorded
+        before it is sent and once answered, with a random `tracking_id`
+        if none is provided, so that it can be resolved with
+        `resolve_in_doubt` if the process dies in between
 
         If authorization is required, no transaction details are available
         in the response, and instead are sent to the url provided in
@@ -100,8 +159,21 @@ class AdaptivePayments(PaypalJSONAPIRequest):
                 'at the same time'
             )
 
+        cached = preapproval_key and self.configuration.preapproval_cache is not None
+        if cached:
+            preapproval = self.cached_preapproval_details(preapproval_key)
+            if preapproval is not None:
+                error = preapproval.payment_error(Receiver.total(receivers))
+                if error:
+                    raise PreapprovalError(error)
+
         url = self.config.environment.AdaptivePayments.pay_endpoint
 
+        journal = self.configuration.journal
+        if journal is not None and not tracking_id:
+            # Payments in doubt are looked up by trackingId
+            tracking_id = uuid.uuid4().hex
+
         payload = {
             'receiverList': {
                 'receiver': [receiver.as_dict() for receiver in receivers]
@@ -122,14 +194,15 @@ class AdaptivePayments(PaypalJSONAPIRequest):
             # default False
             'reverseAllParallelPaymentsOnError': reverse_all_parallel_payments_on_error,
 
-            'actionType': AdaptivePayments.ActionType.PAY,
-            'currencyCode': AdaptivePayments.CurrencyCode.USD,
-            'requestEnvelope': {
-                'errorLanguage': 'en_US',
-                'detailLevel': 'ReturnAll',
-            },
+            # actionType, currencyCode and requestEnvelope: see `pay_template`
         }
 
+        if detail_level != 'ReturnAll':
+            payload['requestEnvelope'] = {
+                'errorLanguage': 'en_US',
+                'detailLevel': detail_level,
+            }
+
         if implicit:
             payload['senderEmail'] = self.config.userid
 
@@ -141,16 +214,71 @@ class AdaptivePayments(PaypalJSONAPIRequest):
                 'customerId': customer_id,
             }
 
-        response = self.post(url, data=payload)
+        before_retry = None
+        if tracking_id:
+            def before_retry():
+                # Use the trackingId as idempotency key, so that a retry
+                # can never send the same payment twice
+                details = self.payment_details(tracking_id=tracking_id)
+                if details.success and 'payKey' in details.response:
+                    # PaymentDetails reports the status of the payment as
+                    # `status`, Pay as `paymentExecStatus`
+                    return dict(details.response, paymentExecStatus=details.response.get('status'))
+                if not details.not_found:
+                    # The payment may exist: only PayPal saying it does not
+                    # allows sending it again
+                    raise AdaptivePaymentsError(
+                        'Payment {} may have been sent, and could not be '
+                        'looked up'.format(tracking_id)
+                    )
+
+        if journal is not None:
+            journal.intent(
+                tracking_id,
+                receivers=payload['receiverList']['receiver'],
+                preapproval_key=preapproval_key,
+            )
 
-        pay_response = PayResponse(self.config, response)
+        try:
+            response = self.post(
+                url, data=payload, template=self.pay_template,
+                idempotent=False, before_retry=before_retry,
+            )
 
-        if implicit or preapproval_key:
-            # For approved payments, return transaction details directly
-            if not pay_response.payment_details:
-                pay_response.payment_details = self.payment_details(
-                    pay_response.paykey
+            pay_response = PayResponse(self.config, response)
+
+            if journal is not None:
+                journal.outcome(
+                    tracking_id,
+                    paykey=pay_response.response.get('payKey'),
+                    ack=pay_response.ack,
+                    correlation_id=pay_response.correlation_id,
                 )
+        except Exception:
+            if cached:
+                self.invalidate_preapproval(preapproval_key)
+            raise
+
+        if cached:
+            status = pay_response.response.get('paymentExecStatus')
+            if pay_response.success and status in self.counted_statuses:
+                self.count_preapproval_payment(preapproval_key, Receiver.total(receivers))
+            else:
+                # E.g. ERROR: whether it counts is up to PayPal
+                self.invalidate_preapproval(preapproval_key)
+
+        paykey = pay_response.response.get('payKey')
+        if (implicit or preapproval_key) and paykey and 'paymentInfoList' not in pay_response.response:
+            # For approved payments, provide transaction details directly
+            if details == AdaptivePayments.Details.EAGER:
+                pay_response.payment_details = self.payment_details(paykey)
+            elif details == AdaptivePayments.Details.LAZY:
+                pay_response._pending_details = lambda: self.payment_details(paykey)
+            elif details == AdaptivePayments.Details.BACKGROUND:
+                # Imported here, the async APIs wrap this module
+                from .asynchronous import AsyncAdaptivePayments
+                future = AsyncAdaptivePayments(self.config).payment_details(paykey)
+                pay_response._pending_details = future.result
 
         return pay_response
 
@@ -233,7 +361,7 @@ class AdaptivePayments(PaypalJSONAPIRequest):
 
         payload = {
             'payKey': paykey,
-            'tackingId': tracking_id,
+            'trackingId': tracking_id,
             'transactionId': transaction_id,
 
             'requestEnvelope': {
@@ -246,6 +374,77 @@ class AdaptivePayments(PaypalJSONAPIRequest):
 
         return PaymentDetails(self.config, response)
 
+    @mixedmethod
+    def payment_details_batch(
+        self, paykeys=None, tracking_ids=None,
+        max_workers=10, max_rate=None
+    ):
+        """ Retrieve payment details for many payKeys or trackingIds
+            concurrently
+
+            Generates a `BatchResult` per key as lookups complete, holding
+            either the `PaymentDetails` or the error raised for that key
+
+            At most `max_workers` lookups run at once, and at most
+            `max_rate` lookups are started per second
+
+            Usage::
+
+                for result in payment_details_batch(paykeys=paykeys, max_rate=20):
+                    if result.success:
+                        result.response.payments
+                    else:
+                        retry_later(result.key, result.error)
+
+        """
+        if paykeys is not None:
+            call = lambda paykey: self.payment_details(paykey=paykey)
+            keys = paykeys
+        else:
+            call = lambda tracking_id: self.payment_details(tracking_id=tracking_id)
+            keys = tracking_ids or ()
+
+        return batch(call, keys, max_workers=max_workers, max_rate=max_rate)
+
+    @mixedmethod
+    def resolve_in_doubt(self, max_workers=10, max_rate=None):
+        """ Resolve the payments in doubt in the configured journal, whose
+            outcome was not recorded
+
+            Payments are looked up by trackingId, generating a `BatchResult`
+            per trackingId as lookups complete.  The outcome of a payment
+            PayPal has (`payKey` and `status`), or answers it does not have
+            (`PaymentDetails.not_found`), is recorded in the journal.
+            Payments whose lookup failed otherwise, or raised, stay in doubt
+
+            Usage::
+
+                for result in AdaptivePayments.resolve_in_doubt():
+                    if result.success:
+                        result.response.paykey
+        """
+        journal = self.configuration.journal
+        if journal is None:
+            raise AdaptivePaymentsError('No journal configured')
+
+        tracking_ids = [intent['id'] for intent in journal.in_doubt()]
+        for result in self.payment_details_batch(
+            tracking_ids=tracking_ids, max_workers=max_workers, max_rate=max_rate,
+        ):
+            details = result.response
+            if result.error is None and (details.success or details.not_found):
+                journal.outcome(
+                    result.key,
+                    paykey=details.response.get('payKey'),
+                    ack=details.ack,
+                    correlation_id=details.correlation_id,
+                    status=details.response.get('status'),
+                    resolved=True,
+                )
+            yield result
+
+        journal.sync()
+
     @mixedmethod
     def preapproval(
         self, sender_email=None,
@@ -294,14 +493,10 @@ class AdaptivePayments(PaypalJSONAPIRequest):
             # "5"
             'maxNumberOfPayments': str(max_number_of_payments) if max_number_of_payments is not None else None,
 
-            'currencyCode': AdaptivePayments.CurrencyCode.USD,
-            'requestEnvelope': {
-                'errorLanguage': 'en_US',
-                'detailLevel': 'ReturnAll',
-            }
+            # currencyCode and requestEnvelope: see `preapproval_template`
         }
 
-        response = self.post(url, data=payload)
+        response = self.post(url, data=payload, template=self.preapproval_template)
 
         preapproval_response = PreapprovalResponse(self.config, response)
 
@@ -311,6 +506,10 @@ class AdaptivePayments(PaypalJSONAPIRequest):
     def preapproval_details(self, preapprovalkey):
         """ Retrieve preapproval details using a preapprovalKey
 
+            With a `preapproval_cache` configured, successful responses are
+            cached until they expire, the preapproval is cancelled or an
+            IPN notification about it is received (see `preapproval_ipn`)
+
             Usage::
 
                 preapproval_details(preapprovalkey="...")
@@ -318,6 +517,12 @@ class AdaptivePayments(PaypalJSONAPIRequest):
         """
         url = self.config.environment.AdaptivePayments.preapproval_details_endpoint
 
+        cache = self.configuration.preapproval_cache
+        if cache is not None:
+            cached = cache.get(self.cache_key(url, preapprovalkey))
+            if cached is not None:
+                return PreapprovalDetails(self.config, cached)
+
         payload = {
             'preapprovalKey': preapprovalkey,
 
@@ -329,7 +534,96 @@ class AdaptivePayments(PaypalJSONAPIRequest):
 
         response = self.post(url, data=payload)
 
-        return PreapprovalDetails(self.config, response)
+        details = PreapprovalDetails(self.config, response)
+        if cache is not None and details.success:
+            cache.set(
+                self.cache_key(url, preapprovalkey), details.response,
+                tags=[self.cache_tag(preapprovalkey)],
+            )
+        return details
+
+    @mixedmethod
+    def cached_preapproval_details(self, preapprovalkey):
+        """ Return the cached `PreapprovalDetails` of a preapprovalKey, or
+            `None` if not cached
+        """
+        cache = self.configuration.preapproval_cache
+        if cache is None:
+            return None
+
+        url = self.config.environment.AdaptivePayments.preapproval_details_endpoint
+        cached = cache.get(self.cache_key(url, preapprovalkey))
+        if cached is None:
+            return None
+        return PreapprovalDetails(self.config, cached)
+
+    # Statuses of preapproved payments counted against the preapproval
+    counted_statuses = ('COMPLETED', 'PROCESSING')
+
+    @mixedmethod
+    def count_preapproval_payment(self, preapprovalkey, amount):
+        """ Add a payment of `amount` to the cached details of a
+            preapprovalKey, so that the next payments are checked against
+            its limits without a lookup
+
+            Concurrent payments are all counted, see `MemoryCache.update`
+        """
+        cache = self.configuration.preapproval_cache
+        if cache is None:
+            return
+
+        url = self.config.environment.AdaptivePayments.preapproval_details_endpoint
+        cache.update(
+            self.cache_key(url, preapprovalkey),
+            lambda response: PreapprovalDetails(self.config, response).paid(amount),
+        )
+
+    @mixedmethod
+    def invalidate_preapproval(self, preapprovalkey):
+        """ Drop the cached details of a preapprovalKey """
+        cache = self.configuration.preapproval_cache
+        if cache is not None:
+            cache.invalidate(self.cache_tag(preapprovalkey))
+
+    @mixedmethod
+    def preapproval_ipn(self, notification):
+        """ Drop the cached details of the preapproval an IPN notification
+            is about, if any
+
+            `notification` is the dictionary of IPN variables
+
+            Usage::
+
+                # In the IPN handler, once the notification is verified
+                AdaptivePayments.preapproval_ipn(request.POST)
+
+        """
+        preapprovalkey = notification.get('preapproval_key')
+        if preapprovalkey:
+            self.invalidate_preapproval(preapprovalkey)
+
+    @mixedmethod
+    def preapproval_details_batch(
+        self, preapprovalkeys,
+        max_workers=10, max_rate=None
+    ):
+        """ Retrieve preapproval details for many preapprovalKeys
+            concurrently
+
+            Generates a `BatchResult` per key as lookups complete, see
+            `payment_details_batch`
+
+            Usage::
+
+                for result in preapproval_details_batch(preapprovalkeys):
+                    if result.success and result.response.approved:
+                        ...
+
+        """
+        return batch(
+            self.preapproval_details, preapprovalkeys,
+            max_workers=max_workers, max_rate=max_rate
+        )
 
     @mixedmethod
     def cancel_preapproval(self, preapprovalkey):
@@ -351,9 +645,12 @@ class AdaptivePayments(PaypalJSONAPIRequest):
             }
         }
 
-        response = self.post(url, data=payload)
+        try:
+            response = self.post(url, data=payload)
+        finally:
+            self.invalidate_preapproval(preapprovalkey)
 
-        return PreapprovalDetails(self.config, response)
+        return CancelPreapprovalResponse(self.config, response)
 
     @mixedmethod
     def refund(self, transaction):
@@ -376,25 +673,50 @@ class PayResponse(PaypalJSONAPIResponse):
 
     _payment_details = None
 
+    # Callable returning the payment details, set by `AdaptivePayments.pay`
+    # to resolve them lazily
+    _pending_details = None
+
     @property
     def payment_details(self):
-        if not self._payment_details:
-            try:
-                self._payment_details = PaymentDetails(self.config, self.response)
-            except PaypalAPIError:
-                """ Some responses (those requiring authorization) may not
-                have payment details available yet"""
-                pass
+        """ `PaymentDetails` of this payment, or `None` if not available
+
+        Payments requiring authorization have no details until the sender
+        completes it.  Errors fetching pending details are raised, and the
+        details stay pending
+        """
+        if self._payment_details is None:
+            if self._pending_details is not None:
+                # Only dropped once it succeeded, so that a failed fetch is
+                # not mistaken for a payment without details
+                self._payment_details = self._pending_details()
+                self._pending_details = None
+            elif 'paymentInfoList' in self.response:
+                try:
+                    self._payment_details = PaymentDetails(self.config, self.response)
+                except PaypalAPIError:
+                    pass
         return self._payment_details
 
     @payment_details.setter
     def payment_details(self, value):
+        self._pending_details = None
         self._payment_details = value
 
     @property
     def redirect(self):
-        """ Authorization redirect based on a payKey """
-        if self.payment_details:
+        """ Authorization redirect based on a payKey, unless the payment
+        does not need authorization
+        """
+        status = self.response.get('paymentExecStatus')
+        if status is None and (
+            self._payment_details is not None or
+            self._pending_details is not None or
+            'paymentInfoList' in self.response
+        ):
+            # Without a status, payments with details went through
+            return ''
+        if status not in (None, 'CREATED'):
             return ''
         return '{url}&paykey={key}'.format(
             url=self.config.environment.AdaptivePayments.authorization_redirect,
@@ -432,6 +754,17 @@ class PaymentDetails(PaypalJSONAPIResponse):
 
     _required_fields = ('payments',)
 
+    # Error id of a lookup of a payKey or trackingId PayPal has no payment for
+    not_found_error_id = '580022'
+
+    @property
+    def not_found(self):
+        """ Returns true if PayPal answered that the payment does not exist """
+        return any(
+            error.get('errorId') == self.not_found_error_id
+            for error in self.response.get('error', ())
+        )
+
     @property
     def memo(self):
         return self.response['memo']
@@ -474,6 +807,72 @@ class PreapprovalDetails(PaypalJSONAPIResponse):
         """ Returns true if this preapproval is valid and active """
         return self.response.get('status') == 'ACTIVE' and self.response.get('approved') == 'true'
 
+    def payment_error(self, amount, now=None):
+        """ Return the reason a payment of `amount` would be refused under
+        this preapproval, or `None` if it is within the known limits
+
+        Checks the status, the starting and ending dates (against `now`,
+        a naive UTC datetime defaulting to the current time), the amount
+        per payment, and the number and total amount of payments
+        """
+        response = self.response
+
+        if not self.approved:
+            return 'Preapproval is not approved and active'
+
+        if now is None:
+            now = datetime.datetime.utcnow()
+
+        starting_date = response.get('startingDate')
+        if starting_date and now < parse_datetime(starting_date):
+            return 'Preapproval starts on {}'.format(starting_date)
+
+        ending_date = response.get('endingDate')
+        if ending_date:
+            ends = parse_datetime(ending_date)
+            if len(ending_date) == 10:
+                # A plain date includes that day
+                ends += datetime.timedelta(days=1)
+            if now >= ends:
+                return 'Preapproval ended on {}'.format(ending_date)
+
+        amount = Decimal(str(amount))
+
+        max_amount = response.get('maxAmountPerPayment')
+        if max_amount and amount > Decimal(max_amount):
+            return 'Amount {} exceeds the maximum of {} per payment'.format(amount, max_amount)
+
+        max_number = response.get('maxNumberOfPayments')
+        if max_number and int(response.get('curPayments') or 0) >= int(max_number):
+            return 'Maximum number of {} payments reached'.format(max_number)
+
+        max_total = response.get('maxTotalAmountOfAllPayments')
+        if max_total:
+            total = Decimal(response.get('curPaymentsAmount') or 0) + amount
+            if total > Decimal(max_total):
+                return 'Amount {} exceeds the remaining {} of all payments'.format(
+                    amount, Decimal(max_total) - total + amount
+                )
+
+        return None
+
+    def paid(self, amount):
+        """ Return a copy of the response with a payment of `amount` added
+        to the current number and amount of payments
+        """
+        response = dict(self.response)
+        response['curPayments'] = str(int(response.get('curPayments') or 0) + 1)
+        response['curPaymentsAmount'] = str(
+            Decimal(response.get('curPaymentsAmount') or 0) + Decimal(str(amount))
+        )
+        return response
+
+
+class CancelPreapprovalResponse(PreapprovalDetails):
+    """ Response of CancelPreapproval, which carries no preapproval details """
+
+    _required_fields = ()
+
 
 class Receiver(object):
     """ Receiver of a Paypal payment """
@@ -517,3 +916,13 @@ class Receiver(object):
     @staticmethod
     def number_of_primary(receivers):
         return sum(1 for receiver in receivers if receiver.primary)
+
+    @staticmethod
+    def total(receivers):
+        """ Amount paid by the sender: that of the primary receiver for
+        chained payments, the sum of all amounts otherwise
+        """
+        for receiver in receivers:
+            if receiver.primary:
+                return Decimal(receiver.amount)
+        return sum(Decimal(receiver.amount) for receiver in receivers)
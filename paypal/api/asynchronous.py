@@ -0,0 +1,119 @@
+""" Non-blocking versions of the PayPal API requests
+
+Every method returns a `concurrent.futures.Future` resolving to the same
+response object as the blocking method, e.g. `AsyncAdaptivePayments.pay`
+resolves to a `PayResponse`.  Calls run on a thread pool and share the
+pooled connections of the configured transport.
+
+Usage::
+
+    future = AsyncAdaptivePayments.payment_details(paykey='...')
+    details = future.result()
+
+    # Under asyncio (Python 3), futures can be awaited with
+    details = await asyncio.wrap_future(future)
+"""
+import threading
+
+from concurrent import futures
+
+from . import PaypalAPI
+from .adaptive_payments import AdaptivePayments
+from .merchant import Merchant
+from .permissions import Permissions
+from ..utils import mixedmethod, bounded
+
+
+__all__ = [
+    'AsyncPaypalAPIRequest', 'AsyncAdaptivePayments', 'AsyncPermissions',
+    'AsyncMerchant', 'bounded',
+]
+
+
+def deferred(name):
+    """ Build a method submitting the blocking method `name` of
+    `AsyncPaypalAPIRequest.api` to the executor
+    """
+    def method(self, *args, **kwargs):
+        return self.submit(name, *args, **kwargs)
+
+    method.__name__ = name
+    method.__doc__ = 'Non-blocking `{}`, returns a future'.format(name)
+    return mixedmethod(method)
+
+
+class AsyncPaypalAPIRequest(PaypalAPI):
+    """ Wrapper submitting calls of a blocking `PaypalAPIRequest` subclass
+    to a thread pool
+
+    Subclasses set `api` to the blocking class and expose its methods with
+    `deferred`
+
+    The executor defaults to a thread pool shared by all async APIs, with
+    `default_max_workers` threads; pass an executor to control concurrency::
+
+        executor = ThreadPoolExecutor(max_workers=50)
+        AsyncAdaptivePayments(config, executor=executor).pay(...)
+    """
+
+    api = None
+
+    default_max_workers = 10
+
+    _executor = None
+    _default_executor = None
+    _default_executor_lock = threading.Lock()
+
+    def __init__(self, configuration=None, executor=None):
+        super(AsyncPaypalAPIRequest, self).__init__(configuration=configuration)
+        self._executor = executor
+
+    @mixedmethod
+    def executor(self):
+        if self._executor is not None:
+            return self._executor
+
+        cls = AsyncPaypalAPIRequest
+        if cls._default_executor is None:
+            with cls._default_executor_lock:
+                if cls._default_executor is None:
+                    cls._default_executor = futures.ThreadPoolExecutor(
+                        max_workers=cls.default_max_workers
+                    )
+        return cls._default_executor
+
+    @mixedmethod
+    def submit(self, name, *args, **kwargs):
+        method = getattr(self.api(self.config), name)
+        return self.executor().submit(method, *args, **kwargs)
+
+
+class AsyncAdaptivePayments(AsyncPaypalAPIRequest):
+    api = AdaptivePayments
+
+    pay = deferred('pay')
+    pay_simple = deferred('pay_simple')
+    pay_parallel = deferred('pay_parallel')
+    pay_chained = deferred('pay_chained')
+    payment_details = deferred('payment_details')
+    preapproval = deferred('preapproval')
+    preapproval_details = deferred('preapproval_details')
+    cancel_preapproval = deferred('cancel_preapproval')
+    refund = deferred('refund')
+
+
+class AsyncPermissions(AsyncPaypalAPIRequest):
+    api = Permissions
+
+    request_permissions = deferred('request_permissions')
+    get_access_token = deferred('get_access_token')
+    get_permissions = deferred('get_permissions')
+    cancel_permissions = deferred('cancel_permissions')
+
+
+class AsyncMerchant(AsyncPaypalAPIRequest):
+    api = Merchant
+
+    transaction_search = deferred('transaction_search')
+    transaction_details = deferred('transaction_details')
+
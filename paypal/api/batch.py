@@ -0,0 +1,74 @@
+""" Concurrent fan-out of many lookups against a single API method """
+from concurrent import futures
+
+from . import PaypalAPIResponse
+from .ratelimit import TokenBucket
+from ..utils import bounded
+
+
+__all__ = [
+    'BatchResult', 'batch',
+]
+
+
+class BatchResult(object):
+    """ Outcome of a single lookup in a batch
+
+    `key` is the item the lookup was made for, `response` the response
+    object if the call returned, and `error` the exception raised otherwise
+    """
+
+    def __init__(self, key, response=None, error=None):
+        self.key = key
+        self.response = response
+        self.error = error
+
+    def __repr__(self):
+        return '<BatchResult {key} {status}>'.format(
+            key=self.key,
+            status='ok' if self.success else 'failed',
+        )
+
+    @property
+    def success(self):
+        return self.error is None and self.response.success
+
+
+def batch(call, keys, max_workers=10, max_rate=None):
+    """ Run `call(key)` for every key in `keys` on a pool of `max_workers`
+    threads, generating a `BatchResult` for each key as lookups complete
+
+    `keys` is consumed lazily, so it can be a generator over a large
+    data set.  A failing lookup is reported on its own result and does not
+    stop the batch.  If producing the keys raises, or the generator is
+    closed early, lookups not started are cancelled and running ones are
+    waited for before returning.
+
+    `max_rate` caps the number of calls started per second
+    """
+    limiter = TokenBucket(max_rate, capacity=1) if max_rate else None
+
+    def lookup(key):
+        if limiter is not None:
+            limiter.acquire()
+        response = call(key)
+        # Responses are parsed lazily: parse on the worker, so that a body
+        # failing to decode is reported as the error of its own result
+        if isinstance(response, PaypalAPIResponse):
+            response.response
+        return response
+
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for key, future in bounded(
+            lambda key: executor.submit(lookup, key),
+            keys,
+            max_in_flight=max_workers,
+        ):
+            error = future.exception()
+            if error is not None:
+                yield BatchResult(key, error=error)
+            else:
+                yield BatchResult(key, response=future.result())
+    finally:
+        executor.shutdown(wait=True)
@@ -0,0 +1,230 @@
+""" Circuit breaking and load shedding per PayPal endpoint
+
+Usage::
+
+    breakers = paypal.CircuitBreakers(error_threshold=0.5, max_in_flight=20)
+    paypal.Configuration.configure(..., circuit_breakers=breakers)
+
+    try:
+        paypal.AdaptivePayments.pay(...)
+    except paypal.CircuitOpenError:
+        # PayPal is failing, don't wait for it
+"""
+import threading
+import time
+
+from . import PaypalAPIError
+
+
+__all__ = [
+    'CircuitBreakerError', 'CircuitOpenError', 'EndpointSaturatedError',
+    'CircuitBreaker', 'CircuitBreakers',
+]
+
+
+class CircuitBreakerError(PaypalAPIError):
+    """ A call was refused without contacting PayPal """
+
+    def __init__(self, message, endpoint=None):
+        super(CircuitBreakerError, self).__init__(message)
+        self.endpoint = endpoint
+
+
+class CircuitOpenError(CircuitBreakerError):
+    pass
+
+
+class EndpointSaturatedError(CircuitBreakerError):
+    pass
+
+
+class CircuitBreaker(object):
+    """ Circuit breaker and in-flight limiter for a single endpoint
+
+    Calls are tracked over a rolling `window` of seconds.  Once at least
+    `minimum_calls` were made, the circuit opens if the fraction of failed
+    calls reaches `error_threshold`, or if the fraction of calls slower
+    than `slow_call_duration` seconds reaches `slow_call_threshold`.
+
+    While open, calls fail immediately with `CircuitOpenError`.  After
+    `open_timeout` seconds, the circuit is half-open and lets
+    `half_open_probes` calls through at a time: the circuit closes when one
+    succeeds, and opens again when one fails.
+
+    If `max_in_flight` calls are already running, further calls fail
+    immediately with `EndpointSaturatedError`.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(
+        self, endpoint=None, error_threshold=0.5,
+        slow_call_duration=None, slow_call_threshold=0.5,
+        window=30, minimum_calls=20, open_timeout=30,
+        half_open_probes=1, max_in_flight=None
+    ):
+        self.endpoint = endpoint
+        self.error_threshold = error_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_threshold = slow_call_threshold
+        self.window = window
+        self.minimum_calls = minimum_calls
+        self.open_timeout = open_timeout
+        self.half_open_probes = half_open_probes
+        self.max_in_flight = max_in_flight
+
+        self.state = self.CLOSED
+        self.in_flight = 0
+
+        self._opened_at = None
+        self._probes = 0
+        # One [second, calls, errors, slow calls, total latency] per second
+        self._buckets = []
+        self._lock = threading.Lock()
+
+    def call(self, func, failed=None):
+        """ Call `func()` through the breaker
+
+        Exceptions raised by `func`, and results for which `failed(result)`
+        is true, count as failures
+        """
+        probe = self._acquire()
+
+        start = time.time()
+        try:
+            result = func()
+        except Exception:
+            self._release(probe, False, time.time() - start)
+            raise
+
+        success = failed is None or not failed(result)
+        self._release(probe, success, time.time() - start)
+        return result
+
+    def _acquire(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() - self._opened_at < self.open_timeout:
+                    raise CircuitOpenError(
+                        'Circuit open for {}'.format(self.endpoint), self.endpoint
+                    )
+                self.state = self.HALF_OPEN
+                self._probes = 0
+
+            probe = self.state == self.HALF_OPEN
+            if probe and self._probes >= self.half_open_probes:
+                raise CircuitOpenError(
+                    'Circuit half-open for {}'.format(self.endpoint), self.endpoint
+                )
+
+            if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+                raise EndpointSaturatedError(
+                    'Too many calls in flight to {}'.format(self.endpoint), self.endpoint
+                )
+
+            self.in_flight += 1
+            if probe:
+                self._probes += 1
+            return probe
+
+    def _release(self, probe, success, latency):
+        with self._lock:
+            self.in_flight -= 1
+            now = time.time()
+
+            if probe:
+                self._probes -= 1
+                if success:
+                    self.state = self.CLOSED
+                    self._buckets = []
+                else:
+                    self._open(now)
+                return
+
+            self._record(now, success, latency)
+
+            if self.state == self.CLOSED and self._tripped():
+                self._open(now)
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self._opened_at = now
+
+    def _record(self, now, success, latency):
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0, 0, 0.0])
+            while self._buckets[0][0] <= second - self.window:
+                self._buckets.pop(0)
+
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        bucket[2] += not success
+        bucket[3] += self.slow_call_duration is not None and latency >= self.slow_call_duration
+        bucket[4] += latency
+
+    def _totals(self):
+        oldest = int(time.time()) - self.window
+        calls = errors = slow = 0
+        latency = 0.0
+        for second, bucket_calls, bucket_errors, bucket_slow, bucket_latency in self._buckets:
+            if second > oldest:
+                calls += bucket_calls
+                errors += bucket_errors
+                slow += bucket_slow
+                latency += bucket_latency
+        return calls, errors, slow, latency
+
+    def _tripped(self):
+        calls, errors, slow, _ = self._totals()
+        if calls < self.minimum_calls:
+            return False
+        return (
+            float(errors) / calls >= self.error_threshold or
+            float(slow) / calls >= self.slow_call_threshold
+        )
+
+    def metrics(self):
+        """ Return a dictionary describing the state of the breaker """
+        with self._lock:
+            calls, errors, slow, latency = self._totals()
+            return {
+                'endpoint': self.endpoint,
+                'state': self.state,
+                'in_flight': self.in_flight,
+                'calls': calls,
+                'error_rate': float(errors) / calls if calls else 0.0,
+                'slow_call_rate': float(slow) / calls if calls else 0.0,
+                'mean_latency': latency / calls if calls else 0.0,
+            }
+
+
+class CircuitBreakers(object):
+    """ A `CircuitBreaker` per endpoint url, created on first use with the
+    settings passed to `CircuitBreakers`
+    """
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self._breakers[endpoint] = CircuitBreaker(
+                        endpoint, **self.settings
+                    )
+        return breaker
+
+    def metrics(self):
+        """ Return the metrics of every breaker, keyed on endpoint url """
+        return dict(
+            (endpoint, breaker.metrics())
+            for endpoint, breaker in self._breakers.items()
+        )
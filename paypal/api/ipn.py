@@ -0,0 +1,382 @@
+""" Instant Payment Notifications (IPN): parsing, verification with PayPal,
+de-duplication and dispatch to handlers
+
+Usage::
+
+    ipn = paypal.IPNHandler(
+        deduplicator=paypal.IPNDeduplicator('/var/lib/myapp/ipn.db'),
+    )
+
+    @ipn.on('Adaptive Payment PAY')
+    def payment(message):
+        message['pay_key'], message['transaction'][0]['status']
+
+    # In the view PayPal posts notifications to
+    result = ipn.handle(request.body)
+
+    # Or many at a time, e.g. from a queue
+    for result in ipn.process(bodies):
+        if result.status == paypal.IPNResult.FAILED:
+            ...
+
+Every verified notification is also passed to
+`AdaptivePayments.preapproval_ipn`, dropping the cached details of the
+preapproval it is about
+"""
+import codecs
+import hashlib
+import itertools
+import logging
+import time
+from urllib import unquote_plus
+
+from . import PaypalAPI, PaypalAPIError, PaypalAPIRequest, PaypalAPIResponse
+from .adaptive_payments import AdaptivePayments
+from .batch import batch
+from .ratelimit import TokenBucket
+from ..utils import mixedmethod, sqlite_connection, sqlite_transaction
+
+
+__all__ = [
+    'IPNError', 'IPNMessage', 'parse_ipn', 'IPN', 'IPNVerification',
+    'IPNDeduplicator', 'IPNResult', 'IPNHandler',
+]
+
+
+class IPNError(PaypalAPIError):
+    pass
+
+
+class IPNMessage(dict):
+    """ Variables of a notification, along with the `raw` body they were
+    parsed from, which is posted back to PayPal to verify it
+    """
+
+    def __init__(self, raw, *args, **kwargs):
+        super(IPNMessage, self).__init__(*args, **kwargs)
+        self.raw = raw
+
+    @property
+    def track_id(self):
+        return self.get('ipn_track_id')
+
+    @property
+    def transaction_type(self):
+        # `transaction_type` for Adaptive Payments, `txn_type` otherwise
+        return self.get('transaction_type') or self.get('txn_type')
+
+    @property
+    def key(self):
+        """ Key of the notification, identical when PayPal sends it again:
+        its `ipn_track_id`, or a digest of its body if it has none (e.g.
+        Adaptive Payments notifications)
+        """
+        return self.track_id or hashlib.sha1(self.raw).hexdigest()
+
+
+def form_pairs(body):
+    """ Generate the unquoted `(name, value)` pairs of a form-encoded body """
+    if '%00' in body or '%01' in body:
+        for pair in body.split('&'):
+            if pair:
+                name, _, value = pair.partition('=')
+                yield unquote_plus(name), unquote_plus(value)
+        return
+
+    # Unquoting the whole body at once is several times faster than pair by
+    # pair.  Separators are swapped beforehand for characters that are not
+    # unquoted from the body
+    for pair in unquote_plus(body.replace('&', '\0').replace('=', '\1')).split('\0'):
+        if pair:
+            name, _, value = pair.partition('\1')
+            if '\1' in value:
+                value = value.replace('\1', '=')
+            yield name, value
+
+
+def parse_ipn(body):
+    """ Parse the form-encoded `body` of a notification into an `IPNMessage`
+
+    Variables of arrays, e.g. `transaction[0].amount`, are collected in a
+    list of dictionaries under the array name, in index order, e.g.
+    `message['transaction'][0]['amount']`.  Values are decoded with the
+    `charset` of the notification
+    """
+    pairs = list(form_pairs(body))
+
+    charset = 'windows-1252'
+    for key, value in pairs:
+        if key == 'charset':
+            charset = value
+            break
+
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'windows-1252'
+
+    message = IPNMessage(body)
+    arrays = {}
+    for key, value in pairs:
+        value = value.decode(charset, 'replace')
+        if '[' in key and not key.endswith(']'):
+            # name[index].field
+            name, _, element = key.partition('[')
+            index, _, field = element.partition('].')
+            if index.isdigit() and field:
+                arrays.setdefault(name, {}).setdefault(int(index), {})[field] = value
+                continue
+        message[key] = value
+
+    for name, items in arrays.iteritems():
+        message[name] = [items[index] for index in sorted(items)]
+
+    return message
+
+
+# Standard headers of verification requests, must not be modified
+IPN_HEADERS = {
+    'Content-Type': 'application/x-www-form-urlencoded',
+}
+
+
+class IPN(PaypalAPIRequest):
+
+    @mixedmethod
+    def headers(self):
+        return IPN_HEADERS
+
+    @mixedmethod
+    def verify(self, message):
+        """ Post a notification back to PayPal, returning an
+        `IPNVerification`, successful if PayPal sent the notification
+        """
+        url = self.config.environment.IPN.verify_endpoint
+
+        response = self.post(url, body=b'cmd=_notify-validate&' + message.raw)
+
+        return IPNVerification(self.config, response)
+
+    @mixedmethod
+    def verify_batch(self, messages, max_workers=10, max_rate=None):
+        """ Verify many notifications concurrently over the pooled
+        connections of the transport
+
+        Generates a `BatchResult` per message as verifications complete
+        """
+        return batch(self.verify, messages, max_workers=max_workers, max_rate=max_rate)
+
+
+class IPNVerification(PaypalAPIResponse):
+    """ Answer of PayPal to a notification posted back, `VERIFIED` or
+    `INVALID`
+    """
+
+    def parse_response(self, response):
+        return response.content.strip()
+
+    def validate_response(self):
+        if self._response not in ('VERIFIED', 'INVALID'):
+            logging.debug('%s', self._response)
+            raise PaypalAPIError(
+                'Failed parsing PayPal response'
+            )
+
+    def log_response(self):
+        if not self.success:
+            logging.warning('IPN verification failed: %s', self._response)
+
+    @property
+    def ack(self):
+        return self.response
+
+    @property
+    def correlation_id(self):
+        return None
+
+    @property
+    def timestamp(self):
+        return None
+
+    @property
+    def success(self):
+        return self.ack == 'VERIFIED'
+
+
+class IPNDeduplicator(object):
+    """ Index of the notifications already received, stored in the SQLite
+    database at `path`, shared by every process and thread using the same
+    `path`
+
+    Keeps the keys of the `max_size` notifications claimed last.  PayPal
+    sends a notification again until it is acknowledged, for up to 4 days
+    """
+
+    def __init__(self, path, max_size=1000000):
+        self.path = path
+        self.max_size = max_size
+
+    def connection(self):
+        return sqlite_connection(
+            self.path,
+            # A key lost in a power failure only lets a duplicate through
+            'PRAGMA journal_mode = WAL',
+            'PRAGMA synchronous = NORMAL',
+            'CREATE TABLE IF NOT EXISTS ipn_keys (key TEXT PRIMARY KEY, claimed REAL)',
+        )
+
+    def __len__(self):
+        return self.connection().execute('SELECT COUNT(*) FROM ipn_keys').fetchone()[0]
+
+    def __contains__(self, key):
+        return self.connection().execute(
+            'SELECT 1 FROM ipn_keys WHERE key = ?', (key,)
+        ).fetchone() is not None
+
+    def claim(self, keys):
+        """ Record notification `keys`, returning for each key whether it
+        was new
+        """
+        now = time.time()
+
+        with sqlite_transaction(self.connection()) as connection:
+            fresh = [
+                connection.execute(
+                    'INSERT OR IGNORE INTO ipn_keys (key, claimed) VALUES (?, ?)', (key, now)
+                ).rowcount == 1
+                for key in keys
+            ]
+            # Rowids grow with every insert, drop the oldest keys
+            connection.execute(
+                'DELETE FROM ipn_keys WHERE rowid <= (SELECT MAX(rowid) FROM ipn_keys) - ?',
+                (self.max_size,)
+            )
+        return fresh
+
+    def release(self, key):
+        """ Forget a notification key, e.g. when handling it failed, so
+        that it is handled when PayPal sends it again
+        """
+        self.connection().execute('DELETE FROM ipn_keys WHERE key = ?', (key,))
+
+
+class IPNResult(object):
+    """ Outcome of a notification: `status` is one of
+
+        `HANDLED`: verified and passed to every handler
+        `DUPLICATE`: already received, skipped
+        `INVALID`: PayPal did not send it
+        `FAILED`: verification or a handler raised `error`; the
+            notification is not recorded as received, so that it is handled
+            when PayPal sends it again
+    """
+
+    HANDLED = 'handled'
+    DUPLICATE = 'duplicate'
+    INVALID = 'invalid'
+    FAILED = 'failed'
+
+    def __init__(self, message, status, error=None):
+        self.message = message
+        self.status = status
+        self.error = error
+
+    def __repr__(self):
+        return '<IPNResult {key} {status}>'.format(key=self.message.key, status=self.status)
+
+
+class IPNHandler(PaypalAPI):
+    """ Parses, verifies, de-duplicates and dispatches notifications to the
+    handlers registered with `on`
+
+    Without a `deduplicator`, every notification is handled.  Notifications
+    are only claimed once PayPal verified them, so that forged
+    notifications can't shadow genuine ones.  With `verify=False`,
+    notifications are not posted back to PayPal, e.g. when they were
+    verified before being queued.  `process` verifies up to `max_workers`
+    notifications at once, at most `max_rate` per second
+    """
+
+    def __init__(
+        self, configuration=None, deduplicator=None, verify=True,
+        max_workers=10, max_rate=None
+    ):
+        super(IPNHandler, self).__init__(configuration=configuration)
+        self.deduplicator = deduplicator
+        self.verify = verify
+        self.max_workers = max_workers
+
+        self._limiter = TokenBucket(max_rate, capacity=1) if max_rate else None
+
+        # Transaction type (`None` for every notification) -> handlers
+        self.handlers = {}
+        self.on(None, self.preapproval_ipn)
+
+    def on(self, transaction_type=None, handler=None):
+        """ Call `handler(message)` for every verified notification of
+        `transaction_type`, or every notification if `None`
+
+        Without `handler`, returns a decorator registering the function
+        """
+        if handler is None:
+            return lambda handler: self.on(transaction_type, handler) or handler
+
+        self.handlers.setdefault(transaction_type, []).append(handler)
+
+    def preapproval_ipn(self, message):
+        AdaptivePayments(self.config).preapproval_ipn(message)
+
+    def handle(self, body):
+        """ Handle a single notification body, returning its `IPNResult` """
+        return self.receive(parse_ipn(body))
+
+    def process(self, bodies):
+        """ Handle a stream of notification bodies, generating an `IPNResult`
+        per notification as they complete
+
+        `bodies` is consumed lazily
+        """
+        messages = itertools.imap(parse_ipn, bodies)
+        for outcome in batch(self.receive, messages, max_workers=self.max_workers):
+            if outcome.error is not None:
+                yield IPNResult(outcome.key, IPNResult.FAILED, outcome.error)
+            else:
+                yield outcome.response
+
+    def receive(self, message):
+        """ Verify, claim and dispatch a parsed notification, returning its
+        `IPNResult`
+        """
+        deduplicator = self.deduplicator
+        # Skip the postback of notifications already handled
+        if deduplicator is not None and message.key in deduplicator:
+            return IPNResult(message, IPNResult.DUPLICATE)
+
+        try:
+            if self.verify:
+                if self._limiter is not None:
+                    self._limiter.acquire()
+                if not IPN(self.config).verify(message).success:
+                    return IPNResult(message, IPNResult.INVALID)
+        except Exception as e:
+            logging.exception('Failed verifying IPN %s', message.key)
+            return IPNResult(message, IPNResult.FAILED, error=e)
+
+        if deduplicator is not None:
+            fresh, = deduplicator.claim([message.key])
+            if not fresh:
+                return IPNResult(message, IPNResult.DUPLICATE)
+
+        try:
+            for handler in itertools.chain(
+                self.handlers.get(None, ()),
+                self.handlers.get(message.transaction_type, ()),
+            ):
+                handler(message)
+        except Exception as e:
+            logging.exception('Failed handling IPN %s', message.key)
+            if deduplicator is not None:
+                deduplicator.release(message.key)
+            return IPNResult(message, IPNResult.FAILED, error=e)
+
+        return IPNResult(message, IPNResult.HANDLED)
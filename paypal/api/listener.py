@@ -0,0 +1,488 @@
+""" HTTP listener acknowledging IPN notifications at once, and handling them
+from a bounded queue on a pool of workers
+
+Usage::
+
+    handler = paypal.IPNHandler(
+        deduplicator=paypal.IPNDeduplicator('/var/lib/myapp/ipn.db'),
+    )
+
+    @handler.on('Adaptive Payment PAY')
+    def payment(message):
+        ...
+
+    listener = paypal.IPNListener(
+        handler,
+        queue=paypal.SQLiteIPNQueue('/var/lib/myapp/ipn-queue.db'),
+        address=('0.0.0.0', 8080),
+    )
+    listener.serve_forever()
+
+    # Metrics, also served as JSON by GET /metrics
+    listener.metrics()
+    # {'depth': 3, 'accepted': 1200, 'rejected': 0,
+    #  'statuses': {'handled': 1180, 'duplicate': 20}, 'dead_letters': 0,
+    #  'wait': {'p50': 0.002, 'p99': 0.08, ...}, ...}
+
+PayPal only waits for the notification to be acknowledged with a 200, and
+sends it again otherwise.  The listener answers as soon as the notification
+is queued, so acknowledgements don't wait on the verification postback
+nor on the handlers.  When the queue is full, notifications are answered
+with a 503 for PayPal to send them again later, rather than piling up.
+
+Acknowledged notifications that fail to be handled are retried by the
+listener, `max_attempts` times at most with growing delays, and then kept
+as dead letters: PayPal won't send them again.  With a `SQLiteIPNQueue`,
+queued notifications and dead letters survive restarts
+
+    for item in listener.queue.dead_letters():
+        item.body, item.error
+"""
+import BaseHTTPServer
+import SocketServer
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from .ipn import IPNResult
+from ..instrumentation import Histogram
+from ..utils import sqlite_connection, sqlite_transaction
+
+
+__all__ = [
+    'IPNQueueItem', 'MemoryIPNQueue', 'SQLiteIPNQueue', 'IPNListener',
+]
+
+
+class IPNQueueItem(object):
+    """ Notification `body` queued at the `received` time, already handled
+    `attempts` times.  Dead letters carry the last `error` handling them
+    """
+
+    def __init__(self, id, body, received, attempts=0, error=None):
+        self.id = id
+        self.body = body
+        self.received = received
+        self.attempts = attempts
+        self.error = error
+
+    def __repr__(self):
+        return '<IPNQueueItem {id} attempts={attempts}>'.format(
+            id=self.id, attempts=self.attempts,
+        )
+
+
+class MemoryIPNQueue(object):
+    """ Queue of at most `maxsize` notifications in memory, lost on exit
+
+    Items are taken once due, in order of arrival
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+
+        # (due, id, item)
+        self._heap = []
+        self._ids = itertools.count()
+        self._ready = threading.Condition()
+        self._closed = False
+        self._dead = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def put(self, body):
+        """ Queue a notification body, returning `False` if the queue is
+        full
+        """
+        with self._ready:
+            if len(self._heap) >= self.maxsize:
+                return False
+            now = time.time()
+            self._push(IPNQueueItem(next(self._ids), body, now), now)
+        return True
+
+    def get(self):
+        """ Take the next due item, waiting for one, or return `None` once
+        the queue is closed
+        """
+        with self._ready:
+            while not self._closed:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                self._ready.wait(self._heap[0][0] - now if self._heap else None)
+        return None
+
+    def retry(self, item, delay):
+        """ Queue an item taken with `get` again, due in `delay` seconds.
+        Retries are queued even if the queue is full
+        """
+        item.attempts += 1
+        with self._ready:
+            self._push(item, time.time() + delay)
+
+    def done(self, item):
+        """ Drop an item taken with `get` for good """
+
+    def dead(self, item, error):
+        """ Keep an item taken with `get` which failed for good as a dead
+        letter, with the last `error` handling it
+        """
+        item.attempts += 1
+        item.error = '{!r}'.format(error)
+        with self._ready:
+            self._dead.append(item)
+
+    def dead_letters(self):
+        """ Return the dead letters, oldest first """
+        with self._ready:
+            return list(self._dead)
+
+    def count_dead_letters(self):
+        """ Return the number of dead letters """
+        return len(self._dead)
+
+    def close(self):
+        """ Wake up every `get`, returning `None` from now on """
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+
+    def _push(self, item, due):
+        heapq.heappush(self._heap, (due, item.id, item))
+        self._ready.notify()
+
+
+class SQLiteIPNQueue(MemoryIPNQueue):
+    """ Queue of at most `maxsize` notifications in the SQLite database at
+    `path`, synced to disk before notifications are acknowledged
+
+    Items taken but not done when the process stopped are queued again when
+    the queue is opened.  A queue must only be used by one process at a
+    time
+    """
+
+    statements = (
+        # Notifications are acknowledged once committed: they must survive
+        # a power failure
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = FULL',
+        'CREATE TABLE IF NOT EXISTS ipn_queue '
+        '(id INTEGER PRIMARY KEY AUTOINCREMENT, body BLOB, received REAL, '
+        'attempts INTEGER, due REAL)',
+        'CREATE TABLE IF NOT EXISTS ipn_dead_letters '
+        '(id INTEGER PRIMARY KEY, body BLOB, received REAL, attempts INTEGER, '
+        'failed REAL, error TEXT)',
+    )
+
+    def __init__(self, path, maxsize=100000):
+        super(SQLiteIPNQueue, self).__init__(maxsize=maxsize)
+        self.path = path
+
+        # Due times of the items, mirrored in memory so that workers wait
+        # on them like on a `MemoryIPNQueue`
+        for id, due in self.connection().execute('SELECT id, due FROM ipn_queue'):
+            self._heap.append((due, id, id))
+        heapq.heapify(self._heap)
+
+        # Puts holding a slot of the queue while their item is written
+        self._reserved = 0
+
+        # The server answers every request on a new thread: rather than
+        # opening a connection per notification, they are written on a
+        # single connection, one at a time
+        self._writer = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        for statement in self.statements:
+            self._writer.execute(statement)
+        self._writing = threading.Lock()
+
+    def connection(self):
+        return sqlite_connection(self.path, *self.statements)
+
+    def put(self, body):
+        with self._ready:
+            if len(self._heap) + self._reserved >= self.maxsize:
+                return False
+            self._reserved += 1
+
+        try:
+            now = time.time()
+            with self._writing:
+                id = self._writer.execute(
+                    'INSERT INTO ipn_queue (body, received, attempts, due) VALUES (?, ?, 0, ?)',
+                    (sqlite3.Binary(body), now, now)
+                ).lastrowid
+        except Exception:
+            with self._ready:
+                self._reserved -= 1
+            raise
+
+        with self._ready:
+            self._reserved -= 1
+            self._push(id, now)
+        return True
+
+    def get(self):
+        id = super(SQLiteIPNQueue, self).get()
+        if id is None:
+            return None
+
+        body, received, attempts = self.connection().execute(
+            'SELECT body, received, attempts FROM ipn_queue WHERE id = ?', (id,)
+        ).fetchone()
+        return IPNQueueItem(id, bytes(body), received, attempts)
+
+    def retry(self, item, delay):
+        item.attempts += 1
+        due = time.time() + delay
+        self.connection().execute(
+            'UPDATE ipn_queue SET attempts = ?, due = ? WHERE id = ?',
+            (item.attempts, due, item.id)
+        )
+        with self._ready:
+            self._push(item.id, due)
+
+    def done(self, item):
+        self.connection().execute('DELETE FROM ipn_queue WHERE id = ?', (item.id,))
+
+    def dead(self, item, error):
+        item.attempts += 1
+        item.error = '{!r}'.format(error)
+        with sqlite_transaction(self.connection()) as connection:
+            connection.execute(
+                'INSERT INTO ipn_dead_letters (id, body, received, attempts, failed, error) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (item.id, sqlite3.Binary(item.body), item.received, item.attempts,
+                 time.time(), item.error)
+            )
+            connection.execute('DELETE FROM ipn_queue WHERE id = ?', (item.id,))
+
+    def dead_letters(self):
+        return [
+            IPNQueueItem(id, bytes(body), received, attempts, error)
+            for id, body, received, attempts, error in self.connection().execute(
+                'SELECT id, body, received, attempts, error FROM ipn_dead_letters ORDER BY id'
+            )
+        ]
+
+    def count_dead_letters(self):
+        # Called by the server for metrics, like puts on a new thread
+        with self._writing:
+            return self._writer.execute('SELECT COUNT(*) FROM ipn_dead_letters').fetchone()[0]
+
+    def _push(self, id, due):
+        heapq.heappush(self._heap, (due, id, id))
+        self._ready.notify()
+
+
+class IPNRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Answers are written at once when flushed, rather than stalled by
+    # delayed acknowledgements
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        listener = self.server.listener
+        length = self.headers.getheader('Content-Length')
+
+        # The body is left unread, so the connection can't be reused
+        if self.path.split('?', 1)[0] != listener.path:
+            self.close_connection = True
+            return self.answer(404)
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            return self.answer(411)
+        if int(length) > listener.max_body_size:
+            self.close_connection = True
+            return self.answer(413)
+
+        body = self.rfile.read(int(length))
+        if listener.accept(body):
+            self.answer(200)
+        else:
+            # PayPal sends the notification again later
+            self.answer(503, headers={'Retry-After': str(listener.retry_after)})
+
+    def do_GET(self):
+        listener = self.server.listener
+        if listener.metrics_path is None or self.path != listener.metrics_path:
+            return self.answer(404)
+
+        self.answer(200, json.dumps(listener.metrics()), {'Content-Type': 'application/json'})
+
+    def answer(self, status, content='', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logging.debug('IPN listener: ' + format, *args)
+
+
+class IPNHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class IPNListener(object):
+    """ Server accepting notifications posted to `path` at `address`, and
+    handling them with `handler`, an `IPNHandler`, on `workers` threads
+
+    `queue` defaults to a `MemoryIPNQueue`.  `workers` defaults to the
+    `max_workers` of the handler.  Notifications failing to be handled are
+    retried after `retry_delay` seconds, doubling with every attempt, and
+    kept as dead letters of the queue after `max_attempts`.
+    Notifications rejected because the queue is full are answered with a
+    `Retry-After` of `retry_after` seconds.  Metrics are served at
+    `metrics_path`, unless `None`
+    """
+
+    def __init__(
+        self, handler, queue=None, address=('127.0.0.1', 8080), path='/ipn',
+        workers=None, max_attempts=5, retry_delay=30, retry_after=60,
+        metrics_path='/metrics', max_body_size=64 * 1024
+    ):
+        self.handler = handler
+        self.queue = queue if queue is not None else MemoryIPNQueue()
+        self.address = address
+        self.path = path
+        self.workers = workers or handler.max_workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_after = retry_after
+        self.metrics_path = metrics_path
+        self.max_body_size = max_body_size
+
+        # Time spent queued, handling, and from receipt to the end of the
+        # last attempt
+        self.wait_time = Histogram()
+        self.handling_time = Histogram()
+        self.latency = Histogram()
+
+        self._counts = {'accepted': 0, 'rejected': 0, 'retried': 0, 'dead': 0}
+        self._statuses = {}
+        self._lock = threading.Lock()
+
+        self._httpd = None
+        self._threads = []
+
+    def __repr__(self):
+        return '<IPNListener {url} depth={depth}>'.format(url=self.url(), depth=len(self.queue))
+
+    def url(self):
+        host, port = self._httpd.server_address if self._httpd else self.address
+        return 'http://{host}:{port}{path}'.format(host=host, port=port, path=self.path)
+
+    def accept(self, body):
+        """ Queue a notification body, returning `False` if the queue is
+        full
+        """
+        accepted = self.queue.put(body)
+        self.count('accepted' if accepted else 'rejected')
+        return accepted
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def metrics(self):
+        """ Return the queue depth, the number of dead letters, counts of
+        notifications, and summaries of the time they spent queued, being
+        handled, and in total
+        """
+        with self._lock:
+            metrics = dict(self._counts, statuses=dict(self._statuses))
+        metrics['depth'] = len(self.queue)
+        metrics['dead_letters'] = self.queue.count_dead_letters()
+        metrics['wait'] = self.wait_time.summary()
+        metrics['handling'] = self.handling_time.summary()
+        metrics['latency'] = self.latency.summary()
+        return metrics
+
+    def work(self):
+        """ Handle queued notifications until the queue is closed """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            start = time.time()
+            self.wait_time.record(max(start - item.received, 0))
+            try:
+                result = self.handler.handle(item.body)
+            except Exception as e:
+                logging.exception('Failed handling queued IPN %s', item.id)
+                status, error = IPNResult.FAILED, e
+            else:
+                status, error = result.status, result.error
+            end = time.time()
+            self.handling_time.record(end - start)
+            self.latency.record(max(end - item.received, 0))
+
+            with self._lock:
+                self._statuses[status] = self._statuses.get(status, 0) + 1
+
+            if status != IPNResult.FAILED:
+                self.queue.done(item)
+            elif item.attempts + 1 < self.max_attempts:
+                self.count('retried')
+                self.queue.retry(item, self.retry_delay * 2 ** item.attempts)
+            else:
+                self.count('dead')
+                logging.error(
+                    'Keeping IPN %s as a dead letter after %s attempts: %s',
+                    item.id, item.attempts + 1, error
+                )
+                self.queue.dead(item, error)
+
+    def start(self):
+        """ Start serving and handling notifications in background threads """
+        self._httpd = IPNHTTPServer(self.address, IPNRequestHandler)
+        self._httpd.listener = self
+
+        self._threads = [threading.Thread(target=self.work) for _ in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._httpd.serve_forever))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        """ Stop accepting notifications, and wait for the workers to finish
+        the notifications they are handling.  Queued notifications are only
+        kept by a `SQLiteIPNQueue`
+        """
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self.queue.close()
+        for thread in self._threads:
+            thread.join()
+
+    def serve_forever(self):
+        """ Serve until interrupted """
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,9 +1,27 @@
+import datetime
+import itertools
+import logging
+from array import array
+from collections import deque
+from decimal import Decimal
+
+from concurrent import futures
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from . import PaypalNVPAPIRequest, PaypalNVPAPIResponse, PaypalAPIError
-from ..utils import mixedmethod, oauth_header
+from ..utils import (
+    mixedmethod, parse_datetime, record_type,
+    parse_cents, parse_epoch, INT64,
+)
 
 
 __all__ = [
     'Merchant', 'MerchantError', 'TransactionSearchResponse',
+    'TransactionColumns',
 ]
 
 
@@ -46,19 +64,155 @@ class Merchant(PaypalNVPAPIRequest):
             'INVNUM': inv_num,
         }
 
-        headers = oauth_header(
-            self.configuration.userid,
-            self.configuration.password,
-            token,
-            token_secret,
-            'POST',
-            url,
-        )
+        headers = self.configuration.oauth_signer(token, token_secret).header('POST', url)
 
         response = self.post(url, data=payload, headers=headers)
 
         return TransactionSearchResponse(self.config, response)
 
+    @mixedmethod
+    def transaction_search_all(
+        self, token, token_secret,
+        start_date, end_date=None, window=None, max_workers=4,
+        **filters
+    ):
+        """ Generate every transaction between `start_date` and `end_date`
+        (default now), working around the 100 row limit of TransactionSearch
+
+        The date range is searched in windows of `window` (a positive
+        `timedelta` of at least a second, default the whole range).  Windows
+        whose result was truncated by PayPal are split in two and searched
+        again, until every window fits in a single response.  Up to
+        `max_workers` windows are searched concurrently, and transactions are
+        generated window by window in chronological order, so memory use does
+        not grow with the range.  A window PayPal fails to search raises
+        `MerchantError`
+
+        `filters` are passed on to `transaction_search`
+
+        Usage::
+
+            for transaction in Merchant.transaction_search_all(
+                token, token_secret,
+                start_date=datetime(2014, 10, 1),
+                end_date=datetime(2014, 11, 1),
+                window=timedelta(days=1),
+            ):
+                transaction['TRANSACTIONID']
+
+        """
+        second = datetime.timedelta(seconds=1)
+
+        if window is not None and window <= datetime.timedelta(0):
+            raise MerchantError('Search window must be positive')
+
+        start_date = start_date.replace(microsecond=0)
+        end_date = (end_date or datetime.datetime.utcnow()).replace(microsecond=0)
+        # Windows are searched by the second, both ends included
+        window = max(window or (end_date - start_date), second)
+
+        def windows():
+            start = start_date
+            while start <= end_date:
+                end = min(start + window - second, end_date)
+                yield start, end
+                start = end + second
+
+        def search(start, end):
+            return self.transaction_search(
+                token, token_secret,
+                start_date=start, end_date=end,
+                **filters
+            )
+
+        executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        # `(start, end, future)` of the windows to generate in order, with no
+        # future until submitted
+        pending = deque()
+        upcoming = windows()
+
+        def submit():
+            """ Submit pending windows in order, then upcoming ones, keeping
+            at most `max_workers` searches in flight
+            """
+            in_flight = sum(1 for _, _, future in pending if future is not None)
+            for i in range(len(pending)):
+                if in_flight >= max_workers:
+                    return
+                start, end, future = pending[i]
+                if future is None:
+                    pending[i] = (start, end, executor.submit(search, start, end))
+                    in_flight += 1
+
+            while in_flight < max_workers:
+                try:
+                    start, end = next(upcoming)
+                except StopIteration:
+                    return
+                pending.append((start, end, executor.submit(search, start, end)))
+                in_flight += 1
+
+        def key(transaction):
+            """ Identify a transaction by its id, or by its whole row
+            without one
+            """
+            transaction_id = transaction.get('TRANSACTIONID')
+            if transaction_id is not None:
+                return transaction_id
+            return tuple(sorted(transaction.items()))
+
+        # Keys of the transactions of the previous and current windows, to
+        # skip transactions PayPal returns for both sides of a boundary
+        previous, current = set(), set()
+
+        try:
+            while True:
+                submit()
+                if not pending:
+                    break
+
+                start, end, future = pending.popleft()
+                response = future.result()
+
+                # A failed window would silently leave out its transactions
+                if response.ack not in ('Success', 'SuccessWithWarning') and not response.truncated:
+                    errors = zip(
+                        response.error_codes,
+                        response.collapsed_response.get('L_LONGMESSAGE', []),
+                    )
+                    raise MerchantError('TransactionSearch from {} to {} failed ({}): {}'.format(
+                        start.isoformat(), end.isoformat(), response.ack,
+                        '; '.join('{} {}'.format(code, message) for code, message in errors),
+                    ))
+
+                if response.truncated:
+                    if end - start >= second:
+                        middle = start + datetime.timedelta(
+                            seconds=int((end - start).total_seconds()) // 2
+                        )
+                        pending.appendleft((middle + second, end, None))
+                        pending.appendleft((start, middle, None))
+                        continue
+
+                    logging.warning(
+                        'TransactionSearch truncated within a single second at %s', start
+                    )
+
+                previous, current = current, set()
+                for transaction in response.transactions:
+                    transaction_key = key(transaction)
+                    if transaction_key in previous or transaction_key in current:
+                        continue
+                    current.add(transaction_key)
+                    yield transaction
+        finally:
+            # Searches are read-only: drop those not started, without
+            # waiting for the running ones
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+            executor.shutdown(wait=False)
+
     @mixedmethod
     def transaction_details(
         self, token, token_secret,
@@ -74,14 +228,7 @@ class Merchant(PaypalNVPAPIRequest):
             'TRANSACTIONID': transaction_id,
         }
 
-        headers = oauth_header(
-            self.configuration.userid,
-            self.configuration.password,
-            token,
-            token_secret,
-            'POST',
-            url,
-        )
+        headers = self.configuration.oauth_signer(token, token_secret).header('POST', url)
 
         response = self.post(url, data=payload, headers=headers)
 
@@ -90,11 +237,162 @@ class Merchant(PaypalNVPAPIRequest):
 
 class TransactionSearchResponse(PaypalNVPAPIResponse):
 
+    # PayPal warning code for searches matching more than 100 transactions
+    TRUNCATED = '11002'
+
+    # Conversions applied to transaction fields by `records`
+    field_types = {
+        'TIMESTAMP': parse_datetime,
+        'AMT': Decimal,
+        'FEEAMT': Decimal,
+        'NETAMT': Decimal,
+    }
+
     @property
     def transactions(self):
         """ Generates transaction dicts based on zipped arrays in the response """
         return self.zipped_response()
 
+    def records(self, typed=True):
+        """ Generates compact transaction records based on the arrays
+        in the response
+
+        Records are namedtuples of a type shared by all responses with the
+        same fields, with attributes named as the keys of `transactions`.
+        If `typed`, amounts are converted to `Decimal` and timestamps to UTC
+        `datetime` according to `field_types`
+
+        Usage::
+
+            for record in response.records():
+                record.TRANSACTIONID, record.AMT
+                record.as_dict()
+        """
+        columns = sorted(
+            (key[2:], values)
+            for key, values in self.collapsed_response.iteritems()
+            if isinstance(values, list) and key not in self.error_arrays
+        )
+        record = record_type(field for field, _ in columns)
+
+        if typed:
+            converted = []
+            for field, values in columns:
+                convert = self.field_types.get(field)
+                if convert is not None:
+                    values = [None if value is None else convert(value) for value in values]
+                converted.append((field, values))
+            columns = converted
+
+        return itertools.imap(
+            record._make,
+            itertools.izip(*(values for _, values in columns))
+        )
+
+    def columns(self):
+        """ Returns the transactions as `TransactionColumns`, built
+        directly from the collapsed arrays of the response
+        """
+        return TransactionColumns(dict(
+            (key[2:], values)
+            for key, values in self.collapsed_response.iteritems()
+            if isinstance(values, list) and key not in self.error_arrays
+        ))
+
+    @property
+    def truncated(self):
+        """ Returns true if PayPal left out transactions matching the search """
+        return self.TRUNCATED in self.error_codes
+
+
+class TransactionColumns(object):
+    """ Column-oriented view of transaction search results
+
+    Holds a list of values per transaction field, taken as-is from the
+    collapsed arrays of one or more `TransactionSearchResponse`, and
+    converts amount and timestamp columns to integer arrays on demand
+
+    Usage::
+
+        columns = TransactionColumns.concatenate(
+            response.columns() for response in responses
+        )
+        fees = sum(columns.amounts('FEEAMT'))  # in cents
+        columns.timestamps()  # seconds since the epoch
+
+    Missing values are `None` in the lists, and 0 in the integer arrays.
+    On platforms without 64 bit integer arrays, such as Python 2 on Windows,
+    those are arrays of doubles holding whole numbers (see `INT64`)
+    """
+
+    # Fields holding amounts and timestamps, by default
+    amount_fields = ('AMT', 'FEEAMT', 'NETAMT')
+    timestamp_fields = ('TIMESTAMP',)
+
+    def __init__(self, columns=None):
+        self.columns = columns or {}
+
+    def __len__(self):
+        return min(len(values) for values in self.columns.itervalues()) if self.columns else 0
+
+    def __getitem__(self, field):
+        return self.columns[field][:len(self)]
+
+    @property
+    def fields(self):
+        return sorted(self.columns)
+
+    @classmethod
+    def concatenate(cls, columns):
+        """ Join `TransactionColumns` sharing the same fields end to end """
+        joined = {}
+        for other in columns:
+            length = len(other)
+            for field, values in other.columns.iteritems():
+                joined.setdefault(field, []).extend(values[:length])
+        return cls(joined)
+
+    def amounts(self, field):
+        """ Return `field` as an array of integer cents, of `INT64` items """
+        return array(INT64, (
+            0 if value is None else parse_cents(value)
+            for value in self[field]
+        ))
+
+    def timestamps(self, field='TIMESTAMP'):
+        """ Return `field` as an array of integer seconds since the epoch, of
+        `INT64` items
+        """
+        return array(INT64, (
+            0 if value is None else parse_epoch(value)
+            for value in self[field]
+        ))
+
+    def to_numpy(self):
+        """ Return a dictionary of NumPy arrays per field
+
+        Amounts are `int64` cents and timestamps `datetime64[s]`, other
+        fields are object arrays.  Requires NumPy to be installed.
+        """
+        if numpy is None:
+            raise MerchantError('NumPy is required for TransactionColumns.to_numpy')
+
+        def int64(values):
+            # Arrays may hold C longs or doubles (see `INT64`): only share
+            # the buffer of 64 bit integers
+            dtype = numpy.dtype(values.typecode)
+            return numpy.frombuffer(values, dtype=dtype).astype(numpy.int64, copy=False)
+
+        arrays = {}
+        for field in self.columns:
+            if field in self.amount_fields:
+                arrays[field] = int64(self.amounts(field))
+            elif field in self.timestamp_fields:
+                arrays[field] = int64(self.timestamps(field)).astype('datetime64[s]')
+            else:
+                arrays[field] = numpy.array(self[field], dtype=object)
+        return arrays
+
 
 class TransactionDetailsResponse(PaypalNVPAPIResponse):
     pass
@@ -0,0 +1,364 @@
+""" Bulk payouts to many receivers, packed into Pay requests
+
+Usage::
+
+    rows = csv.reader(open('payouts.csv'))  # email, amount, invoice id
+    payout = paypal.Payout(
+        paypal.PayoutJournal('/var/lib/myapp/payouts.db'),
+        max_workers=10, max_rate=5,
+    )
+    with open('payout-2014-10.log', 'a') as log:
+        for result in payout.run('payout-2014-10', rows, log=log):
+            if not result.success:
+                ...
+
+Rows are packed into implicit Pay requests of up to 6 receivers, sent
+concurrently.  Every request is recorded in the journal before it is sent,
+with a trackingId derived from the run id and its position in the rows, so
+running the same rows again with the same run id resumes the run: recorded
+payments are reported without calling PayPal, and requests that were sent
+without a recorded outcome are looked up by trackingId, and only sent again
+if PayPal answers it has no payment for them.  Requests whose lookup fails
+stay in doubt, and are reported with an `error`
+
+Invalid rows (e.g. without an email or amount) are left out of their Pay
+request, and reported on a result of their own with an `error`
+"""
+import hashlib
+import itertools
+import json
+import time
+
+from . import PaypalAPI, PaypalAPIError
+from .adaptive_payments import AdaptivePayments, Receiver
+from .batch import batch
+from .ratelimit import TokenBucket
+from ..utils import sqlite_connection
+
+
+__all__ = [
+    'PayoutError', 'PayoutJournal', 'PayoutResult', 'Payout',
+]
+
+
+class PayoutError(PaypalAPIError):
+    pass
+
+
+class PayoutJournal(object):
+    """ Progress of payout runs, stored in the SQLite database at `path`
+
+    Every Pay request is `SENT` before being sent, then `DONE` or `FAILED`
+    once PayPal answered.  Unlike caches, the journal is synced to disk on
+    every write: a lost entry could pay its receivers twice
+    """
+
+    SENT = 'sent'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = path
+
+    def connection(self):
+        return sqlite_connection(
+            self.path,
+            'CREATE TABLE IF NOT EXISTS payout_requests '
+            '(tracking_id TEXT PRIMARY KEY, run TEXT, digest TEXT, '
+            'state TEXT, result TEXT, updated REAL)',
+            'CREATE INDEX IF NOT EXISTS payout_requests_run ON payout_requests (run, state)',
+        )
+
+    def get(self, tracking_id):
+        """ Return the `(digest, state, result)` of a request, or `None` """
+        row = self.connection().execute(
+            'SELECT digest, state, result FROM payout_requests WHERE tracking_id = ?',
+            (tracking_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        digest, state, result = row
+        return digest, state, json.loads(result) if result is not None else None
+
+    def sent(self, run, tracking_id, digest):
+        self.connection().execute(
+            'INSERT INTO payout_requests (tracking_id, run, digest, state, updated) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (tracking_id, run, digest, self.SENT, time.time())
+        )
+
+    def finished(self, tracking_id, state, result):
+        self.connection().execute(
+            'UPDATE payout_requests SET state = ?, result = ?, updated = ? WHERE tracking_id = ?',
+            (state, json.dumps(result), time.time(), tracking_id)
+        )
+
+    def counts(self, run):
+        """ Return the number of requests of `run` by state """
+        return dict(self.connection().execute(
+            'SELECT state, COUNT(*) FROM payout_requests WHERE run = ? GROUP BY state',
+            (run,)
+        ))
+
+
+class PayoutResult(object):
+    """ Outcome of a single Pay request of a payout run
+
+    `receivers` holds a dictionary per receiver, with its `email`,
+    `amount`, `invoice_id` and `status`: the transaction status reported by
+    PayPal (e.g. `COMPLETED`), or `FAILED` with the PayPal `error` message.
+    `error` is the exception raised by the request, leaving it in doubt
+    until the run is resumed, or the `PayoutError` of an invalid row, with
+    no trackingId
+    """
+
+    def __init__(self, tracking_id, receivers, paykey=None, status=None, error=None, resumed=False):
+        self.tracking_id = tracking_id
+        self.receivers = receivers
+        self.paykey = paykey
+        self.status = status
+        self.error = error
+        self.resumed = resumed
+
+    def __repr__(self):
+        return '<PayoutResult {tracking_id} {status}>'.format(
+            tracking_id=self.tracking_id,
+            status=self.status or type(self.error).__name__,
+        )
+
+    @property
+    def success(self):
+        return self.error is None and self.status == 'COMPLETED'
+
+    def as_dict(self):
+        return {
+            'tracking_id': self.tracking_id,
+            'paykey': self.paykey,
+            'status': self.status,
+            'receivers': self.receivers,
+        }
+
+    @classmethod
+    def from_response(cls, tracking_id, receivers, response):
+        """ Build the result of a Pay or PaymentDetails `response` """
+        response = response.response
+
+        transactions = {}
+        for info in response.get('paymentInfoList', {}).get('paymentInfo', ()):
+            receiver = info.get('receiver', {})
+            transactions[receiver.get('email'), receiver.get('invoiceId')] = info.get('transactionStatus')
+
+        errors = {}
+        for pay_error in response.get('payErrorList', {}).get('payError', ()):
+            receiver = pay_error.get('receiver', {})
+            errors[receiver.get('email')] = pay_error.get('error', {}).get('message')
+
+        ack = response.get('responseEnvelope', {}).get('ack')
+        if ack != 'Success':
+            status = 'FAILED'
+            message = '; '.join(error.get('message', '') for error in response.get('error', ()))
+        else:
+            status = response.get('paymentExecStatus') or response.get('status')
+            message = None
+
+        results = []
+        for receiver in receivers:
+            email, invoice_id = receiver.email, receiver.invoice_id
+            if email in errors:
+                receiver_status, receiver_error = 'FAILED', errors[email]
+            elif (email, invoice_id) in transactions:
+                receiver_status, receiver_error = transactions[email, invoice_id], None
+            else:
+                receiver_status, receiver_error = status, message
+            results.append({
+                'email': email,
+                'amount': receiver.amount,
+                'invoice_id': invoice_id,
+                'status': receiver_status,
+                'error': receiver_error,
+            })
+
+        return cls(tracking_id, results, paykey=response.get('payKey'), status=status)
+
+
+class Payout(PaypalAPI):
+    """ Engine paying a stream of `(email, amount, invoice_id)` rows from the
+    account of the API caller, recording its progress in a `PayoutJournal`
+
+    Up to `max_workers` Pay requests of `receivers_per_payment` receivers
+    run at once, and at most `max_rate` are sent per second.  Further
+    arguments of `AdaptivePayments.pay` (e.g. `memo` or
+    `ipn_notification_url`) can be passed as `pay_options`
+
+    Requests PayPal answered with a failure are recorded as such, and not
+    sent again when resuming; pay their receivers in a new run
+    """
+
+    def __init__(
+        self, journal, configuration=None,
+        max_workers=10, max_rate=None, receivers_per_payment=6,
+        **pay_options
+    ):
+        super(Payout, self).__init__(configuration=configuration)
+
+        if not 1 <= receivers_per_payment <= 6:
+            raise PayoutError('Pay requests take 1 to 6 receivers')
+
+        self.journal = journal
+        self.max_workers = max_workers
+        self.max_rate = max_rate
+        self.receivers_per_payment = receivers_per_payment
+        # Receiver statuses are read from the Pay response, which carries
+        # them for completed payments
+        self.pay_options = dict(pay_options)
+        self.pay_options.setdefault('details', AdaptivePayments.Details.NEVER)
+
+    @staticmethod
+    def tracking_id(run, index):
+        """ trackingId of the `index`th Pay request of `run` """
+        return '{}-{:06d}'.format(run, index)
+
+    @staticmethod
+    def digest(receivers):
+        """ Fingerprint of the receivers of a request, to detect rows that
+        changed between a run and its resumption
+        """
+        content = '\n'.join(
+            '{} {} {}'.format(receiver.email, receiver.amount, receiver.invoice_id)
+            for receiver in receivers
+        )
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        return hashlib.sha1(content).hexdigest()
+
+    def requests(self, rows):
+        """ Generate `(index, receivers, rejected)` for every Pay request of
+        `rows`, where `rejected` holds the `PayoutResult` of its invalid rows
+        """
+        rows = iter(rows)
+        for index in itertools.count():
+            chunk = list(itertools.islice(rows, self.receivers_per_payment))
+            if not chunk:
+                return
+
+            receivers, rejected = [], []
+            for position, row in enumerate(chunk, index * self.receivers_per_payment):
+                try:
+                    email, amount, invoice_id = row
+                    receivers.append(
+                        Receiver(email=email, amount=amount, invoice_id=invoice_id or None)
+                    )
+                except (PaypalAPIError, TypeError, ValueError) as e:
+                    rejected.append(self.rejected(position, row, e))
+            yield index, receivers, rejected
+
+    @staticmethod
+    def rejected(position, row, error):
+        """ Result of the invalid row at `position` """
+        error = PayoutError('Invalid row {}: {}'.format(position, error))
+        try:
+            email, amount, invoice_id = (tuple(row) + (None,) * 3)[:3]
+        except TypeError:
+            email = amount = invoice_id = None
+        return PayoutResult(
+            None,
+            [{
+                'email': email,
+                'amount': amount,
+                'invoice_id': invoice_id,
+                'status': None,
+                'error': str(error),
+            }],
+            error=error,
+        )
+
+    def run(self, run, rows, log=None):
+        """ Pay every row, generating a `PayoutResult` per Pay request as they
+        complete
+
+        `run` names the run, and must be the same when resuming it with the
+        same `rows`.  Rows are consumed lazily.  With a `log` file, a JSON
+        line is written per receiver, with the trackingId and payKey of its
+        request
+        """
+        if len(self.tracking_id(run, 0)) > 127:
+            raise PayoutError('Run id too long for a trackingId')
+
+        api = AdaptivePayments(self.config)
+        limiter = TokenBucket(self.max_rate, capacity=1) if self.max_rate else None
+
+        def pay(request):
+            index, receivers, _ = request
+            if not receivers:
+                return None
+            tracking_id = self.tracking_id(run, index)
+            digest = self.digest(receivers)
+
+            entry = self.journal.get(tracking_id)
+            if entry is not None:
+                recorded_digest, state, result = entry
+                if recorded_digest != digest:
+                    raise PayoutError(
+                        'Rows of {} changed since the run started'.format(tracking_id)
+                    )
+
+                if state != PayoutJournal.SENT:
+                    return PayoutResult(resumed=True, **result)
+
+                # In doubt: only send again if PayPal has no such payment
+                details = api.payment_details(tracking_id=tracking_id)
+                if details.success and 'payKey' in details.response:
+                    return self.finish(tracking_id, receivers, details)
+                if not details.not_found:
+                    # Left in doubt, to be looked up again on the next run
+                    raise PayoutError(
+                        'Payment {} may have been sent, and could not be '
+                        'looked up'.format(tracking_id)
+                    )
+            else:
+                self.journal.sent(run, tracking_id, digest)
+
+            if limiter is not None:
+                limiter.acquire()
+
+            response = api.pay(
+                receivers=receivers, tracking_id=tracking_id, implicit=True,
+                **self.pay_options
+            )
+            return self.finish(tracking_id, receivers, response)
+
+        for outcome in batch(pay, self.requests(rows), max_workers=self.max_workers):
+            index, receivers, rejected = outcome.key
+            if outcome.error is not None:
+                result = PayoutResult(
+                    self.tracking_id(run, index),
+                    [
+                        {
+                            'email': receiver.email,
+                            'amount': receiver.amount,
+                            'invoice_id': receiver.invoice_id,
+                            'status': None,
+                            'error': str(outcome.error),
+                        }
+                        for receiver in receivers
+                    ],
+                    error=outcome.error,
+                )
+            else:
+                result = outcome.response
+
+            for result in ([result] if result is not None else []) + rejected:
+                if log is not None:
+                    for receiver in result.receivers:
+                        entry = dict(receiver, tracking_id=result.tracking_id, paykey=result.paykey)
+                        log.write(json.dumps(entry, sort_keys=True) + '\n')
+                    log.flush()
+
+                yield result
+
+    def finish(self, tracking_id, receivers, response):
+        result = PayoutResult.from_response(tracking_id, receivers, response)
+        state = PayoutJournal.DONE if response.success else PayoutJournal.FAILED
+        self.journal.finished(tracking_id, state, result.as_dict())
+        return result
@@ -22,16 +22,7 @@ class Permissions(PaypalJSONAPIRequest):
 
     @mixedmethod
     def headers(self):
-        return {
-            'X-PAYPAL-SECURITY-USERID': self.configuration.userid,
-            'X-PAYPAL-SECURITY-PASSWORD': self.configuration.password,
-            'X-PAYPAL-SECURITY-SIGNATURE': self.configuration.signature,
-
-            'X-PAYPAL-APPLICATION-ID': self.configuration.application_id,
-
-            'X-PAYPAL-REQUEST-DATA-FORMAT': 'JSON',
-            'X-PAYPAL-RESPONSE-DATA-FORMAT': 'JSON',
-        }
+        return self.configuration.headers
 
     @mixedmethod
     def request_permissions(self, scope, callback):
@@ -48,8 +39,20 @@ class Permissions(PaypalJSONAPIRequest):
 
     @mixedmethod
     def get_access_token(self, token, verifier):
+        """ Exchange a request token for an access token
+
+        With a `permissions_cache` configured, successful responses are
+        cached until the access token is cancelled
+        """
         url = self.config.environment.Permissions.get_access_token_endpoint
 
+        cache = self.configuration.permissions_cache
+        if cache is not None:
+            key = self.cache_key(url, token, verifier)
+            cached = cache.get(key)
+            if cached is not None:
+                return GetAccessTokenResponse(self.config, cached)
+
         payload = {
             'token': token,
             'verifier': verifier,
@@ -57,29 +60,53 @@ class Permissions(PaypalJSONAPIRequest):
 
         response = self.post(url, data=payload)
 
-        return GetAccessTokenResponse(self.config, response)
+        response = GetAccessTokenResponse(self.config, response)
+        if cache is not None and response.success:
+            cache.set(key, response.response, tags=[self.cache_tag(response.token)])
+        return response
 
     @mixedmethod
     def get_permissions(self, token):
+        """ Return the scope granted to an access token
+
+        With a `permissions_cache` configured, successful responses are
+        cached until the access token is cancelled
+        """
         url = self.config.environment.Permissions.get_permissions_endpoint
 
+        cache = self.configuration.permissions_cache
+        if cache is not None:
+            key = self.cache_key(url, token)
+            cached = cache.get(key)
+            if cached is not None:
+                return GetPermissionsResponse(self.config, cached)
+
         payload = {
             'token': token,
         }
 
         response = self.post(url, data=payload)
 
-        return GetPermissionsResponse(self.config, response)
+        response = GetPermissionsResponse(self.config, response)
+        if cache is not None and response.success:
+            cache.set(key, response.response, tags=[self.cache_tag(token)])
+        return response
 
     @mixedmethod
     def cancel_permissions(self, token):
+        """ Cancel an access token, dropping its cached lookups """
         url = self.config.environment.Permissions.cancel_permissions_endpoint
 
         payload = {
             'token': token,
         }
 
-        response = self.post(url, data=payload)
+        try:
+            response = self.post(url, data=payload)
+        finally:
+            cache = self.configuration.permissions_cache
+            if cache is not None:
+                cache.invalidate(self.cache_tag(token))
 
         return CancelPermissionsResponse(self.config, response)
 
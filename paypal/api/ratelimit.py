@@ -0,0 +1,144 @@
+""" Client-side rate limiting of PayPal API calls
+
+Usage::
+
+    # 10 calls per second per application id and endpoint, with bursts of 20
+    limits = paypal.RateLimits(rate=10, capacity=20)
+    paypal.Configuration.configure(..., rate_limits=limits)
+
+    # The same limit shared by all processes on this node (e.g. gunicorn workers)
+    limits = paypal.RateLimits(rate=10, path='/var/run/myapp/paypal-limits.db')
+"""
+import threading
+import time
+
+from . import PaypalAPIError
+from ..utils import sqlite_connection, sqlite_transaction
+
+
+__all__ = [
+    'RateLimitExceeded', 'TokenBucket', 'SQLiteTokenBucket', 'RateLimits',
+]
+
+
+class RateLimitExceeded(PaypalAPIError):
+    pass
+
+
+class TokenBucket(object):
+    """ Thread-safe token bucket, refilled with `rate` tokens per second up to
+    `capacity` tokens (default `rate`, i.e. one second of burst)
+
+    `acquire` takes a token, waiting until one is available.  Waiting
+    callers reserve their token up front, so they are served in order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """ Take a token, returning the seconds to wait before using it """
+        with self._lock:
+            now = time.time()
+            tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate) - 1
+            wait = -tokens / self.rate if tokens < 0 else 0
+
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExceeded('Rate limit exceeded, next call in {:.3f}s'.format(wait))
+
+            self._tokens = tokens
+            self._updated = now
+            return wait
+
+    def acquire(self, max_wait=None):
+        wait = self.reserve(max_wait)
+        if wait:
+            time.sleep(wait)
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """ Token bucket stored in the SQLite database at `path`, shared by every
+    process and thread using the same `path` and `key`
+    """
+
+    def __init__(self, path, key, rate, capacity=None):
+        super(SQLiteTokenBucket, self).__init__(rate, capacity)
+        self.path = path
+        self.key = key
+
+    def connection(self):
+        return sqlite_connection(
+            self.path,
+            # Bucket state does not need to survive a crash, so skip fsync
+            'PRAGMA synchronous = OFF',
+            'CREATE TABLE IF NOT EXISTS token_buckets '
+            '(key TEXT PRIMARY KEY, tokens REAL, updated REAL)',
+        )
+
+    def reserve(self, max_wait=None):
+        with sqlite_transaction(self.connection()) as connection:
+            now = time.time()
+            row = connection.execute(
+                'SELECT tokens, updated FROM token_buckets WHERE key = ?', (self.key,)
+            ).fetchone()
+            tokens, updated = row if row is not None else (self.capacity, now)
+
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate) - 1
+            wait = -tokens / self.rate if tokens < 0 else 0
+
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExceeded('Rate limit exceeded, next call in {:.3f}s'.format(wait))
+
+            connection.execute(
+                'INSERT OR REPLACE INTO token_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                (self.key, tokens, now)
+            )
+        return wait
+
+
+class RateLimits(object):
+    """ A token bucket per application id and endpoint url, created on first
+    use
+
+    With `path`, buckets are stored in a SQLite database so that the limits
+    hold across processes.  With `per_endpoint=False`, all endpoints share
+    the bucket of their application id.
+
+    Calls wait for a token, or raise `RateLimitExceeded` if that would take
+    longer than `max_wait` seconds
+    """
+
+    def __init__(self, rate, capacity=None, path=None, per_endpoint=True, max_wait=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self.per_endpoint = per_endpoint
+        self.max_wait = max_wait
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, application_id, endpoint):
+        key = (application_id, endpoint if self.per_endpoint else None)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    if self.path is None:
+                        bucket = TokenBucket(self.rate, self.capacity)
+                    else:
+                        bucket = SQLiteTokenBucket(
+                            self.path, '{} {}'.format(*key), self.rate, self.capacity
+                        )
+                    self._buckets[key] = bucket
+        return bucket
+
+    def acquire(self, application_id, endpoint):
+        self.bucket(application_id, endpoint).acquire(self.max_wait)
@@ -0,0 +1,251 @@
+""" Caches of API responses, with expiry, least recently used eviction and
+invalidation by tag
+
+Usage::
+
+    # In-process
+    cache = paypal.MemoryCache(max_size=1000, ttl=600)
+    paypal.Configuration.configure(..., permissions_cache=cache)
+
+    # Shared by every process on this node, and kept across restarts
+    cache = paypal.SQLiteCache('/var/cache/myapp/paypal.db', ttl=600)
+
+Values are response dictionaries, as decoded by a JSON codec.  Entries are tagged on
+`set`, and `invalidate` drops every entry carrying one of the given tags.
+`update` changes a value atomically, e.g. to count payments against it
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .codec import default_codec
+from .utils import sqlite_connection, sqlite_transaction
+
+
+__all__ = [
+    'MemoryCache', 'SQLiteCache',
+]
+
+
+class MemoryCache(object):
+    """ Thread-safe cache of at most `max_size` entries, each expiring `ttl`
+    seconds after being set
+
+    Values are returned as stored, not copied
+    """
+
+    def __init__(self, max_size=1000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # Key -> (expires, value, tags), least recently used first
+        self._entries = OrderedDict()
+        # Tag -> keys
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ Return the value of `key`, or `None` if missing or expired """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._untag(key, entry)
+                return None
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tags=()):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        tags = tuple(tags)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._untag(key, entry)
+
+            self._entries[key] = (expires, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._untag(*self._entries.popitem(last=False))
+
+    def update(self, key, function):
+        """ Replace the value of `key` with `function(value)`, keeping its
+        expiry and tags, and return the new value.  Return `None` if missing
+        or expired, without calling `function`
+
+        No other change of the entry happens in between
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._untag(key, entry)
+                return None
+            expires, value, tags = entry
+            try:
+                value = function(value)
+            finally:
+                self._entries[key] = (expires, value, tags)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._untag(key, entry)
+
+    def invalidate(self, *tags):
+        """ Drop every entry tagged with one of `tags` """
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    entry = self._entries.pop(key, None)
+                    if entry is not None:
+                        self._untag(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _untag(self, key, entry):
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteCache(object):
+    """ Cache stored in the SQLite database at `path`, shared by every process
+    and thread using the same `path`
+
+    Holds at most `max_size` entries, each expiring `ttl` seconds after being
+    set.  Values are stored as JSON with `codec` (default `default_codec`),
+    so that `Decimal` amounts decoded from responses can be cached; they are
+    read back as strings, like the amounts PayPal sends
+    """
+
+    def __init__(self, path, max_size=10000, ttl=600, codec=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.codec = codec or default_codec
+
+    def connection(self):
+        return sqlite_connection(
+            self.path,
+            # A lost entry is only a cache miss, so skip fsync
+            'PRAGMA synchronous = OFF',
+            'CREATE TABLE IF NOT EXISTS cache_entries '
+            '(key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)',
+            'CREATE INDEX IF NOT EXISTS cache_entries_used ON cache_entries (used)',
+            'CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT, key TEXT)',
+            'CREATE INDEX IF NOT EXISTS cache_tags_tag ON cache_tags (tag)',
+            'CREATE INDEX IF NOT EXISTS cache_tags_key ON cache_tags (key)',
+        )
+
+    def __len__(self):
+        return self.connection().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+    def get(self, key):
+        """ Return the value of `key`, or `None` if missing or expired """
+        connection = self.connection()
+        now = time.time()
+
+        row = connection.execute(
+            'SELECT value, expires FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        value, expires = row
+        if expires <= now:
+            self.delete(key)
+            return None
+
+        connection.execute('UPDATE cache_entries SET used = ? WHERE key = ?', (now, key))
+        return self.codec.decode(value)
+
+    def set(self, key, value, ttl=None, tags=()):
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        value = self.encode(value)
+
+        with sqlite_transaction(self.connection()) as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires, used) VALUES (?, ?, ?, ?)',
+                (key, value, expires, now)
+            )
+            connection.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            connection.executemany(
+                'INSERT INTO cache_tags (tag, key) VALUES (?, ?)',
+                [(tag, key) for tag in tags]
+            )
+
+            excess = connection.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0] - self.max_size
+            if excess > 0:
+                evicted = [
+                    (evicted_key,) for evicted_key, in connection.execute(
+                        'SELECT key FROM cache_entries ORDER BY used LIMIT ?', (excess,)
+                    )
+                ]
+                self._delete(connection, evicted)
+
+    def update(self, key, function):
+        """ Replace the value of `key` with `function(value)`, keeping its
+        expiry and tags, and return the new value.  Return `None` if missing
+        or expired, without calling `function`
+
+        Other processes can't change the entry in between
+        """
+        now = time.time()
+
+        with sqlite_transaction(self.connection()) as connection:
+            row = connection.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+
+            value = function(self.codec.decode(row[0]))
+            connection.execute(
+                'UPDATE cache_entries SET value = ?, used = ? WHERE key = ?',
+                (self.encode(value), now, key)
+            )
+        return value
+
+    def encode(self, value):
+        # Stored as text, codecs encode to UTF-8 bytes
+        return self.codec.encode(value).decode('utf-8')
+
+    def delete(self, key):
+        with sqlite_transaction(self.connection()) as connection:
+            self._delete(connection, [(key,)])
+
+    def invalidate(self, *tags):
+        """ Drop every entry tagged with one of `tags` """
+        with sqlite_transaction(self.connection()) as connection:
+            for tag in tags:
+                keys = connection.execute(
+                    'SELECT key FROM cache_tags WHERE tag = ?', (tag,)
+                ).fetchall()
+                self._delete(connection, keys)
+
+    def clear(self):
+        connection = self.connection()
+        connection.execute('DELETE FROM cache_entries')
+        connection.execute('DELETE FROM cache_tags')
+
+    def _delete(self, connection, keys):
+        connection.executemany('DELETE FROM cache_entries WHERE key = ?', keys)
+        connection.executemany('DELETE FROM cache_tags WHERE key = ?', keys)
@@ -0,0 +1,119 @@
+""" JSON codecs of the JSON APIs (Adaptive Payments, Permissions)
+
+Codecs encode request payloads straight to UTF-8 bytes, with `Decimal`
+values as strings so that amounts are sent exactly, and decode response
+bodies
+
+`default_codec` uses the standard library, decoding numbers with a fraction
+as `Decimal`.  Decoding with ujson is faster, but yields floats, so it is
+opt-in::
+
+    paypal.Configuration.configure(json_codec=paypal.UJSONCodec(), **paypal_settings)
+"""
+import json
+from decimal import Decimal
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+__all__ = [
+    'JSONCodec', 'UJSONCodec', 'PayloadTemplate', 'default_codec',
+]
+
+
+class JSONCodec(object):
+    """ Codec of the standard library `json` module
+
+    Numbers with a fraction are decoded as `Decimal`
+    """
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'), default=self.default)
+        self._decoder = json.JSONDecoder(parse_float=Decimal)
+
+    def __repr__(self):
+        return '<{}>'.format(type(self).__name__)
+
+    @staticmethod
+    def default(value):
+        if isinstance(value, Decimal):
+            return str(value)
+        raise TypeError('{!r} is not JSON serializable'.format(value))
+
+    def encode(self, data):
+        body = self._encoder.encode(data)
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return body
+
+    def decode(self, content):
+        """ Decode a response body, raising `ValueError` if it is not JSON """
+        return self._decoder.decode(content)
+
+
+class UJSONCodec(JSONCodec):
+    """ Codec decoding with the `ujson` package
+
+    Encoding stays with the standard library: ujson turns `Decimal` into
+    floats, and converting them beforehand costs more than the C encoder of
+    the standard library.  Unlike `JSONCodec`, numbers with a fraction are
+    decoded as floats; the JSON APIs send amounts as strings
+    """
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError('UJSONCodec requires the ujson package')
+        super(UJSONCodec, self).__init__()
+
+    def decode(self, content):
+        return ujson.loads(content)
+
+
+# Decoded types must not depend on the packages installed
+default_codec = JSONCodec()
+
+
+class PayloadTemplate(object):
+    """ JSON object made of `constant` fields, encoded once per codec, and
+    variable fields encoded on every call
+
+    Usage::
+
+        template = PayloadTemplate(currencyCode='USD', requestEnvelope={...})
+        body = template.encode(codec, {'memo': memo, 'trackingId': None})
+        # b'{"memo":"...","currencyCode":"USD","requestEnvelope":{...}}'
+
+    Variable fields of `None` are left out.  A variable field named like a
+    constant one replaces it, at the cost of encoding the whole object
+    """
+
+    def __init__(self, **constant):
+        self.constant = constant
+        self._constant_keys = frozenset(constant)
+        self._fragments = {}
+
+    def fragment(self, codec):
+        """ Encoded constant fields, without the enclosing braces """
+        fragment = self._fragments.get(codec)
+        if fragment is None:
+            fragment = self._fragments[codec] = codec.encode(self.constant)[1:-1]
+        return fragment
+
+    def encode(self, codec, fields):
+        variable = {key: value for key, value in fields.iteritems() if value is not None}
+
+        if not self.constant:
+            return codec.encode(variable)
+
+        if not variable:
+            return b'{' + self.fragment(codec) + b'}'
+
+        if not self._constant_keys.isdisjoint(variable):
+            merged = dict(self.constant)
+            merged.update(variable)
+            return codec.encode(merged)
+
+        return codec.encode(variable)[:-1] + b',' + self.fragment(codec) + b'}'
@@ -1,10 +1,17 @@
+from .codec import default_codec
 from .exceptions import PaypalError
+from .transport import Transport
+from .utils import OAuthSigner
 
 
 class ConfigurationError(PaypalError):
     pass
 
 
+# Connection pool shared by every configuration without its own transport
+default_transport = Transport()
+
+
 class Configuration(object):
     """ Configure the Paypal environment
 
@@ -28,6 +35,35 @@ class Configuration(object):
         # Instance configuration
         config = paypal.Configuration(**paypal_settings)
         paypal.AdaptivePayments(config).pay(...)
+
+    Configurations are immutable and hashable; derive modified copies with
+    `replace`::
+
+        sandbox = config.replace(environment=paypal.Environment.Sandbox)
+
+    All configurations share a pooled `Transport` unless one is provided::
+
+        transport = paypal.Transport(pool_size=20)
+        paypal.Configuration.configure(transport=transport, **paypal_settings)
+
+    Requests are not retried unless a `RetryPolicy` is provided, endpoints
+    are not guarded unless `CircuitBreakers` are provided, and calls are not
+    throttled unless `RateLimits` are provided
+
+    Calls are measured and reported to hooks when an `Instrumentation` is
+    provided (see `paypal.instrumentation`)
+
+    Payments are recorded in a write-ahead journal, to resolve those in
+    doubt after a crash, when a `journal` is provided (see `paypal.journal`)
+
+    JSON payloads are encoded and decoded with `default_codec` unless a
+    `json_codec` is provided (see `paypal.codec`)
+
+    Permissions and preapproval lookups are cached when a
+    `permissions_cache` or `preapproval_cache` is provided::
+
+        cache = paypal.MemoryCache(max_size=1000, ttl=600)
+        paypal.Configuration.configure(permissions_cache=cache, **paypal_settings)
     """
 
     environment = None
@@ -35,21 +71,133 @@ class Configuration(object):
     password = None
     signature = None
     application_id = None
+    transport = default_transport
+    retry_policy = None
+    circuit_breakers = None
+    rate_limits = None
+    permissions_cache = None
+    preapproval_cache = None
+    json_codec = default_codec
+    instrumentation = None
+    journal = None
+
+    # Settings making up a configuration, in constructor order
+    _settings = (
+        'environment', 'userid', 'password', 'signature', 'application_id',
+        'transport', 'retry_policy', 'circuit_breakers', 'rate_limits',
+        'permissions_cache', 'preapproval_cache', 'json_codec',
+        'instrumentation', 'journal',
+    )
+
+    # Global configuration instance, see `instantiate`
+    _instance = None
 
     def __init__(
         self, environment, userid, password, signature,
-        application_id=None
+        application_id=None, transport=None, retry_policy=None,
+        circuit_breakers=None, rate_limits=None, permissions_cache=None,
+        preapproval_cache=None, json_codec=None, instrumentation=None,
+        journal=None
     ):
         self.environment = environment
         self.userid = userid
         self.password = password
         self.signature = signature
         self.application_id = application_id or environment.application_id
+        # Derived again from the environment by `replace`
+        self._default_application_id = not application_id
+        self.transport = transport or Configuration.transport
+        self.retry_policy = retry_policy or Configuration.retry_policy
+        self.circuit_breakers = circuit_breakers or Configuration.circuit_breakers
+        self.rate_limits = rate_limits or Configuration.rate_limits
+        # Empty caches are falsy
+        self.permissions_cache = (
+            permissions_cache if permissions_cache is not None
+            else Configuration.permissions_cache
+        )
+        self.preapproval_cache = (
+            preapproval_cache if preapproval_cache is not None
+            else Configuration.preapproval_cache
+        )
+        self.json_codec = json_codec or Configuration.json_codec
+        self.instrumentation = instrumentation or Configuration.instrumentation
+        self.journal = journal or Configuration.journal
+
+        # Authentication headers of the JSON APIs, shared by every request
+        self.headers = {
+            'X-PAYPAL-SECURITY-USERID': self.userid,
+            'X-PAYPAL-SECURITY-PASSWORD': self.password,
+            'X-PAYPAL-SECURITY-SIGNATURE': self.signature,
+
+            'X-PAYPAL-APPLICATION-ID': self.application_id,
+
+            'X-PAYPAL-REQUEST-DATA-FORMAT': 'JSON',
+            'X-PAYPAL-RESPONSE-DATA-FORMAT': 'JSON',
+        }
+
+        # OAuth signers of the Merchant APIs, by token
+        self._signers = {}
+
+        self._key = tuple(getattr(self, name) for name in self._settings)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen'):
+            raise ConfigurationError(
+                'Configuration is immutable, use Configuration.replace'
+            )
+        super(Configuration, self).__setattr__(name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, Configuration) and self._key == other._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        return '<PaypalConfiguration {userid} {environment}>'.format(
+            userid=self.userid,
+            environment=getattr(self.environment, '__name__', self.environment),
+        )
+
+    # Tokens whose signers are kept, the cache is dropped past this size
+    max_signers = 1000
+
+    def oauth_signer(self, token, token_secret):
+        """ Return the `OAuthSigner` of a permissions token, signing with
+        the API credentials as consumer key and secret
+        """
+        signer = self._signers.get((token, token_secret))
+        if signer is None:
+            if len(self._signers) >= self.max_signers:
+                self._signers.clear()
+            signer = self._signers[token, token_secret] = OAuthSigner(
+                self.userid, self.password, token, token_secret
+            )
+        return signer
+
+    def replace(self, **settings):
+        """ Return a new configuration with `settings` changed
+
+        An `application_id` defaulting to that of the environment follows
+        a change of `environment`
+        """
+        values = dict(zip(self._settings, self._key))
+        if self._default_application_id:
+            values['application_id'] = None
+        values.update(settings)
+        return type(self)(**values)
 
     @classmethod
     def configure(
         cls, environment, userid, password, signature,
-        application_id=None
+        application_id=None, transport=None, retry_policy=None,
+        circuit_breakers=None, rate_limits=None, permissions_cache=None,
+        preapproval_cache=None, json_codec=None, instrumentation=None,
+        journal=None
     ):
         """ Use global configuration settings """
         Configuration.environment = environment
@@ -57,14 +205,39 @@ class Configuration(object):
         Configuration.password = password
         Configuration.signature = signature
         Configuration.application_id = application_id
+        Configuration.transport = transport or default_transport
+        Configuration.retry_policy = retry_policy
+        Configuration.circuit_breakers = circuit_breakers
+        Configuration.rate_limits = rate_limits
+        Configuration.permissions_cache = permissions_cache
+        Configuration.preapproval_cache = preapproval_cache
+        Configuration.json_codec = json_codec or default_codec
+        Configuration.instrumentation = instrumentation
+        Configuration.journal = journal
+        Configuration._instance = None
 
     @classmethod
     def instantiate(cls):
-        """ Return settings as a configuration instance """
-        return cls(
-            Configuration.environment,
-            Configuration.userid,
-            Configuration.password,
-            Configuration.signature,
-            Configuration.application_id,
-        )
+        """ Return settings as a configuration instance
+
+        The instance is built once, and rebuilt after `configure`
+        """
+        instance = Configuration._instance
+        if instance is None:
+            instance = Configuration._instance = cls(
+                Configuration.environment,
+                Configuration.userid,
+                Configuration.password,
+                Configuration.signature,
+                Configuration.application_id,
+                Configuration.transport,
+                Configuration.retry_policy,
+                Configuration.circuit_breakers,
+                Configuration.rate_limits,
+                Configuration.permissions_cache,
+                Configuration.preapproval_cache,
+                Configuration.json_codec,
+                Configuration.instrumentation,
+                Configuration.journal,
+            )
+        return instance
@@ -25,6 +25,9 @@ class Environment(object):
         class Merchant(object):
             merchant_endpoint = "https://api-3t.sandbox.paypal.com/nvp"
 
+        class IPN(object):
+            verify_endpoint = 'https://ipnpb.sandbox.paypal.com/cgi-bin/webscr'
+
     class Production(object):
         application_id = None
 
@@ -50,5 +53,8 @@ class Environment(object):
         class Merchant(object):
             merchant_endpoint = "https://api-3t.paypal.com/nvp"
 
+        class IPN(object):
+            verify_endpoint = 'https://ipnpb.paypal.com/cgi-bin/webscr'
+
 Sandbox = Environment.Sandbox
 Production = Environment.Production
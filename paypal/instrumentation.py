@@ -0,0 +1,377 @@
+""" Hooks observing every PayPal API call
+
+Usage::
+
+    histograms = paypal.Histograms()
+    paypal.Configuration.configure(
+        instrumentation=paypal.Instrumentation(histograms), **paypal_settings
+    )
+    ...
+    histograms.snapshot()
+    # {'Pay': {'calls': 120, 'acks': {'Success': 118, 'Failure': 2},
+    #          'latency': {'p50': 0.31, 'p99': 0.94, ...}, ...}, ...}
+
+A hook is any object with `before(event)` and `after(event)` methods, called
+with the `CallEvent` of a call when it starts, and once the transport
+returned its response or it failed.  Responses are parsed lazily: hooks
+with a `parsed(event)` method are called again when the response is parsed,
+with its parse time, ack and correlationId (or the error parsing it).
+Without a configured `Instrumentation`, calls are not measured at all.
+"""
+import bisect
+import logging
+import threading
+import time
+
+
+__all__ = [
+    'CallEvent', 'Hook', 'Instrumentation', 'Histogram', 'Histograms',
+    'OpenTelemetryHook',
+]
+
+
+class CallEvent(object):
+    """ Measurements of a single API call, filled in as it progresses
+
+    Times are in seconds, and `None` when not measured:
+
+        `encode_time`: encoding the payload
+        `connect_time`, `tls_time`: opening a TCP connection and negotiating
+            TLS, only when the last attempt did not reuse a connection
+        `ttfb`: from sending the request to receiving the response headers
+        `latency`: from sending the first attempt to receiving the last
+            response, including retries
+        `parse_time`: parsing the response body
+
+    `attempts` counts the requests sent, `response_size` is in bytes, and
+    `ack` and `correlation_id` come from the parsed response.  `error` is
+    the exception the call or parsing failed with, if any.  `parse_time`,
+    `ack` and `correlation_id` are only set once the response is parsed
+
+    Hooks can keep their own state for the call in `context`
+    """
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.time()
+
+        self.encode_time = None
+        self.connect_time = None
+        self.tls_time = None
+        self.ttfb = None
+        self.latency = None
+        self.parse_time = None
+
+        self.attempts = 0
+        self.status_code = None
+        self.response_size = None
+        self.ack = None
+        self.correlation_id = None
+        self.error = None
+
+        self.context = {}
+
+    def __repr__(self):
+        return '<CallEvent {method} {ack} {latency}>'.format(
+            method=self.method,
+            ack=outcome(self),
+            latency=self.latency,
+        )
+
+
+def outcome(event):
+    """ Return the ack of a call, the name of the error it failed with, or
+    `'unknown'` if neither is known (e.g. the response is not parsed yet)
+    """
+    if event.ack:
+        return event.ack
+    if event.error is not None:
+        return type(event.error).__name__
+    return 'unknown'
+
+
+class Hook(object):
+    """ Base class of hooks, ignoring every event """
+
+    def before(self, event):
+        pass
+
+    def after(self, event):
+        pass
+
+    def parsed(self, event):
+        pass
+
+
+class Instrumentation(object):
+    """ Calls `hooks` around every API call
+
+    A failing hook is logged, and does not fail the call
+    """
+
+    def __init__(self, *hooks):
+        self.hooks = list(hooks)
+
+    def add(self, hook):
+        self.hooks.append(hook)
+
+    def start(self, endpoint, method):
+        event = CallEvent(endpoint, method)
+        for hook in self.hooks:
+            try:
+                hook.before(event)
+            except Exception:
+                logging.exception('Instrumentation hook %r failed', hook)
+        return event
+
+    def finish(self, event):
+        for hook in self.hooks:
+            try:
+                hook.after(event)
+            except Exception:
+                logging.exception('Instrumentation hook %r failed', hook)
+
+    def parsed(self, event):
+        for hook in self.hooks:
+            parsed = getattr(hook, 'parsed', None)
+            if parsed is None:
+                continue
+            try:
+                parsed(event)
+            except Exception:
+                logging.exception('Instrumentation hook %r failed', hook)
+
+
+class Histogram(object):
+    """ Thread-safe histogram with exponentially growing buckets, from
+    `lowest` to `highest`
+
+    Percentiles are estimated with a relative error of at most `growth - 1`
+    """
+
+    def __init__(self, lowest=1e-6, highest=600, growth=1.1):
+        self.bounds = [lowest]
+        while self.bounds[-1] < highest:
+            self.bounds.append(self.bounds[-1] * growth)
+
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """ Upper bound of the bucket holding the `q`th percentile (0-100) """
+        if not self.count:
+            return None
+
+        rank = q / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': float(self.sum) / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class Histograms(Hook):
+    """ Hook aggregating the measurements of every call into a `Histogram`
+    per API method and metric, and counting calls by ack or error
+
+    Calls are counted by ack once their response is parsed, or by the error
+    they failed with: responses never parsed are not counted in `acks`
+    """
+
+    timings = (
+        'encode_time', 'connect_time', 'tls_time', 'ttfb', 'latency', 'parse_time',
+    )
+
+    def __init__(self):
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def method(self, name):
+        """ Return the aggregates of an API method, creating them on first use """
+        method = self._methods.get(name)
+        if method is None:
+            with self._lock:
+                method = self._methods.get(name)
+                if method is None:
+                    method = self._methods[name] = {
+                        'calls': 0,
+                        'acks': {},
+                        'response_size': Histogram(lowest=64, highest=64 * 1024 * 1024),
+                    }
+                    for timing in self.timings:
+                        method[timing] = Histogram()
+        return method
+
+    def after(self, event):
+        method = self.method(event.method)
+
+        with self._lock:
+            method['calls'] += 1
+            if event.error is not None:
+                self.count(method, event)
+
+        for timing in self.timings:
+            value = getattr(event, timing)
+            if value is not None:
+                method[timing].record(value)
+        if event.response_size is not None:
+            method['response_size'].record(event.response_size)
+
+    def parsed(self, event):
+        method = self.method(event.method)
+
+        with self._lock:
+            self.count(method, event)
+        method['parse_time'].record(event.parse_time)
+
+    @staticmethod
+    def count(method, event):
+        name = outcome(event)
+        method['acks'][name] = method['acks'].get(name, 0) + 1
+
+    def snapshot(self):
+        """ Return the aggregates of every method as plain dictionaries """
+        snapshot = {}
+        for name, method in self._methods.items():
+            with self._lock:
+                calls, acks = method['calls'], dict(method['acks'])
+            snapshot[name] = {'calls': calls, 'acks': acks}
+            for metric in self.timings + ('response_size',):
+                snapshot[name][metric] = method[metric].summary()
+        return snapshot
+
+
+class OpenTelemetryHook(Hook):
+    """ Hook reporting calls to OpenTelemetry
+
+    With a `tracer`, every call is a span carrying its measurements as
+    attributes.  The span of a call that failed is ended once the transport
+    raised; otherwise it is ended once the response is parsed, with its ack
+    and correlationId, so spans of responses never read are not exported.
+
+    With a `meter`, durations and response sizes are recorded on histograms
+    when the transport returned, with the method, HTTP status code and
+    error type as attributes, and parse times on a histogram of their own,
+    with the method and ack.  Both are used through the OpenTelemetry API
+    only, so the SDK is not required here::
+
+        from opentelemetry import metrics, trace
+
+        hook = paypal.OpenTelemetryHook(
+            tracer=trace.get_tracer('paypal'),
+            meter=metrics.get_meter('paypal'),
+        )
+    """
+
+    def __init__(self, tracer=None, meter=None):
+        self.tracer = tracer
+        self.meter = meter
+
+        if meter is not None:
+            self.duration = meter.create_histogram(
+                'paypal.client.duration', unit='s',
+                description='Duration of PayPal API calls',
+            )
+            self.response_size = meter.create_histogram(
+                'paypal.client.response.size', unit='By',
+                description='Size of PayPal API responses',
+            )
+            self.parse_duration = meter.create_histogram(
+                'paypal.client.parse.duration', unit='s',
+                description='Time spent parsing PayPal API responses',
+            )
+
+    def before(self, event):
+        if self.tracer is not None:
+            event.context[self] = self.tracer.start_span(
+                'PayPal {}'.format(event.method),
+                attributes={
+                    'paypal.method': event.method,
+                    'http.url': event.endpoint,
+                },
+            )
+
+    def after(self, event):
+        if self.meter is not None:
+            # The ack is not known until the response is parsed
+            attributes = {'paypal.method': event.method}
+            if event.status_code is not None:
+                attributes['http.status_code'] = event.status_code
+            if event.error is not None:
+                attributes['error.type'] = type(event.error).__name__
+            if event.latency is not None:
+                self.duration.record(event.latency, attributes=attributes)
+            if event.response_size is not None:
+                self.response_size.record(event.response_size, attributes=attributes)
+
+        span = event.context.get(self)
+        if span is not None:
+            self.set_attributes(span, [
+                ('paypal.attempts', event.attempts),
+                ('http.status_code', event.status_code),
+                ('http.response_content_length', event.response_size),
+                ('paypal.encode_time', event.encode_time),
+                ('paypal.connect_time', event.connect_time),
+                ('paypal.tls_time', event.tls_time),
+                ('paypal.ttfb', event.ttfb),
+                ('paypal.latency', event.latency),
+            ])
+            if event.error is not None:
+                self.end(event)
+
+    def parsed(self, event):
+        if self.meter is not None:
+            self.parse_duration.record(event.parse_time, attributes={
+                'paypal.method': event.method,
+                'paypal.ack': outcome(event),
+            })
+
+        span = event.context.get(self)
+        if span is not None:
+            self.set_attributes(span, [
+                ('paypal.ack', event.ack),
+                ('paypal.correlation_id', event.correlation_id),
+                ('paypal.parse_time', event.parse_time),
+            ])
+            self.end(event)
+
+    @staticmethod
+    def set_attributes(span, attributes):
+        for name, value in attributes:
+            if value is not None:
+                span.set_attribute(name, value)
+
+    def end(self, event):
+        span = event.context.pop(self)
+        if event.error is not None:
+            span.record_exception(event.error)
+        span.end()
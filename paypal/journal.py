@@ -0,0 +1,307 @@
+""" Write-ahead journal of payments, to find out which payments went out
+after a crash
+
+Usage::
+
+    journal = paypal.WriteAheadJournal('/var/lib/myapp/paypal.journal')
+    paypal.Configuration.configure(journal=journal, **paypal_settings)
+
+    # After a crash
+    for intent in journal.in_doubt():
+        intent['id'], intent['receivers']
+    for result in paypal.AdaptivePayments.resolve_in_doubt():
+        ...
+
+With a journal configured, `AdaptivePayments.pay` records the intent of a
+payment (its trackingId, receivers and amounts) before sending it, and its
+outcome (payKey, ack and correlationId) once the response is parsed.
+Payments with an intent but no outcome are in doubt: they may or may not
+have been made.
+
+The journal is an append-only log file of fixed size, read back through a
+memory map when opened.  Intents are durable before the payment is sent;
+concurrent writers share a single sync of the file (group commit).
+Outcomes are synced with the next intent: an outcome lost in a crash leaves
+its payment in doubt, to be resolved through PayPal
+
+A journal is locked by the process opening it: with several processes
+(e.g. prefork workers), give each its own journal, opened after forking
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .exceptions import PaypalError
+
+
+__all__ = [
+    'JournalError', 'WriteAheadJournal',
+]
+
+
+class JournalError(PaypalError):
+    pass
+
+
+# Record length and CRC-32 of the record
+HEADER = struct.Struct('<II')
+
+
+# Sorting keys would rule out the C encoder
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def encode_record(record):
+    data = _encoder.encode(record).encode('utf-8')
+    return HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+# Syncs file contents, and metadata only as needed to read them back
+fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+
+def lock(fd, path):
+    """ Lock the file open as `fd` for this process, raising `JournalError`
+    if another process holds it
+    """
+    if fcntl is None:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        os.close(fd)
+        raise JournalError('Journal {} is in use by another process'.format(path))
+
+
+class WriteAheadJournal(object):
+    """ Journal in the file at `path`, of at least `size` bytes
+
+    Records are JSON objects with an `op` (`intent` or `outcome`), the `id`
+    of the operation and the `time` it was recorded.  When the file is full,
+    it is rewritten with the intents in doubt only.  A record torn by a
+    crash ends the journal, and is dropped with the records following it
+
+    A journal must only be used by one process at a time: opening a journal
+    in use raises `JournalError`, as does writing to a journal opened
+    before forking
+    """
+
+    INTENT = 'intent'
+    OUTCOME = 'outcome'
+
+    def __init__(self, path, size=64 * 1024 * 1024):
+        self.path = path
+        self.size = size
+
+        # Syncs of the file, and records written
+        self.commits = 0
+        self.records = 0
+
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = False
+
+        # Bytes written and synced since opening, which unlike offsets in
+        # the file keep growing when it is compacted
+        self._written = 0
+        self._durable = 0
+
+        # Intents without outcome, by operation id
+        self._in_doubt = OrderedDict()
+
+        # Offset of the end of the records in the file
+        self._end = 0
+
+        self._fd = None
+        self._pid = None
+        self._open()
+
+    def __repr__(self):
+        return '<WriteAheadJournal {path} {in_doubt} in doubt>'.format(
+            path=self.path, in_doubt=len(self._in_doubt),
+        )
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        lock(self._fd, self.path)
+        self._pid = os.getpid()
+        if os.fstat(self._fd).st_size < self.size:
+            os.ftruncate(self._fd, self.size)
+
+        self._in_doubt.clear()
+        journal = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+        try:
+            end = 0
+            for end, record in self._scan(journal):
+                if record['op'] == self.INTENT:
+                    self._in_doubt[record['id']] = record
+                else:
+                    self._in_doubt.pop(record['id'], None)
+            torn = journal[end:end + HEADER.size] != b'\0' * HEADER.size
+            size = len(journal)
+        finally:
+            journal.close()
+
+        # Clear what follows a torn record, so that it is not mistaken for
+        # records once overwritten
+        if torn:
+            os.lseek(self._fd, end, os.SEEK_SET)
+            chunk = b'\0' * (1024 * 1024)
+            for offset in range(end, size, len(chunk)):
+                os.write(self._fd, chunk[:size - offset])
+            fdatasync(self._fd)
+
+        self._end = end
+        self._size = size
+
+    @staticmethod
+    def _scan(journal):
+        """ Generate `(end, record)` for every valid record of the mapped
+        `journal`
+        """
+        offset = 0
+        limit = len(journal)
+        while offset + HEADER.size <= limit:
+            length, crc = HEADER.unpack_from(journal, offset)
+            start, end = offset + HEADER.size, offset + HEADER.size + length
+            if not length or end > limit:
+                return
+
+            data = journal[start:end]
+            if zlib.crc32(data) & 0xffffffff != crc:
+                return
+            try:
+                record = json.loads(data.decode('utf-8'))
+            except ValueError:
+                return
+
+            yield end, record
+            offset = end
+
+    def intent(self, operation_id, **fields):
+        """ Record an operation about to be made, returning once the record
+        is synced to disk
+        """
+        record = dict(fields, op=self.INTENT, id=operation_id, time=time.time())
+        self.commit(self._append(record))
+
+    def outcome(self, operation_id, **fields):
+        """ Record the outcome of an operation, synced with the next intent
+        or `sync`
+        """
+        record = dict(fields, op=self.OUTCOME, id=operation_id, time=time.time())
+        self._append(record)
+
+    def in_doubt(self):
+        """ Return the intents without an outcome, oldest first """
+        with self._lock:
+            return [dict(record) for record in self._in_doubt.values()]
+
+    def _append(self, record):
+        """ Write `record`, returning the bytes written so far """
+        entry = encode_record(record)
+
+        # The lock of the file is inherited across a fork
+        if os.getpid() != self._pid:
+            raise JournalError('Journal {} was opened by another process'.format(self.path))
+
+        with self._lock:
+            if self._end + len(entry) > self._size:
+                self._compact(len(entry))
+
+            os.lseek(self._fd, self._end, os.SEEK_SET)
+            os.write(self._fd, entry)
+            self._end += len(entry)
+            self._written += len(entry)
+            self.records += 1
+
+            if record['op'] == self.INTENT:
+                self._in_doubt[record['id']] = record
+            else:
+                self._in_doubt.pop(record['id'], None)
+
+            return self._written
+
+    def commit(self, written):
+        """ Wait until the first `written` bytes are synced to disk
+
+        One waiting thread syncs everything written so far while the others
+        wait for it, so concurrent records share a single sync
+        """
+        with self._lock:
+            while self._durable < written:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+
+                self._syncing = True
+                stop = self._written
+                self._lock.release()
+                try:
+                    fdatasync(self._fd)
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._synced.notify_all()
+
+                self._durable = stop
+                self.commits += 1
+
+    def sync(self):
+        """ Sync every record written so far to disk """
+        with self._lock:
+            written = self._written
+        self.commit(written)
+
+    def _compact(self, needed):
+        """ Rewrite the journal with the intents in doubt only, with room for
+        `needed` more bytes.  Called with the lock held
+        """
+        # The file is not replaced while syncing
+        while self._syncing:
+            self._synced.wait()
+
+        content = b''.join(encode_record(record) for record in self._in_doubt.values())
+        size = max(self.size, 2 * (len(content) + needed))
+
+        path = self.path + '.compact'
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        # Locked before replacing the journal, for processes opening it next
+        lock(fd, path)
+        try:
+            os.write(fd, content)
+            os.ftruncate(fd, size)
+            os.fsync(fd)
+        except Exception:
+            os.close(fd)
+            raise
+        os.rename(path, self.path)
+
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        os.close(self._fd)
+        self._fd = fd
+        self._end = len(content)
+        self._size = size
+        # Everything written so far is on disk, either in the new file or
+        # not needed anymore
+        self._durable = self._written
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            os.close(self._fd)
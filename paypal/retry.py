@@ -0,0 +1,160 @@
+""" Retrying of API requests failing for transient reasons """
+import random
+import threading
+import time
+
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+
+__all__ = [
+    'RetryPolicy', 'RetryBudget',
+]
+
+
+def failed_to_connect(error):
+    """ Returns true if a request raising `error` never reached the server:
+    connecting timed out or was refused
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps the urllib3 error, e.g. MaxRetryError(reason=...)
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, 'reason', cause), NewConnectionError)
+
+
+class RetryBudget(object):
+    """ Limits retries to a fraction of the calls made, across all calls
+    sharing the budget, so that an outage does not multiply the load sent
+    to PayPal
+
+    Every call deposits `ratio` retries into the budget, up to `maximum`,
+    and every retry withdraws one.  The budget starts with `minimum`
+    retries, and never holds less than that.
+    """
+
+    def __init__(self, ratio=0.1, minimum=10, maximum=100):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self._balance = float(minimum)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.maximum)
+
+    def withdraw(self):
+        """ Returns true if a retry is allowed """
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    @property
+    def balance(self):
+        return self._balance
+
+
+class RetryPolicy(object):
+    """ Retry API requests on connection errors, 5xx responses and
+    transient PayPal errors
+
+    Retries wait an exponentially growing, randomly jittered delay of up to
+    `backoff * 2 ** retry` seconds (capped at `max_backoff`).  A call is
+    attempted at most `max_attempts` times, and gives up once `deadline`
+    seconds have passed since the first attempt.  `budget` is shared by all
+    calls made with this policy, see `RetryBudget`.
+
+    Requests which may have reached PayPal are only sent again if they are
+    idempotent, see `PaypalAPIRequest.post`
+
+    Usage::
+
+        policy = paypal.RetryPolicy(max_attempts=4, deadline=20)
+        paypal.Configuration.configure(..., retry_policy=policy)
+    """
+
+    # Error ids of PayPal responses worth retrying ("Internal Error")
+    transient_error_ids = frozenset([
+        '520002',  # Adaptive Payments, Permissions
+        '10001',  # Merchant (NVP)
+    ])
+
+    def __init__(
+        self, max_attempts=3, backoff=0.1, max_backoff=5, deadline=None,
+        budget=None, transient_error_ids=None
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.budget = budget or RetryBudget()
+
+        if transient_error_ids is not None:
+            self.transient_error_ids = frozenset(transient_error_ids)
+
+    def delay(self, retry):
+        """ Seconds to wait before retry number `retry` (starting at 1) """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def transient(self, response, error_ids):
+        """ Returns true if `response` is worth retrying """
+        if response.status_code >= 500:
+            return True
+        return any(error_id in self.transient_error_ids for error_id in error_ids)
+
+    def call(self, send, error_ids, idempotent=True, before_retry=None):
+        """ Call `send(timeout)` until it returns a non-transient response
+
+        `error_ids(response)` returns the PayPal error ids of a response.
+        `timeout` is `None`, or the seconds left until the deadline.
+
+        If `idempotent` is false, only requests which failed to connect are
+        retried.  `before_retry` is called before sending a request again
+        which may have reached PayPal, and can return a response to use
+        instead of sending it again.
+
+        Returns the last response once attempts, deadline or budget are
+        exhausted, or raises the last connection error
+        """
+        start = time.time()
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            timeout = None
+            if self.deadline is not None:
+                timeout = max(self.deadline - (time.time() - start), 0.001)
+
+            error = response = None
+            try:
+                response = send(timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, delivered = e, not failed_to_connect(e)
+            else:
+                delivered = True
+                if not self.transient(response, error_ids(response)):
+                    self.budget.deposit()
+                    return response
+
+            delay = self.delay(attempt)
+            if (
+                attempt >= self.max_attempts or
+                (delivered and not idempotent and before_retry is None) or
+                (self.deadline is not None and time.time() - start + delay >= self.deadline) or
+                not self.budget.withdraw()
+            ):
+                if error is not None:
+                    raise error
+                return response
+
+            time.sleep(delay)
+
+            if delivered and before_retry is not None:
+                replacement = before_retry()
+                if replacement is not None:
+                    return replacement
@@ -0,0 +1,219 @@
+""" HTTP transports used to send API requests to PayPal
+
+A transport is any object with a `post(url, data=None, headers=None, **kwargs)`
+method that returns a `requests.Response` (or something that quacks like
+one).  `Configuration` owns the transport, so tests can swap in a fake::
+
+    class FakeTransport(object):
+        def post(self, url, data=None, headers=None, **kwargs):
+            ...
+
+    config = paypal.Configuration(..., transport=FakeTransport())
+"""
+import threading
+import time
+import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3 import connection, connectionpool
+
+
+__all__ = [
+    'Transport', 'UnpooledTransport', 'pop_connect_timings',
+]
+
+
+# Timings of the connections opened by the current thread, see
+# `pop_connect_timings`
+_timings = threading.local()
+
+
+def pop_connect_timings():
+    """ Return and reset `(connect, tls)`, the seconds spent by the current
+    thread opening TCP connections and negotiating TLS through a `Transport`
+
+    Both are `None` if no connection was opened, e.g. when reusing a pooled
+    connection
+    """
+    timings = getattr(_timings, 'value', None)
+    _timings.value = None
+    return timings or (None, None)
+
+
+class TimedHTTPConnection(connection.HTTPConnection):
+    def _new_conn(self):
+        started = time.time()
+        conn = super(TimedHTTPConnection, self)._new_conn()
+        _timings.value = (time.time() - started, None)
+        return conn
+
+
+class TimedHTTPSConnection(connection.HTTPSConnection):
+    def _new_conn(self):
+        started = time.time()
+        conn = super(TimedHTTPSConnection, self)._new_conn()
+        self._connected = time.time()
+        _timings.value = (self._connected - started, None)
+        return conn
+
+    def connect(self):
+        super(TimedHTTPSConnection, self).connect()
+        connect = getattr(_timings, 'value', None)
+        if connect is not None:
+            _timings.value = (connect[0], time.time() - self._connected)
+
+
+class TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class ClosingPoolMixin(object):
+    """ Close connections as they are put back in the pool, so that the
+    next request opens a new one instead of reusing a connection the server
+    may be closing
+    """
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.close()
+        super(ClosingPoolMixin, self)._put_conn(conn)
+
+
+class ClosingHTTPConnectionPool(ClosingPoolMixin, TimedHTTPConnectionPool):
+    pass
+
+
+class ClosingHTTPSConnectionPool(ClosingPoolMixin, TimedHTTPSConnectionPool):
+    pass
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """ Adapter recording connect and TLS times, see `pop_connect_timings`
+
+    Without `keep_alive`, connections are closed once their response was read
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ['keep_alive']
+
+    def __init__(self, keep_alive=True, **kwargs):
+        self.keep_alive = keep_alive
+        super(TimedHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        if self.keep_alive:
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': TimedHTTPConnectionPool,
+                'https': TimedHTTPSConnectionPool,
+            }
+        else:
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': ClosingHTTPConnectionPool,
+                'https': ClosingHTTPSConnectionPool,
+            }
+
+
+class Transport(object):
+    """ Pooled, keep-alive HTTP transport
+
+    Keeps one `requests.Session` per host (scheme and netloc), so that
+    consecutive calls to e.g. svcs.paypal.com reuse an already established
+    TCP+TLS connection instead of performing a new handshake every time
+
+    Sessions are created lazily and are shared between threads; each session
+    keeps up to `pool_size` connections open to its host
+
+    `connect_timeout` and `read_timeout` are applied to every request, unless
+    a `timeout` is passed explicitly to `post`
+
+    Usage::
+
+        transport = paypal.Transport(pool_size=20, read_timeout=10)
+        paypal.Configuration.configure(..., transport=transport)
+    """
+
+    def __init__(
+        self, pool_size=10, keep_alive=True,
+        connect_timeout=3.05, read_timeout=30, verify=True
+    ):
+        super(Transport, self).__init__()
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.verify = verify
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def session(self, url):
+        """ Return the shared session for the host of `url` """
+        scheme, netloc = urlparse.urlsplit(url)[:2]
+        key = (scheme, netloc)
+
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._sessions[key] = self.create_session()
+        return session
+
+    def create_session(self):
+        session = requests.Session()
+
+        adapter = TimedHTTPAdapter(
+            keep_alive=self.keep_alive,
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+
+        return session
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        # Passed per request, since `Session.verify` loses to REQUESTS_CA_BUNDLE
+        kwargs.setdefault('verify', self.verify)
+        return self.session(url).post(url, data=data, headers=headers, **kwargs)
+
+    def close(self):
+        """ Close all pooled connections """
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+class UnpooledTransport(object):
+    """ Transport opening a new connection for every request
+
+    Mostly useful as a baseline when benchmarking `Transport`
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=30, verify=True):
+        super(UnpooledTransport, self).__init__()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.verify = verify
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        kwargs.setdefault('verify', self.verify)
+        return requests.post(url, data=data, headers=headers, **kwargs)
+
+    def close(self):
+        pass
@@ -1,11 +1,22 @@
-import functools
+import array
+import calendar
+import contextlib
+import datetime
+import itertools
+import os
+import sqlite3
+import threading
+import urllib
 import urlparse
 import time
 import hmac
 import hashlib
 import base64
 import re
-from collections import OrderedDict
+import types
+from collections import OrderedDict, namedtuple
+
+from concurrent import futures
 
 
 class MixedMethod(object):
@@ -27,61 +38,202 @@ class MixedMethod(object):
         self.func = func
 
     def __get__(self, instance, cls):
-        @functools.wraps(self.func)
-        def wrapper(*args, **kwargs):
-            return self.func(instance or cls, *args, **kwargs)
+        if instance is not None:
+            # Not cached: a cache held by the instance would form a
+            # reference cycle, keeping it alive until the garbage collector
+            # runs
+            return types.MethodType(self.func, instance)
+        try:
+            return cls.__dict__['_mixedmethods'][self]
+        except KeyError:
+            return self.bind(cls)
+
+    def bind(self, cls):
+        """ Bind the function to `cls`, caching the bound method in the
+        class so that later lookups don't allocate
+        """
+        method = types.MethodType(self.func, cls)
 
-        return wrapper
+        cache = cls.__dict__.get('_mixedmethods')
+        if cache is None:
+            cache = {}
+            setattr(cls, '_mixedmethods', cache)
+        cache[self] = method
+        return method
 
 mixedmethod = MixedMethod
 
 
+def bounded(call, items, max_in_flight=10):
+    """ Fan out `call(item)` over `items`, keeping at most `max_in_flight`
+    calls running at once
+
+    `call` must return a future, e.g. a method of an async API.  `items`
+    is consumed lazily, and `(item, future)` pairs are generated in
+    completion order, so failures can be inspected per item::
+
+        paykeys = [...]
+        for paykey, future in bounded(
+            lambda paykey: AsyncAdaptivePayments.payment_details(paykey=paykey),
+            paykeys,
+            max_in_flight=20,
+        ):
+            if future.exception():
+                ...
+
+    If `items` or `call` raise, or the generator is closed early, calls not
+    started yet are cancelled and running ones are waited for, so none is
+    left running once the exception reaches the caller
+    """
+    pending = {}
+
+    try:
+        for item in items:
+            if len(pending) >= max_in_flight:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future
+
+            pending[call(item)] = item
+
+        for future in futures.as_completed(list(pending)):
+            yield pending.pop(future), future
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        futures.wait(pending)
+        raise
+
+
+# SQLite connections of the current thread, see `sqlite_connection`
+_sqlite = threading.local()
+
+
+def sqlite_connection(path, *statements):
+    """ Return the connection of the current thread to the SQLite database
+    at `path`, in autocommit mode, running `statements` (e.g. pragmas and
+    table creations) when it is opened
+
+    Connections can't be shared between threads, nor across a fork, so one
+    is opened per thread and process, for every `path` and `statements`
+    """
+    connections = getattr(_sqlite, 'connections', None)
+    if connections is None or _sqlite.pid != os.getpid():
+        connections = _sqlite.connections = {}
+        _sqlite.pid = os.getpid()
+
+    connection = connections.get((path, statements))
+    if connection is None:
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        for statement in statements:
+            connection.execute(statement)
+        connections[path, statements] = connection
+    return connection
+
+
+@contextlib.contextmanager
+def sqlite_transaction(connection):
+    """ Run the block in a transaction of `connection`, taking the write
+    lock of the database right away, and rolled back if the block raises
+    """
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
 def oauth_header(consumer_key, consumer_secret, token, token_secret, http_method, url):
+    """ Sign a single request, see `OAuthSigner` to sign many with the same
+    credentials
+    """
+    signer = OAuthSigner(consumer_key, consumer_secret, token, token_secret)
+    return signer.header(http_method, url)
 
-    timestamp = int(time.time())
-    key = '{consumer_secret}&{token_secret}'.format(
-        consumer_secret=consumer_secret,
-        token_secret=oauth_encode(token_secret)
-    )
 
-    params = '&'.join(
-        '{}={}'.format(key, value)
-        for key, value in [
-            ('oauth_consumer_key', consumer_key),
-            ('oauth_signature_method', 'HMAC-SHA1'),
-            ('oauth_timestamp', timestamp),
-            ('oauth_token', token),
-            ('oauth_version', '1.0'),
-        ]
-    )
+class OAuthSigner(object):
+    """ Signs requests with `X-PP-AUTHORIZATION` headers for a consumer and
+    a token
 
-    raw = '{http_method}&{url}&{params}'.format(
-        http_method=http_method,
-        url=oauth_encode(url),
-        params=oauth_encode(params)
-    )
+    The keyed HMAC and the encoded parameters around the timestamp are built
+    once, and encoded urls are cached per endpoint, so that signing only
+    hashes the request line
+
+    Usage::
+
+        signer = OAuthSigner(userid, password, token, token_secret)
+        headers = signer.header('POST', url)
+    """
 
-    hashed = hmac.new(str(key), str(raw), hashlib.sha1)
-    signature = base64.b64encode(hashed.digest())
+    def __init__(self, consumer_key, consumer_secret, token, token_secret):
+        self.consumer_key = consumer_key
+        self.token = token
 
-    return {
-        'X-PP-AUTHORIZATION': 'token={token},signature={signature},timestamp={timestamp}'.format(
+        key = '{consumer_secret}&{token_secret}'.format(
+            consumer_secret=consumer_secret,
+            token_secret=oauth_encode(token_secret)
+        )
+        self._hmac = hmac.new(str(key), digestmod=hashlib.sha1)
+
+        # Encoding is per character, so the parameters can be encoded in
+        # parts, the timestamp in between being left unchanged
+        self._params_head = oauth_encode(
+            'oauth_consumer_key={}&oauth_signature_method=HMAC-SHA1&oauth_timestamp='.format(consumer_key)
+        )
+        self._params_tail = oauth_encode(
+            '&oauth_token={}&oauth_version=1.0'.format(token)
+        )
+        self._urls = {}
+
+    def header(self, http_method, url, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        encoded_url = self._urls.get(url)
+        if encoded_url is None:
+            encoded_url = self._urls[url] = oauth_encode(url)
+
+        raw = '{http_method}&{url}&{head}{timestamp}{tail}'.format(
+            http_method=http_method,
+            url=encoded_url,
+            head=self._params_head,
             timestamp=timestamp,
-            token=token,
-            signature=signature,
-        ),
-    }
+            tail=self._params_tail,
+        )
+
+        hashed = self._hmac.copy()
+        hashed.update(str(raw))
+        signature = base64.b64encode(hashed.digest())
 
+        return {
+            'X-PP-AUTHORIZATION': 'token={token},signature={signature},timestamp={timestamp}'.format(
+                timestamp=timestamp,
+                token=self.token,
+                signature=signature,
+            ),
+        }
 
-oauth_encode_re = re.compile(r'([A-Za-z0-9_ ]+)')
+
+# Encoding of every byte value: alphanumerics and underscores are kept,
+# spaces become `+` and everything else is escaped with lowercase hex
+oauth_safe = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_')
+oauth_encode_table = [
+    '+' if c == ' ' else c if c in oauth_safe else '%' + hex(ord(c))[2:]
+    for c in map(chr, range(256))
+]
 
 
 def oauth_encode(raw):
-    translate = {' ': '+'}
-    return ''.join(
-        "%" + hex(ord(c))[2:] if not re.match(oauth_encode_re, c) else translate.get(c, c)
-        for c in raw
-    )
+    try:
+        return ''.join([oauth_encode_table[ord(c)] for c in raw])
+    except IndexError:
+        # Unicode beyond latin-1
+        return ''.join(
+            oauth_encode_table[ord(c)] if ord(c) < 256 else '%' + hex(ord(c))[2:]
+            for c in raw
+        )
 
 
 def parse_nvp(nvp):
@@ -90,3 +242,180 @@ def parse_nvp(nvp):
 
 
 nvp_array_re = re.compile('^(?P<key>L_.*\D)(?P<index>\d+)$')
+
+
+def decode_nvp(nvp, exclude=()):
+    """ Decode a name-value-pair response in a single pass
+
+    Returns a tuple of
+
+    - the response dictionary, as `parse_nvp` would return it
+    - the collapsed response, with arrays such as `L_TRANSACTIONID0`,
+      `L_TRANSACTIONID1` gathered in a list under `L_TRANSACTIONID`
+    - the list of rows, each a dictionary of the array values at an index
+      keyed on the array name without `L_` (arrays in `exclude` excluded)
+
+    Array indices must be increasing for each array, otherwise `IndexError`
+    is raised.  Missing indices are padded with `None`, and rows are
+    truncated to the shortest array, e.g.::
+
+        L_TRANSACTIONID0=1&L_TIMESTAMP0=3&L_TRANSACTIONID1=2&L_TIMESTAMP2=5
+
+    decodes to the rows::
+
+        [{'TRANSACTIONID': '1', 'TIMESTAMP': '3'},
+         {'TRANSACTIONID': '2', 'TIMESTAMP': None}]
+    """
+    response = {}
+    collapsed = {}
+    rows = []
+    row_keys = {}
+
+    for pair in nvp.split('&'):
+        name, _, value = pair.partition('=')
+        if not value:
+            # Blank values are dropped, as in `parse_nvp`
+            continue
+
+        if '%' in name or '+' in name:
+            name = urllib.unquote_plus(name)
+        if '%' in value or '+' in value:
+            value = urllib.unquote_plus(value)
+
+        response[name] = value
+
+        if not name.startswith('L_'):
+            collapsed[name] = value
+            continue
+
+        key = name.rstrip('0123456789')
+        if len(key) < 3 or len(key) == len(name):
+            # Not an array, e.g. `L_` or `L_NAME`
+            collapsed[name] = value
+            continue
+
+        index = int(name[len(key):])
+
+        values = collapsed.get(key)
+        if values is None:
+            values = collapsed[key] = []
+
+        if index < len(values):
+            # E.g. we've hit a key like L_TRANSACTIONID2 after hitting a key like L_TRANSACTIONID3
+            raise IndexError('Index mismatch parsing NVP response, perhaps lost order?')
+
+        if index > len(values):
+            # E.g. we've hit a key like L_TRANSACTIONID2 without hitting a key like L_TRANSACTIONID1
+            # Assume L_TRANSACTIONID1 is missing and pad with None
+            values.extend([None] * (index - len(values)))
+
+        values.append(value)
+
+        if key in exclude:
+            continue
+
+        row_key = row_keys.get(key)
+        if row_key is None:
+            row_key = row_keys[key] = key[2:]
+
+        while len(rows) <= index:
+            rows.append({})
+        rows[index][row_key] = value
+
+    if rows:
+        del rows[min(len(collapsed[key]) for key in row_keys):]
+
+        # Fill in values padded with None
+        for row in rows:
+            if len(row) < len(row_keys):
+                for key, row_key in row_keys.iteritems():
+                    row.setdefault(row_key, None)
+
+    return response, collapsed, rows
+
+
+def parse_datetime(value):
+    """ Parse a PayPal timestamp into a naive UTC datetime
+
+    Handles both the NVP format (`2014-10-21T18:15:53Z`) and the format of
+    the JSON APIs (`2014-10-21T11:15:53.861-07:00`), as well as plain dates
+    (`2014-10-21`)
+    """
+    if len(value) == 10:
+        return datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+    offset = 0
+    if value.endswith('Z'):
+        value = value[:-1]
+    elif len(value) > 19 and value[-6] in '+-' and value[-3] == ':':
+        offset = int(value[-5:-3]) * 60 + int(value[-2:])
+        if value[-6] == '-':
+            offset = -offset
+        value = value[:-6]
+
+    microsecond = 0
+    if len(value) > 20 and value[19] == '.':
+        microsecond = int(value[20:26].ljust(6, '0'))
+
+    timestamp = datetime.datetime(
+        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19]),
+        microsecond,
+    )
+    return timestamp - datetime.timedelta(minutes=offset)
+
+
+class Record(object):
+    """ Mixin for the compact records built by `record_type` """
+    __slots__ = ()
+
+    def as_dict(self):
+        return dict(itertools.izip(self._fields, self))
+
+
+_record_types = {}
+
+
+def record_type(fields):
+    """ Return a namedtuple-based `Record` type with a field per name
+
+    Records carry no per-instance dictionary.  Types are created once per
+    distinct tuple of `fields`::
+
+        Transaction = record_type(('TRANSACTIONID', 'AMT'))
+        transaction = Transaction('9JH123', Decimal('10.00'))
+        transaction.AMT
+        transaction.as_dict()
+    """
+    fields = tuple(fields)
+    cls = _record_types.get(fields)
+    if cls is None:
+        cls = type('Record', (namedtuple('Record', fields), Record), {'__slots__': ()})
+        cls = _record_types.setdefault(fields, cls)
+    return cls
+
+
+# Typecode of 64 bit signed integer arrays.  'q' is Python 3 only, and
+# 'l' only 64 bit on platforms with 64 bit C longs: elsewhere (e.g.
+# Windows) fall back to doubles, which hold integers exactly up to 2 ** 53
+try:
+    array.array('q')
+    INT64 = 'q'
+except ValueError:
+    INT64 = 'l' if array.array('l').itemsize >= 8 else 'd'
+
+
+def parse_cents(value):
+    """ Parse a PayPal amount such as `-0.59` into an integer number of cents """
+    sign = 1
+    if value[:1] == '-':
+        sign = -1
+        value = value[1:]
+
+    whole, _, fraction = value.partition('.')
+    return sign * (int(whole or 0) * 100 + int((fraction + '00')[:2]))
+
+
+def parse_epoch(value):
+    """ Parse a PayPal timestamp into seconds since the epoch """
+    return calendar.timegm(parse_datetime(value).timetuple())
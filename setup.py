@@ -5,9 +5,10 @@ setup(
     version='0.1.0',    
     description='Allows interacting with PayPal payments gateway',
     url='https://github.com/brstrat/paypal',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=[
         'requests',                     
+        'futures; python_version < "3"',
     ],
 )
 
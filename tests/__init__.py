@@ -0,0 +1,4 @@
+""" Tests against the local stub server of the benchmarks
+
+    python -m unittest discover -s tests -t .
+"""
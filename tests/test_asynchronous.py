@@ -0,0 +1,71 @@
+""" Non-blocking APIs, resolving futures on a thread pool """
+import unittest
+
+from concurrent import futures
+
+from paypal import (
+    AsyncAdaptivePayments, AsyncMerchant, AsyncPaypalAPIRequest, AsyncPermissions,
+    Configuration, GetPermissionsResponse, PaymentDetails, PaypalAPIError,
+    TransactionSearchResponse,
+)
+
+from benchmarks import stub
+
+
+class AsyncAPITest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub.StubServer(routes=stub.paypal_routes(rows=1)).start()
+        self.config = Configuration(stub.environment(self.server), 'userid', 'password', 'signature')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_futures_resolve_to_responses(self):
+        details = AsyncAdaptivePayments(self.config).payment_details(paykey='AP-1')
+        permissions = AsyncPermissions(self.config).get_permissions('token')
+        search = AsyncMerchant(self.config).transaction_search('token', 'secret')
+
+        self.assertIsInstance(details, futures.Future)
+        self.assertIsInstance(details.result(), PaymentDetails)
+        self.assertTrue(details.result().success)
+        self.assertIsInstance(permissions.result(), GetPermissionsResponse)
+        self.assertIsInstance(search.result(), TransactionSearchResponse)
+        self.assertEqual(len(list(search.result().transactions)), 1)
+
+    def test_errors_are_set_on_the_future(self):
+        self.server.routes['/AdaptivePayments/PaymentDetails'] = (
+            502, 'text/html', '<html>Bad Gateway</html>',
+        )
+        future = AsyncAdaptivePayments(self.config).payment_details(paykey='AP-1')
+        self.assertIsInstance(future.exception(), PaypalAPIError)
+
+    def test_executor(self):
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            api = AsyncAdaptivePayments(self.config, executor=executor)
+            self.assertIs(api.executor(), executor)
+            self.assertTrue(api.payment_details(paykey='AP-1').result().success)
+        finally:
+            executor.shutdown()
+
+        # Without one, every async API shares the default pool
+        self.assertIs(
+            AsyncAdaptivePayments(self.config).executor(),
+            AsyncPermissions(self.config).executor(),
+        )
+        self.assertIs(
+            AsyncMerchant.executor(),
+            AsyncPaypalAPIRequest._default_executor,
+        )
+
+    def test_deferred_methods(self):
+        self.assertEqual(AsyncAdaptivePayments.pay.__name__, 'pay')
+        self.assertEqual(
+            AsyncAdaptivePayments.payment_details.__doc__,
+            'Non-blocking `payment_details`, returns a future',
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
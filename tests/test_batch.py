@@ -0,0 +1,155 @@
+""" Concurrent lookups of many keys, and fan-out of futures """
+import json
+import threading
+import time
+import unittest
+
+from concurrent import futures
+
+from paypal import AdaptivePayments, Configuration, PaypalAPIError, batch, bounded
+
+from benchmarks import stub
+
+
+class Calls(object):
+    """ Call recording how many calls started and finished, sleeping
+    `duration` seconds (or `slow` seconds for keys in `slow_keys`), and
+    raising for keys in `failing`
+    """
+
+    def __init__(self, duration=0.05, failing=(), slow=0.2, slow_keys=()):
+        self.duration = duration
+        self.slow = slow
+        self.slow_keys = slow_keys
+        self.failing = failing
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, key):
+        with self.lock:
+            self.started.append(key)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(self.slow if key in self.slow_keys else self.duration)
+        with self.lock:
+            self.running -= 1
+            self.finished.append(key)
+        if key in self.failing:
+            raise ValueError(key)
+        return key
+
+
+def keys(count, error=None):
+    """ Generate `count` keys, then raise `error` if any """
+    for key in range(count):
+        yield key
+    if error is not None:
+        raise error
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_results_per_key(self):
+        calls = Calls(failing=(3,))
+        results = list(batch(calls, keys(10), max_workers=4))
+
+        self.assertEqual(sorted(result.key for result in results), range(10))
+        [failed] = [result for result in results if result.error is not None]
+        self.assertEqual(failed.key, 3)
+        self.assertIsInstance(failed.error, ValueError)
+        self.assertEqual(
+            sorted(result.response for result in results if result.error is None),
+            [key for key in range(10) if key != 3],
+        )
+        self.assertLessEqual(calls.most_running, 4)
+
+    def test_failing_keys_wait_for_running_lookups(self):
+        calls = Calls(duration=0.1)
+        results = []
+        with self.assertRaises(IOError):
+            for result in batch(calls, keys(3, IOError('Failed reading keys')), max_workers=2):
+                results.append(result)
+
+        # Nothing left running once the caller sees the error
+        finished = list(calls.finished)
+        self.assertEqual(sorted(calls.started), sorted(finished))
+        time.sleep(0.15)
+        self.assertEqual(calls.finished, finished)
+
+    def test_closed_batch_waits_for_running_lookups(self):
+        calls = Calls(duration=0, slow_keys=(1,))
+        results = batch(calls, keys(10), max_workers=2)
+        self.assertEqual(next(results).key, 0)
+        # Key 1 is still running
+        results.close()
+
+        started = list(calls.started)
+        self.assertEqual(sorted(started), sorted(calls.finished))
+        self.assertLess(len(started), 10)
+        time.sleep(0.25)
+        self.assertEqual(calls.started, started)
+
+
+class BoundedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = futures.ThreadPoolExecutor(max_workers=10)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_completion_order(self):
+        def call(key):
+            return self.executor.submit(time.sleep, key)
+
+        done = [key for key, future in bounded(call, [0.2, 0.1, 0], max_in_flight=3)]
+        self.assertEqual(done, [0, 0.1, 0.2])
+
+    def test_max_in_flight(self):
+        calls = Calls()
+        results = list(bounded(
+            lambda key: self.executor.submit(calls, key), keys(10), max_in_flight=3,
+        ))
+
+        self.assertEqual(sorted(key for key, _ in results), range(10))
+        self.assertEqual(calls.most_running, 3)
+
+    def test_failing_items_wait_for_running_calls(self):
+        calls = Calls(duration=0.1)
+        with self.assertRaises(IOError):
+            list(bounded(
+                lambda key: self.executor.submit(calls, key),
+                keys(2, IOError('Failed reading keys')),
+            ))
+        self.assertEqual(sorted(calls.finished), [0, 1])
+
+
+class PaymentDetailsBatchTest(unittest.TestCase):
+
+    def test_failing_lookup_has_its_own_result(self):
+        def details(body):
+            if json.loads(body)['payKey'] == 'AP-2':
+                return 502, 'text/html', '<html>Bad Gateway</html>'
+            return 200, 'application/json', stub.payment_details_body(receivers=1)
+
+        with stub.StubServer(routes={'/AdaptivePayments/PaymentDetails': details}) as server:
+            api = AdaptivePayments(Configuration(
+                stub.environment(server), 'userid', 'password', 'signature',
+            ))
+            results = dict(
+                (result.key, result)
+                for result in api.payment_details_batch(paykeys=['AP-1', 'AP-2', 'AP-3'])
+            )
+
+        self.assertEqual(sorted(results), ['AP-1', 'AP-2', 'AP-3'])
+        self.assertTrue(results['AP-1'].success)
+        self.assertTrue(results['AP-3'].success)
+        self.assertFalse(results['AP-2'].success)
+        self.assertIsInstance(results['AP-2'].error, PaypalAPIError)
+
+
+if __name__ == '__main__':
+    unittest.main()
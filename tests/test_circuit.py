@@ -0,0 +1,178 @@
+""" Circuit breakers and in-flight limits per endpoint, on a fake clock """
+import unittest
+
+from paypal import (
+    CircuitBreaker, CircuitBreakers, CircuitOpenError, EndpointSaturatedError,
+)
+from paypal.api import circuit
+
+
+class Clock(object):
+    """ Stands in for the `time` module, moving only when told to """
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.time, circuit.time = circuit.time, self.clock
+
+    def tearDown(self):
+        circuit.time = self.time
+
+    def breaker(self, **settings):
+        settings.setdefault('minimum_calls', 4)
+        settings.setdefault('open_timeout', 30)
+        return CircuitBreaker('https://example.com/Pay', **settings)
+
+    def succeed(self, breaker, duration=0):
+        def func():
+            self.clock.advance(duration)
+            return 'ok'
+        return breaker.call(func)
+
+    def fail(self, breaker):
+        def func():
+            raise IOError('Connection reset')
+        with self.assertRaises(IOError):
+            breaker.call(func)
+
+    def test_errors_open_the_circuit(self):
+        breaker = self.breaker(error_threshold=0.5)
+        self.succeed(breaker)
+        self.succeed(breaker)
+        self.fail(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        # Two errors out of four calls
+        self.fail(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.succeed(breaker)
+        self.assertEqual(raised.exception.endpoint, 'https://example.com/Pay')
+
+    def test_circuit_stays_closed_below_minimum_calls(self):
+        breaker = self.breaker()
+        for _ in range(3):
+            self.fail(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_results_count_as_errors(self):
+        breaker = self.breaker(error_threshold=1)
+        for _ in range(4):
+            self.assertEqual(breaker.call(lambda: 500, failed=lambda status: status >= 500), 500)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_slow_calls_open_the_circuit(self):
+        breaker = self.breaker(slow_call_duration=5, slow_call_threshold=0.5)
+        self.succeed(breaker, duration=1)
+        self.succeed(breaker, duration=1)
+        self.succeed(breaker, duration=5)
+        self.succeed(breaker, duration=10)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_old_errors_leave_the_window(self):
+        breaker = self.breaker(window=30)
+        self.fail(breaker)
+        self.fail(breaker)
+        self.clock.advance(30)
+        self.succeed(breaker)
+        self.succeed(breaker)
+        self.assertEqual(breaker.metrics()['calls'], 2)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        self.fail(breaker)
+        self.fail(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def open(self, breaker):
+        for _ in range(4):
+            self.fail(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_probe_closes_the_circuit(self):
+        breaker = self.breaker()
+        self.open(breaker)
+
+        self.clock.advance(29)
+        with self.assertRaises(CircuitOpenError):
+            self.succeed(breaker)
+
+        self.clock.advance(1)
+        self.succeed(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        # Failures from before the circuit opened are forgotten
+        self.assertEqual(breaker.metrics()['calls'], 0)
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        breaker = self.breaker()
+        self.open(breaker)
+
+        self.clock.advance(30)
+        self.fail(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        self.clock.advance(29)
+        with self.assertRaises(CircuitOpenError):
+            self.succeed(breaker)
+
+    def test_half_open_circuit_limits_probes(self):
+        breaker = self.breaker(half_open_probes=2)
+        self.open(breaker)
+        self.clock.advance(30)
+
+        def first_probe():
+            def second_probe():
+                self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+                with self.assertRaises(CircuitOpenError):
+                    self.succeed(breaker)
+                return 'ok'
+            return breaker.call(second_probe)
+
+        self.assertEqual(breaker.call(first_probe), 'ok')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_calls_beyond_max_in_flight_are_refused(self):
+        breaker = self.breaker(max_in_flight=1)
+
+        def call():
+            self.assertEqual(breaker.in_flight, 1)
+            with self.assertRaises(EndpointSaturatedError):
+                self.succeed(breaker)
+            return 'ok'
+
+        self.assertEqual(breaker.call(call), 'ok')
+        self.assertEqual(breaker.in_flight, 0)
+        # Refused calls are not failures of the endpoint
+        self.assertEqual(breaker.metrics()['error_rate'], 0.0)
+        self.succeed(breaker)
+
+
+class CircuitBreakersTest(unittest.TestCase):
+
+    def test_breaker_per_endpoint(self):
+        breakers = CircuitBreakers(minimum_calls=1, max_in_flight=5)
+        pay = breakers['https://example.com/Pay']
+
+        self.assertIs(breakers['https://example.com/Pay'], pay)
+        self.assertIsNot(breakers['https://example.com/PaymentDetails'], pay)
+        self.assertEqual(pay.max_in_flight, 5)
+
+        with self.assertRaises(IOError):
+            pay.call(lambda: open('/nonexistent'))
+        metrics = breakers.metrics()
+        self.assertEqual(metrics['https://example.com/Pay']['state'], CircuitBreaker.OPEN)
+        self.assertEqual(metrics['https://example.com/PaymentDetails']['state'], CircuitBreaker.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+""" JSON codecs of the JSON APIs, and payload templates """
+import unittest
+from collections import OrderedDict
+from decimal import Decimal
+
+from paypal import AdaptivePayments, Configuration, JSONCodec, PayloadTemplate
+
+
+class DefaultCodecTest(unittest.TestCase):
+
+    def test_amounts_are_decoded_as_decimal(self):
+        codec = Configuration.json_codec
+        self.assertIs(type(codec), JSONCodec)
+        self.assertEqual(type(codec.decode('{"amount": 10.10}')['amount']), Decimal)
+
+    def test_decimal_is_encoded_exactly(self):
+        body = Configuration.json_codec.encode({'amount': Decimal('10.10')})
+        self.assertEqual(body, b'{"amount":"10.10"}')
+
+
+class PayloadTemplateTest(unittest.TestCase):
+
+    codec = JSONCodec()
+    template = AdaptivePayments.pay_template
+
+    fields = {
+        'receiverList': {'receiver': [{'email': 'receiver@example.com', 'amount': Decimal('10.10')}]},
+        'memo': None,
+        'trackingId': 'tracking-1',
+    }
+
+    def merged(self, fields, template=template):
+        """ Fields of `template`, replaced by those of `fields` but `None` """
+        merged = dict(template.constant)
+        merged.update({key: value for key, value in fields.items() if value is not None})
+        return merged
+
+    def test_constant_fields_are_appended(self):
+        body = self.template.encode(self.codec, self.fields)
+
+        # The variable fields, followed by the constant ones
+        ordered = OrderedDict(
+            (key, value) for key, value in self.fields.items() if value is not None
+        )
+        ordered.update(self.template.constant)
+        self.assertEqual(body, self.codec.encode(ordered))
+        self.assertEqual(
+            self.codec.decode(body),
+            self.codec.decode(self.codec.encode(self.merged(self.fields))),
+        )
+        self.assertNotIn(b'memo', body)
+
+    def test_overridden_fields_encode_the_merged_object(self):
+        for fields in [
+            dict(self.fields, currencyCode='EUR'),
+            # As sent by `pay` with a `detail_level`
+            dict(self.fields, requestEnvelope={'errorLanguage': 'en_US', 'detailLevel': 'None'}),
+        ]:
+            body = self.template.encode(self.codec, fields)
+            self.assertEqual(body, self.codec.encode(self.merged(fields)))
+
+        self.assertIn(b'"detailLevel":"None"', body)
+        self.assertNotIn(b'ReturnAll', body)
+
+    def test_constant_fields_only(self):
+        self.assertEqual(
+            self.template.encode(self.codec, {'memo': None}),
+            self.codec.encode(self.template.constant),
+        )
+
+    def test_empty_template(self):
+        template = PayloadTemplate()
+        self.assertEqual(
+            template.encode(self.codec, self.fields),
+            self.codec.encode(self.merged(self.fields, template)),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
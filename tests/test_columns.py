@@ -0,0 +1,75 @@
+""" Column-oriented transaction search results """
+import unittest
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from paypal import TransactionColumns
+from paypal.utils import INT64, parse_cents
+
+
+class TransactionColumnsTest(unittest.TestCase):
+
+    def test_parse_cents(self):
+        self.assertEqual(parse_cents('10.00'), 1000)
+        self.assertEqual(parse_cents('-0.59'), -59)
+        self.assertEqual(parse_cents('.5'), 50)
+        self.assertEqual(parse_cents('7'), 700)
+        self.assertEqual(parse_cents('-1234567.8'), -123456780)
+
+    def test_amounts(self):
+        columns = TransactionColumns({'AMT': ['10.00', '-0.59', None, '99999999.99']})
+        amounts = columns.amounts('AMT')
+        self.assertEqual(amounts.typecode, INT64)
+        # Past the 32 bit range
+        self.assertEqual(amounts.tolist(), [1000, -59, 0, 9999999999])
+
+    def test_timestamps(self):
+        columns = TransactionColumns({
+            'TIMESTAMP': ['2014-10-21T18:15:53Z', None, '2040-01-01T00:00:00Z'],
+        })
+        self.assertEqual(columns.timestamps().tolist(), [1413915353, 0, 2208988800])
+
+    def test_concatenate(self):
+        columns = TransactionColumns.concatenate([
+            TransactionColumns({'AMT': ['1.00', '2.00'], 'TRANSACTIONID': ['A', 'B', 'padding']}),
+            TransactionColumns({'AMT': ['3.00'], 'TRANSACTIONID': ['C']}),
+        ])
+        self.assertEqual(len(columns), 3)
+        self.assertEqual(columns.fields, ['AMT', 'TRANSACTIONID'])
+        self.assertEqual(columns['TRANSACTIONID'], ['A', 'B', 'C'])
+        self.assertEqual(columns.amounts('AMT').tolist(), [100, 200, 300])
+        self.assertEqual(len(TransactionColumns.concatenate([])), 0)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class ToNumpyTest(unittest.TestCase):
+
+    def columns(self):
+        return TransactionColumns({
+            'AMT': ['10.00', '-0.59', None],
+            'TIMESTAMP': ['2014-10-21T18:15:53Z', '2014-10-21T18:16:53Z', None],
+            'TRANSACTIONID': ['A', 'B', 'C'],
+        })
+
+    def test_amounts_and_timestamps(self):
+        arrays = self.columns().to_numpy()
+        self.assertEqual(arrays['AMT'].dtype, numpy.int64)
+        self.assertEqual(arrays['AMT'].tolist(), [1000, -59, 0])
+        self.assertEqual(str(arrays['TIMESTAMP'][0]), '2014-10-21T18:15:53')
+        self.assertEqual(arrays['TRANSACTIONID'].tolist(), ['A', 'B', 'C'])
+
+    def test_32_bit_items(self):
+        # C longs of platforms where they are 32 bit, e.g. Windows
+        columns = self.columns()
+        columns.amounts = lambda field: array('i', [1000, -59, 0])
+        arrays = columns.to_numpy()
+        self.assertEqual(arrays['AMT'].dtype, numpy.int64)
+        self.assertEqual(arrays['AMT'].tolist(), [1000, -59, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+""" Immutable configurations and their derived copies """
+import unittest
+
+from paypal import Configuration, Environment
+
+
+class ReplaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration(Environment.Sandbox, 'userid', 'password', 'signature')
+
+    def test_default_application_id_follows_environment(self):
+        self.assertEqual(self.config.application_id, Environment.Sandbox.application_id)
+
+        production = self.config.replace(environment=Environment.Production)
+        self.assertIsNone(production.application_id)
+        self.assertIsNone(production.headers['X-PAYPAL-APPLICATION-ID'])
+
+        sandbox = production.replace(environment=Environment.Sandbox)
+        self.assertEqual(sandbox.application_id, Environment.Sandbox.application_id)
+        self.assertEqual(sandbox, self.config)
+
+    def test_explicit_application_id_is_kept(self):
+        config = self.config.replace(application_id='APP-1')
+        production = config.replace(environment=Environment.Production)
+        self.assertEqual(production.application_id, 'APP-1')
+        self.assertEqual(production.headers['X-PAYPAL-APPLICATION-ID'], 'APP-1')
+
+    def test_other_settings_are_kept(self):
+        config = self.config.replace(userid='other')
+        self.assertEqual(config.userid, 'other')
+        self.assertEqual(config.application_id, Environment.Sandbox.application_id)
+        self.assertEqual(config.password, 'password')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+""" Instrumentation of calls against the stub: hooks hear of a call once the
+transport returned, and again when its response is parsed
+"""
+import unittest
+
+import requests
+
+from paypal import (
+    AdaptivePayments, CallEvent, Configuration, Histograms, Hook, Instrumentation,
+    OpenTelemetryHook, PaypalAPIError, Permissions,
+)
+
+from benchmarks import stub
+
+
+class Recorder(Hook):
+    """ Hook recording every callback, with the measurements of its event """
+
+    def __init__(self):
+        self.calls = []
+
+    def after(self, event):
+        self.calls.append(('after', event.latency, event.parse_time, event.ack))
+
+    def parsed(self, event):
+        self.calls.append(('parsed', event.latency, event.parse_time, event.ack))
+
+
+class Span(object):
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.exceptions = []
+        self.ended = False
+
+    def set_attribute(self, name, value):
+        assert not self.ended
+        self.attributes[name] = value
+
+    def record_exception(self, exception):
+        self.exceptions.append(exception)
+
+    def end(self):
+        assert not self.ended
+        self.ended = True
+
+
+class Tracer(object):
+    """ Stands in for an OpenTelemetry tracer, keeping its spans """
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, attributes=None):
+        span = Span(name, attributes or {})
+        self.spans.append(span)
+        return span
+
+
+class Meter(object):
+    """ Stands in for an OpenTelemetry meter, keeping the `(value,
+    attributes)` recorded on each histogram by name
+    """
+
+    def __init__(self):
+        self.recorded = {}
+
+    def create_histogram(self, name, unit=None, description=None):
+        recorded = self.recorded.setdefault(name, [])
+
+        class Histogram(object):
+            def record(self, value, attributes=None):
+                recorded.append((value, attributes))
+
+        return Histogram()
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub.StubServer(routes=stub.paypal_routes()).start()
+        self.recorder = Recorder()
+        self.histograms = Histograms()
+        self.tracer = Tracer()
+        self.meter = Meter()
+        self.config = Configuration(
+            stub.environment(self.server), 'userid', 'password', 'signature',
+            instrumentation=Instrumentation(
+                self.recorder, self.histograms,
+                OpenTelemetryHook(tracer=self.tracer, meter=self.meter),
+            ),
+        )
+        self.api = AdaptivePayments(self.config)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_call_is_finished_before_parsing(self):
+        details = self.api.payment_details(paykey='AP-1')
+
+        [(name, latency, parse_time, ack)] = self.recorder.calls
+        self.assertEqual(name, 'after')
+        self.assertIsNotNone(latency)
+        self.assertEqual((parse_time, ack), (None, None))
+
+        snapshot = self.histograms.snapshot()['PaymentDetails']
+        self.assertEqual((snapshot['calls'], snapshot['acks']), (1, {}))
+
+        details.response
+        details.response
+        self.assertEqual(len(self.recorder.calls), 2)
+        name, _, parse_time, ack = self.recorder.calls[1]
+        self.assertEqual(name, 'parsed')
+        self.assertIsNotNone(parse_time)
+        self.assertEqual(ack, 'Success')
+
+        snapshot = self.histograms.snapshot()['PaymentDetails']
+        self.assertEqual((snapshot['calls'], snapshot['acks']), (1, {'Success': 1}))
+        self.assertEqual(snapshot['parse_time']['count'], 1)
+
+    def test_unknown_outcome(self):
+        # Parsed without an ack, e.g. a body missing its envelope
+        event = CallEvent(None, 'Pay')
+        event.parse_time = 0.001
+        self.histograms.parsed(event)
+
+        snapshot = self.histograms.snapshot()['Pay']
+        self.assertEqual(snapshot['acks'], {'unknown': 1})
+
+    def test_permissions_methods_are_named(self):
+        Permissions(self.config).get_access_token('token', 'verifier').response
+        Permissions(self.config).get_permissions('token').response
+
+        snapshot = self.histograms.snapshot()
+        self.assertEqual(sorted(snapshot), ['GetAccessToken', 'GetPermissions'])
+        self.assertEqual(snapshot['GetPermissions']['acks'], {'Success': 1})
+
+    def test_span_ends_once_parsed(self):
+        details = self.api.payment_details(paykey='AP-1')
+
+        [span] = self.tracer.spans
+        self.assertEqual(span.name, 'PayPal PaymentDetails')
+        self.assertFalse(span.ended)
+        self.assertEqual(span.attributes['http.status_code'], 200)
+
+        details.response
+        self.assertTrue(span.ended)
+        self.assertEqual(span.attributes['paypal.ack'], 'Success')
+        self.assertEqual(span.attributes['paypal.correlation_id'], stub.RESPONSE_ENVELOPE['correlationId'])
+        self.assertIn('paypal.parse_time', span.attributes)
+        self.assertEqual(span.exceptions, [])
+
+        [(_, attributes)] = self.meter.recorded['paypal.client.duration']
+        self.assertEqual(attributes, {'paypal.method': 'PaymentDetails', 'http.status_code': 200})
+        [(_, attributes)] = self.meter.recorded['paypal.client.parse.duration']
+        self.assertEqual(attributes, {'paypal.method': 'PaymentDetails', 'paypal.ack': 'Success'})
+
+    def test_span_of_invalid_response_records_the_error(self):
+        self.server.routes['/AdaptivePayments/PaymentDetails'] = (
+            200, 'text/html', '<html>Bad Gateway</html>',
+        )
+        with self.assertRaises(PaypalAPIError):
+            self.api.payment_details(paykey='AP-1')
+
+        [span] = self.tracer.spans
+        self.assertTrue(span.ended)
+        [error] = span.exceptions
+        self.assertIsInstance(error, PaypalAPIError)
+        [(_, attributes)] = self.meter.recorded['paypal.client.parse.duration']
+        self.assertEqual(attributes['paypal.ack'], 'PaypalAPIError')
+
+    def test_span_of_failed_call_ends_with_the_transport(self):
+        # Hang up without answering
+        self.server.routes['/AdaptivePayments/PaymentDetails'] = None
+        with self.assertRaises(requests.RequestException):
+            self.api.payment_details(paykey='AP-1')
+
+        [span] = self.tracer.spans
+        self.assertTrue(span.ended)
+        self.assertEqual(len(span.exceptions), 1)
+        [(_, attributes)] = self.meter.recorded['paypal.client.duration']
+        self.assertIn('error.type', attributes)
+
+
+if __name__ == '__main__':
+    unittest.main()
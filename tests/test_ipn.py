@@ -0,0 +1,63 @@
+""" Verification and de-duplication of IPN notifications against the
+verification stub
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from paypal import Configuration, IPNDeduplicator, IPNHandler, IPNResult
+
+from benchmarks import stub
+from benchmarks.bench_ipn import ipn_body
+
+
+class IPNHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.genuine = ipn_body(1) + '&ipn_track_id=a1b2c3d4e5f6'
+        self.forged = ipn_body(2) + '&ipn_track_id=a1b2c3d4e5f6'
+
+        # Only the genuine notification was sent by PayPal
+        def verify(body):
+            verified = body == 'cmd=_notify-validate&' + self.genuine
+            return 200, 'text/plain', 'VERIFIED' if verified else 'INVALID'
+
+        self.server = stub.StubServer(routes={'/cgi-bin/webscr': verify}).start()
+        self.directory = tempfile.mkdtemp()
+        self.handler = IPNHandler(
+            Configuration(stub.environment(self.server), 'userid', 'password', 'signature'),
+            deduplicator=IPNDeduplicator(os.path.join(self.directory, 'ipn.db')),
+        )
+        self.handled = []
+        self.handler.on('Adaptive Payment PAY', self.handled.append)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_forged_notification_does_not_shadow_genuine(self):
+        self.assertEqual(self.handler.handle(self.forged).status, IPNResult.INVALID)
+        self.assertEqual(self.handler.handle(self.genuine).status, IPNResult.HANDLED)
+        self.assertEqual(len(self.handled), 1)
+
+    def test_duplicates_are_skipped(self):
+        statuses = sorted(
+            result.status for result in self.handler.process([self.genuine] * 3)
+        )
+        self.assertEqual(statuses, [IPNResult.DUPLICATE] * 2 + [IPNResult.HANDLED])
+        self.assertEqual(len(self.handled), 1)
+
+    def test_failed_notification_is_handled_again(self):
+        def fail(message):
+            raise ValueError()
+
+        self.handler.on('Adaptive Payment PAY', fail)
+        self.assertEqual(self.handler.handle(self.genuine).status, IPNResult.FAILED)
+
+        self.handler.handlers['Adaptive Payment PAY'].remove(fail)
+        self.assertEqual(self.handler.handle(self.genuine).status, IPNResult.HANDLED)
+
+
+if __name__ == '__main__':
+    unittest.main()
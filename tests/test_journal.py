@@ -0,0 +1,212 @@
+""" Write-ahead journal of payments used by a single process """
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from paypal import AdaptivePayments, Configuration, JournalError, WriteAheadJournal
+
+from benchmarks import stub
+
+
+def open_journal(path):
+    try:
+        WriteAheadJournal(path, size=4096).close()
+    except JournalError:
+        return 'locked'
+    return 'opened'
+
+
+class WriteAheadJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open_elsewhere(self):
+        """ Open the journal from another process """
+        pool = multiprocessing.Pool(1)
+        try:
+            return pool.apply(open_journal, (self.path,))
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_journal_is_locked(self):
+        journal = WriteAheadJournal(self.path, size=4096)
+        self.assertEqual(self.open_elsewhere(), 'locked')
+
+        journal.close()
+        self.assertEqual(self.open_elsewhere(), 'opened')
+
+    def test_compacted_journal_is_locked(self):
+        journal = WriteAheadJournal(self.path, size=4096)
+        for i in range(100):
+            journal.intent(str(i), receivers=[])
+            journal.outcome(str(i), ack='Success')
+        self.assertEqual(self.open_elsewhere(), 'locked')
+        journal.close()
+
+    def test_forked_journal_refuses_writes(self):
+        journal = WriteAheadJournal(self.path, size=4096)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                journal.intent('child', receivers=[])
+            except JournalError:
+                os._exit(0)
+            os._exit(1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        journal.intent('parent', receivers=[])
+        journal.close()
+
+    def records(self):
+        """ Return the `(end, record)` of the valid records in the file """
+        with open(self.path, 'rb') as f:
+            return list(WriteAheadJournal._scan(f.read()))
+
+    def in_doubt(self, journal):
+        return [intent['id'] for intent in journal.in_doubt()]
+
+    def test_intents_survive_reopening(self):
+        journal = WriteAheadJournal(self.path, size=4096)
+        journal.intent('a', receivers=[{'email': 'a@example.com', 'amount': '1.00'}])
+        journal.intent('b', receivers=[])
+        journal.intent('c', receivers=[])
+        journal.outcome('b', ack='Success')
+        journal.close()
+
+        journal = WriteAheadJournal(self.path, size=4096)
+        self.assertEqual(self.in_doubt(journal), ['a', 'c'])
+        self.assertEqual(journal.in_doubt()[0]['receivers'][0]['amount'], '1.00')
+
+        journal.outcome('a', ack='Success')
+        journal.close()
+
+        journal = WriteAheadJournal(self.path, size=4096)
+        self.assertEqual(self.in_doubt(journal), ['c'])
+        journal.close()
+
+    def test_torn_record_is_dropped(self):
+        journal = WriteAheadJournal(self.path, size=4096)
+        journal.intent('a', receivers=[])
+        journal.intent('b', receivers=[])
+        journal.close()
+
+        # Corrupt the data of the last record, as a crash mid-write would
+        (start, _), (end, _) = self.records()
+        with open(self.path, 'r+b') as f:
+            f.seek(end - 2)
+            f.write(b'\xff\xff')
+
+        journal = WriteAheadJournal(self.path, size=4096)
+        self.assertEqual(self.in_doubt(journal), ['a'])
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            self.assertEqual(f.read(end - start), b'\0' * (end - start))
+
+        # Records following the torn one are read back
+        journal.intent('c', receivers=[])
+        journal.close()
+
+        journal = WriteAheadJournal(self.path, size=4096)
+        self.assertEqual(self.in_doubt(journal), ['a', 'c'])
+        journal.close()
+
+    def test_truncated_record_is_dropped(self):
+        journal = WriteAheadJournal(self.path, size=4096)
+        journal.intent('a', receivers=[])
+        journal.intent('b', receivers=[])
+        journal.close()
+
+        # Only the header and the start of the last record reached the disk
+        (start, _), (end, _) = self.records()
+        with open(self.path, 'r+b') as f:
+            f.seek(start + 12)
+            f.write(b'\0' * (end - start - 12))
+
+        journal = WriteAheadJournal(self.path, size=4096)
+        self.assertEqual(self.in_doubt(journal), ['a'])
+        journal.close()
+        self.assertEqual(len(self.records()), 1)
+
+    def test_compaction_keeps_intents_in_doubt(self):
+        journal = WriteAheadJournal(self.path, size=4096)
+        journal.intent('doubt-1', receivers=[])
+        for i in range(100):
+            journal.intent(str(i), receivers=[])
+            journal.outcome(str(i), ack='Success')
+        journal.intent('doubt-2', receivers=[])
+        journal.close()
+
+        # Rewritten with the intents in doubt, followed by the last intent
+        records = [record for _, record in self.records()]
+        self.assertLess(len(records), 200)
+        self.assertEqual(
+            set(record['id'] for record in records if record['op'] == 'intent') -
+            set(record['id'] for record in records if record['op'] == 'outcome'),
+            set(['doubt-1', 'doubt-2'])
+        )
+        self.assertEqual(records[0]['id'], 'doubt-1')
+
+        journal = WriteAheadJournal(self.path, size=4096)
+        self.assertEqual(self.in_doubt(journal), ['doubt-1', 'doubt-2'])
+        journal.close()
+
+
+class ResolveInDoubtTest(unittest.TestCase):
+
+    def setUp(self):
+        # PaymentDetails answers by trackingId
+        self.answers = {}
+
+        def details(body):
+            tracking_id = json.loads(body)['trackingId']
+            envelope = dict(stub.RESPONSE_ENVELOPE, ack='Failure')
+            error_id = self.answers[tracking_id]
+            if error_id is None:
+                answer = {
+                    'responseEnvelope': stub.RESPONSE_ENVELOPE,
+                    'payKey': 'AP-' + tracking_id,
+                    'status': 'COMPLETED',
+                }
+            else:
+                answer = {'responseEnvelope': envelope, 'error': [{'errorId': error_id}]}
+            return 200, 'application/json', json.dumps(answer)
+
+        self.server = stub.StubServer(routes={
+            '/AdaptivePayments/PaymentDetails': details,
+        }).start()
+        self.directory = tempfile.mkdtemp()
+        self.journal = WriteAheadJournal(os.path.join(self.directory, 'journal'), size=4096)
+        self.api = AdaptivePayments(Configuration(
+            stub.environment(self.server), 'userid', 'password', 'signature',
+            journal=self.journal,
+        ))
+
+    def tearDown(self):
+        self.journal.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_only_answered_lookups_are_resolved(self):
+        self.answers = {'paid': None, 'unknown': '580022', 'failed': '520002'}
+        for tracking_id in sorted(self.answers):
+            self.journal.intent(tracking_id, receivers=[])
+
+        results = list(self.api.resolve_in_doubt())
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual([intent['id'] for intent in self.journal.in_doubt()], ['failed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
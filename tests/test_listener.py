@@ -0,0 +1,148 @@
+""" Queues of the IPN listener, and acknowledgement of notifications """
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from paypal import IPNListener, IPNResult, MemoryIPNQueue, SQLiteIPNQueue
+
+from benchmarks.bench_ipn import ipn_body
+
+
+class Handler(object):
+    """ Stands in for an `IPNHandler`, answering notifications with
+    `statuses` in turn and repeating the last one, once `release` is set
+    """
+
+    max_workers = 1
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.bodies = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def handle(self, body):
+        self.bodies.append(body)
+        self.started.set()
+        self.release.wait()
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return IPNResult(None, status, ValueError() if status == IPNResult.FAILED else None)
+
+
+class SQLiteIPNQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ipn-queue.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_concurrent_puts_respect_maxsize(self):
+        queue = SQLiteIPNQueue(self.path, maxsize=10)
+        accepted = []
+
+        def put():
+            accepted.append(queue.put(ipn_body(1)))
+
+        threads = [threading.Thread(target=put) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(accepted.count(True), 10)
+        self.assertEqual(len(queue), 10)
+        self.assertEqual(len(SQLiteIPNQueue(self.path, maxsize=10)), 10)
+
+    def test_queued_items_survive_reopening(self):
+        queue = SQLiteIPNQueue(self.path)
+        queue.put(b'first')
+        queue.put(b'second')
+        queue.done(queue.get())
+
+        queue = SQLiteIPNQueue(self.path)
+        self.assertEqual(queue.get().body, b'second')
+
+    def test_dead_letters_survive_reopening(self):
+        queue = SQLiteIPNQueue(self.path)
+        queue.put(b'failing')
+        queue.dead(queue.get(), ValueError('Handler failed'))
+        self.assertEqual(len(queue), 0)
+
+        queue = SQLiteIPNQueue(self.path)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.count_dead_letters(), 1)
+        [item] = queue.dead_letters()
+        self.assertEqual((item.body, item.attempts), (b'failing', 1))
+        self.assertIn('Handler failed', item.error)
+
+
+class IPNListenerTest(unittest.TestCase):
+
+    def test_full_queue_is_answered_with_503(self):
+        handler = Handler(IPNResult.HANDLED)
+        handler.release.clear()
+        listener = IPNListener(
+            handler, queue=MemoryIPNQueue(maxsize=1), address=('127.0.0.1', 0),
+        )
+        with listener:
+            # The only worker is busy with the first notification
+            self.assertEqual(requests.post(listener.url(), data=ipn_body(1)).status_code, 200)
+            handler.started.wait()
+            self.assertEqual(requests.post(listener.url(), data=ipn_body(2)).status_code, 200)
+
+            response = requests.post(listener.url(), data=ipn_body(3))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '60')
+            handler.release.set()
+
+        metrics = listener.metrics()
+        self.assertEqual((metrics['accepted'], metrics['rejected']), (2, 1))
+
+    def handled(self, handler, bodies, attempts, **options):
+        """ Accept `bodies`, and stop the listener once they were handled
+        `attempts` times
+        """
+        listener = IPNListener(handler, address=('127.0.0.1', 0), retry_delay=0, **options)
+        with listener:
+            for body in bodies:
+                listener.accept(body)
+            deadline = time.time() + 10
+            while (
+                sum(listener.metrics()['statuses'].values()) < attempts and
+                time.time() < deadline
+            ):
+                time.sleep(0.01)
+        return listener
+
+    def test_failed_notification_is_retried(self):
+        handler = Handler(IPNResult.FAILED, IPNResult.HANDLED)
+        listener = self.handled(handler, [ipn_body(1)], 2, max_attempts=3)
+
+        self.assertEqual(handler.bodies, [ipn_body(1)] * 2)
+        metrics = listener.metrics()
+        self.assertEqual((metrics['retried'], metrics['dead'], metrics['dead_letters']), (1, 0, 0))
+        self.assertEqual(metrics['statuses'], {IPNResult.FAILED: 1, IPNResult.HANDLED: 1})
+
+    def test_failing_notification_is_kept_as_dead_letter(self):
+        handler = Handler(IPNResult.FAILED)
+        listener = self.handled(handler, [ipn_body(1)], 3, max_attempts=3)
+
+        self.assertEqual(len(handler.bodies), 3)
+        metrics = listener.metrics()
+        self.assertEqual((metrics['retried'], metrics['dead'], metrics['dead_letters']), (2, 1, 1))
+
+        [item] = listener.queue.dead_letters()
+        self.assertEqual((item.body, item.attempts), (ipn_body(1), 3))
+        self.assertEqual(item.error, 'ValueError()')
+
+
+if __name__ == '__main__':
+    unittest.main()
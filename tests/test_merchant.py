@@ -0,0 +1,129 @@
+""" Searches of every transaction of a date range, window by window """
+import datetime
+import threading
+import time
+import unittest
+import urllib
+import urlparse
+
+from paypal import Configuration, Merchant, MerchantError
+
+from benchmarks import stub
+
+
+FAILURE = urllib.urlencode([
+    ('TIMESTAMP', '2014-10-21T18:15:53Z'),
+    ('CORRELATIONID', '6e4b1d2b5f1f3'),
+    ('ACK', 'Failure'),
+    ('VERSION', '119'),
+    ('L_ERRORCODE0', '10001'),
+    ('L_SHORTMESSAGE0', 'Internal Error'),
+    ('L_LONGMESSAGE0', 'Internal Error'),
+    ('L_SEVERITYCODE0', 'Error'),
+])
+
+TRUNCATED = urllib.urlencode([
+    ('TIMESTAMP', '2014-10-21T18:15:53Z'),
+    ('CORRELATIONID', '6e4b1d2b5f1f3'),
+    ('ACK', 'SuccessWithWarning'),
+    ('VERSION', '119'),
+    ('L_ERRORCODE0', '11002'),
+    ('L_SHORTMESSAGE0', 'Search warning'),
+    ('L_LONGMESSAGE0', 'The number of results were truncated.'),
+    ('L_SEVERITYCODE0', 'Warning'),
+])
+
+
+class TransactionSearchAllTest(unittest.TestCase):
+
+    start = datetime.datetime(2014, 10, 1)
+
+    def search_all(self, answer, days=5, **options):
+        self.searches = []
+        lock = threading.Lock()
+
+        def route(body):
+            with lock:
+                self.searches.append(urlparse.parse_qs(body))
+                n = len(self.searches)
+            return answer(n)
+
+        options.setdefault('end_date', self.start + datetime.timedelta(days=days, seconds=-1))
+        options.setdefault('window', datetime.timedelta(days=1))
+        options.setdefault('max_workers', 1)
+        with stub.StubServer(routes={'/nvp': route}) as server:
+            config = Configuration(stub.environment(server), 'userid', 'password', 'signature')
+            return list(Merchant(config).transaction_search_all(
+                'token', 'secret', start_date=self.start, **options
+            ))
+
+    def test_failed_windows_raise(self):
+        with self.assertRaises(MerchantError) as raised:
+            self.search_all(lambda n: (200, 'text/plain', FAILURE))
+        self.assertIn('10001', str(raised.exception))
+
+    def test_truncated_windows_are_split(self):
+        answers = {1: TRUNCATED}
+        transactions = self.search_all(
+            lambda n: (200, 'text/plain', answers.get(n, stub.transaction_search_body(rows=1))),
+            days=1,
+        )
+        self.assertEqual(len(self.searches), 3)
+        self.assertEqual(len(transactions), 1)
+
+    def test_single_second_range_is_searched_once(self):
+        transactions = self.search_all(
+            lambda n: (200, 'text/plain', stub.transaction_search_body(rows=5)),
+            end_date=self.start, window=None,
+        )
+        self.assertEqual(len(self.searches), 1)
+        self.assertEqual(len(transactions), 5)
+
+    def test_window_must_be_positive(self):
+        for window in [datetime.timedelta(0), datetime.timedelta(seconds=-1)]:
+            with self.assertRaises(MerchantError):
+                self.search_all(lambda n: None, window=window)
+
+    def test_transactions_without_id_are_kept(self):
+        body = urllib.urlencode([
+            (key, value)
+            for key, value in urlparse.parse_qsl(stub.transaction_search_body(rows=5))
+            if not key.startswith('L_TRANSACTIONID')
+        ])
+        transactions = self.search_all(lambda n: (200, 'text/plain', body), days=1)
+        self.assertEqual(len(transactions), 5)
+
+    def test_split_windows_stay_within_max_workers(self):
+        searches = []
+        first_day = {
+            'STARTDATE': ['2014-10-01T00:00:00'], 'ENDDATE': ['2014-10-01T23:59:59'],
+        }
+
+        def route(body):
+            search = urlparse.parse_qs(body)
+            searches.append(search)
+            if all(search[key] == value for key, value in first_day.items()):
+                return 200, 'text/plain', TRUNCATED
+            return 200, 'text/plain', stub.transaction_search_body(rows=1)
+
+        with stub.StubServer(routes={'/nvp': route}) as server:
+            config = Configuration(stub.environment(server), 'userid', 'password', 'signature')
+            transactions = Merchant(config).transaction_search_all(
+                'token', 'secret',
+                start_date=self.start,
+                end_date=self.start + datetime.timedelta(days=4, seconds=-1),
+                window=datetime.timedelta(days=1),
+                max_workers=2,
+            )
+
+            # The first day and its first half, then the second half once
+            # the first is consumed
+            next(transactions)
+            time.sleep(0.1)
+            self.assertEqual(len(searches), 3)
+            list(transactions)
+            self.assertEqual(len(searches), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
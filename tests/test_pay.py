@@ -0,0 +1,118 @@
+""" Transaction details of payments made without authorization, fetched as
+chosen by `details`
+"""
+import json
+import threading
+import unittest
+
+from paypal import AdaptivePayments, Configuration, PaypalAPIError, Receiver
+
+from benchmarks import stub
+
+
+PAY = (
+    200, 'application/json', json.dumps({
+        'responseEnvelope': stub.RESPONSE_ENVELOPE,
+        'payKey': 'AP-1',
+        'paymentExecStatus': 'COMPLETED',
+    })
+)
+
+DETAILS = (200, 'application/json', stub.payment_details_body(receivers=1))
+
+UNAVAILABLE = (503, 'text/html', '<html>Service Unavailable</html>')
+
+
+class PayDetailsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pays = []
+        self.lookups = []
+        self.details = DETAILS
+        self.lock = threading.Lock()
+
+        def pay(body):
+            self.pays.append(json.loads(body))
+            return PAY
+
+        def details(body):
+            with self.lock:
+                self.lookups.append(body)
+            return self.details
+
+        self.server = stub.StubServer(routes={
+            '/AdaptivePayments/Pay': pay,
+            '/AdaptivePayments/PaymentDetails': details,
+        }).start()
+        self.api = AdaptivePayments(Configuration(
+            stub.environment(self.server), 'userid', 'password', 'signature',
+        ))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def pay(self, **options):
+        return self.api.pay(
+            receivers=[Receiver(email='receiver@example.com', amount='10.00')],
+            implicit=True, **options
+        )
+
+    def test_eager_details_are_fetched_before_returning(self):
+        response = self.pay()
+        self.assertEqual(len(self.lookups), 1)
+        self.assertTrue(response.payment_details.success)
+        self.assertEqual(response.redirect, '')
+
+    def test_lazy_details_are_fetched_once_on_access(self):
+        response = self.pay(details=AdaptivePayments.Details.LAZY)
+        self.assertEqual(self.lookups, [])
+        self.assertEqual(response.redirect, '')
+
+        self.assertTrue(response.payment_details.success)
+        self.assertIs(response.payment_details, response.payment_details)
+        self.assertEqual(len(self.lookups), 1)
+
+    def test_failed_lazy_details_are_fetched_again(self):
+        self.details = UNAVAILABLE
+        response = self.pay(details=AdaptivePayments.Details.LAZY)
+
+        for _ in range(2):
+            with self.assertRaises(PaypalAPIError):
+                response.payment_details
+        self.assertEqual(len(self.lookups), 2)
+
+        self.details = DETAILS
+        self.assertTrue(response.payment_details.success)
+        self.assertEqual(len(self.lookups), 3)
+
+    def test_background_details_are_waited_for(self):
+        response = self.pay(details=AdaptivePayments.Details.BACKGROUND)
+        self.assertTrue(response.payment_details.success)
+        self.assertEqual(len(self.lookups), 1)
+
+    def test_failed_background_details_keep_raising(self):
+        self.details = UNAVAILABLE
+        response = self.pay(details=AdaptivePayments.Details.BACKGROUND)
+
+        for _ in range(2):
+            with self.assertRaises(PaypalAPIError):
+                response.payment_details
+        self.assertEqual(len(self.lookups), 1)
+
+    def test_details_can_be_skipped(self):
+        response = self.pay(details=AdaptivePayments.Details.NEVER)
+        self.assertIsNone(response.payment_details)
+        self.assertEqual(self.lookups, [])
+
+    def test_detail_level(self):
+        self.pay(details=AdaptivePayments.Details.NEVER)
+        self.pay(details=AdaptivePayments.Details.NEVER, detail_level='None')
+
+        self.assertEqual(
+            [body['requestEnvelope']['detailLevel'] for body in self.pays],
+            ['ReturnAll', 'None'],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
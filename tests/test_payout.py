@@ -0,0 +1,186 @@
+""" Resumption of payout runs against the stub: a Pay request left in doubt
+must only be sent again once PayPal answered it has no such payment
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from paypal import Configuration, Payout, PayoutError, PayoutJournal, Receiver
+
+from benchmarks import stub
+
+
+ENVELOPE = {
+    'ack': 'Success',
+    'correlationId': '6e4b1d2b5f1f3',
+    'timestamp': '2014-10-21T11:15:53.861-07:00',
+}
+
+ROWS = [('receiver@example.com', '10.00', 'invoice-1')]
+
+PAY = (
+    200, 'application/json', json.dumps({
+        'responseEnvelope': ENVELOPE,
+        'payKey': 'AP-PAY',
+        'paymentExecStatus': 'COMPLETED',
+    })
+)
+
+DETAILS = (
+    200, 'application/json', json.dumps({
+        'responseEnvelope': ENVELOPE,
+        'payKey': 'AP-DETAILS',
+        'status': 'COMPLETED',
+    })
+)
+
+
+def details_failure(error_id):
+    return 200, 'application/json', json.dumps({
+        'responseEnvelope': dict(ENVELOPE, ack='Failure'),
+        'error': [{'errorId': error_id, 'message': 'Lookup failed'}],
+    })
+
+
+class PayoutResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.paid = []
+        self.details = DETAILS
+
+        def pay(body):
+            self.paid.append(body)
+            return PAY
+
+        self.server = stub.StubServer(routes={
+            '/AdaptivePayments/Pay': pay,
+            '/AdaptivePayments/PaymentDetails': lambda body: self.details,
+        }).start()
+        self.directory = tempfile.mkdtemp()
+        self.journal = PayoutJournal(os.path.join(self.directory, 'payouts.db'))
+        self.payout = Payout(
+            self.journal,
+            Configuration(stub.environment(self.server), 'userid', 'password', 'signature'),
+        )
+
+        # A previous run died after sending its only request
+        receivers = [Receiver(email=email, amount=amount, invoice_id=invoice_id)
+                     for email, amount, invoice_id in ROWS]
+        self.tracking_id = Payout.tracking_id('run', 0)
+        self.journal.sent('run', self.tracking_id, Payout.digest(receivers))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def state(self):
+        return self.journal.get(self.tracking_id)[1]
+
+    def test_found_payment_is_not_sent_again(self):
+        [result] = self.payout.run('run', ROWS)
+
+        self.assertTrue(result.success)
+        self.assertEqual(result.paykey, 'AP-DETAILS')
+        self.assertEqual(self.paid, [])
+        self.assertEqual(self.state(), PayoutJournal.DONE)
+
+    def test_unknown_payment_is_sent_again(self):
+        self.details = details_failure('580022')
+
+        [result] = self.payout.run('run', ROWS)
+
+        self.assertTrue(result.success)
+        self.assertEqual(result.paykey, 'AP-PAY')
+        self.assertEqual(len(self.paid), 1)
+        self.assertEqual(self.state(), PayoutJournal.DONE)
+
+    def test_failed_lookup_stays_in_doubt(self):
+        self.details = details_failure('520002')
+
+        [result] = self.payout.run('run', ROWS)
+
+        self.assertIsInstance(result.error, PayoutError)
+        self.assertEqual(self.paid, [])
+        self.assertEqual(self.state(), PayoutJournal.SENT)
+
+        # Looked up again on the next run
+        self.details = DETAILS
+        [result] = self.payout.run('run', ROWS)
+        self.assertTrue(result.success)
+        self.assertEqual(self.paid, [])
+
+
+class PayoutRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.paid = []
+
+        def pay(body):
+            self.paid.append(json.loads(body))
+            return PAY
+
+        self.server = stub.StubServer(routes={'/AdaptivePayments/Pay': pay}).start()
+        self.directory = tempfile.mkdtemp()
+        self.journal = PayoutJournal(os.path.join(self.directory, 'payouts.db'))
+        self.config = Configuration(stub.environment(self.server), 'userid', 'password', 'signature')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_invalid_rows_are_reported_on_their_own(self):
+        rows = [
+            ('first@example.com', '10.00', 'invoice-1'),
+            ('', '10.00', 'invoice-2'),
+            ('third@example.com', None, 'invoice-3'),
+            ('fourth@example.com', '10.00'),
+            ('fifth@example.com', '10.00', 'invoice-5'),
+        ]
+        results = list(Payout(self.journal, self.config).run('run', rows))
+
+        paid = [result for result in results if result.tracking_id is not None]
+        rejected = [result for result in results if result.tracking_id is None]
+        self.assertEqual(len(paid), 1)
+        self.assertTrue(paid[0].success)
+        self.assertEqual(
+            [receiver['email'] for receiver in paid[0].receivers],
+            ['first@example.com', 'fifth@example.com'],
+        )
+        self.assertEqual(len(self.paid), 1)
+
+        self.assertEqual(len(rejected), 3)
+        for result in rejected:
+            self.assertIsInstance(result.error, PayoutError)
+            self.assertFalse(result.success)
+        self.assertEqual(
+            [result.receivers[0]['email'] for result in rejected],
+            ['', 'third@example.com', 'fourth@example.com'],
+        )
+        self.assertIn('Invalid row 1', str(rejected[0].error))
+
+    def test_failing_rows_wait_for_sent_requests(self):
+        def rows():
+            yield ('first@example.com', '10.00', 'invoice-1')
+            yield ('second@example.com', '10.00', 'invoice-2')
+            raise IOError('Failed reading rows')
+
+        payout = Payout(self.journal, self.config, receivers_per_payment=1)
+        with self.assertRaises(IOError):
+            list(payout.run('run', rows()))
+
+        # Requests not started yet are cancelled, and those started are
+        # finished: none is left sent without an outcome, nor still running
+        counts = self.journal.counts('run')
+        self.assertNotIn(PayoutJournal.SENT, counts)
+        self.assertIn(counts.get(PayoutJournal.DONE), (1, 2))
+        paid = len(self.paid)
+        time.sleep(0.1)
+        self.assertEqual(len(self.paid), paid)
+        self.assertEqual(paid, counts[PayoutJournal.DONE])
+
+
+if __name__ == '__main__':
+    unittest.main()
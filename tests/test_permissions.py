@@ -0,0 +1,77 @@
+""" Permissions lookups cached until their access token is cancelled """
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from paypal import Configuration, MemoryCache, Permissions, SQLiteCache
+
+from benchmarks import stub
+
+
+# Numbers with a fraction are decoded as `Decimal`
+ACCESS_TOKEN = {
+    'responseEnvelope': stub.RESPONSE_ENVELOPE,
+    'scope': ['TRANSACTION_SEARCH'],
+    'token': 'AAAAAAAbCdEfGhIjKlMn',
+    'tokenSecret': 'GhIjKlMnOpQrStUvWxYz',
+    'version': 1.5,
+}
+
+PERMISSIONS = {
+    'responseEnvelope': stub.RESPONSE_ENVELOPE,
+    'scope': ['TRANSACTION_SEARCH'],
+}
+
+
+class PermissionsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+
+        def route(answer):
+            def respond(body):
+                self.requests.append(json.loads(body))
+                return 200, 'application/json', json.dumps(answer)
+            return respond
+
+        self.server = stub.StubServer(routes={
+            '/Permissions/GetAccessToken/': route(ACCESS_TOKEN),
+            '/Permissions/GetPermissions/': route(PERMISSIONS),
+            '/Permissions/CancelPermissions/': route({'responseEnvelope': stub.RESPONSE_ENVELOPE}),
+        }).start()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def check_cache(self, cache):
+        api = Permissions(Configuration(
+            stub.environment(self.server), 'userid', 'password', 'signature',
+            permissions_cache=cache,
+        ))
+        token = ACCESS_TOKEN['token']
+
+        for _ in range(2):
+            self.assertEqual(api.get_access_token('request', 'verifier').token, token)
+            self.assertEqual(api.get_permissions(token).response['scope'], ['TRANSACTION_SEARCH'])
+        self.assertEqual(len(self.requests), 2)
+
+        api.cancel_permissions(token)
+        self.assertEqual(len(self.requests), 3)
+
+        api.get_access_token('request', 'verifier')
+        api.get_permissions(token)
+        self.assertEqual(len(self.requests), 5)
+
+    def test_memory_cache(self):
+        self.check_cache(MemoryCache())
+
+    def test_sqlite_cache(self):
+        self.check_cache(SQLiteCache(os.path.join(self.directory, 'cache.db')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+""" Preapproval details cached between preapproved payments """
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from paypal import AdaptivePayments, Configuration, MemoryCache, PreapprovalError, SQLiteCache
+
+from benchmarks import stub
+
+
+PREAPPROVAL = {
+    'responseEnvelope': stub.RESPONSE_ENVELOPE,
+    'senderEmail': 'sender@example.com',
+    'startingDate': '2014-10-01',
+    'endingDate': '2099-10-01',
+    'status': 'ACTIVE',
+    'approved': 'true',
+    'maxNumberOfPayments': '3',
+    'curPayments': '0',
+    'curPaymentsAmount': '0.00',
+}
+
+
+def pay(status):
+    return 200, 'application/json', json.dumps({
+        'responseEnvelope': stub.RESPONSE_ENVELOPE,
+        'payKey': 'AP-PAY',
+        'paymentExecStatus': status,
+    })
+
+
+class PreapprovedPaymentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pay = pay('COMPLETED')
+        self.lookups = []
+
+        def details(body):
+            self.lookups.append(body)
+            return 200, 'application/json', json.dumps(PREAPPROVAL)
+
+        self.server = stub.StubServer(routes={
+            '/AdaptivePayments/Pay': lambda body: self.pay,
+            '/AdaptivePayments/PreapprovalDetails': details,
+        }).start()
+        self.cache = MemoryCache()
+        self.api = AdaptivePayments(Configuration(
+            stub.environment(self.server), 'userid', 'password', 'signature',
+            preapproval_cache=self.cache,
+        ))
+        self.api.preapproval_details('PA-1')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def pay_simple(self):
+        return self.api.pay_simple(
+            email='receiver@example.com', amount='10.00', preapproval_key='PA-1',
+            details=AdaptivePayments.Details.NEVER,
+        )
+
+    def cur_payments(self):
+        return int(self.api.cached_preapproval_details('PA-1').response['curPayments'])
+
+    def test_completed_payments_are_counted(self):
+        self.pay_simple()
+        self.pay = pay('PROCESSING')
+        self.pay_simple()
+        self.assertEqual(self.cur_payments(), 2)
+
+        self.pay_simple()
+        with self.assertRaises(PreapprovalError):
+            self.pay_simple()
+        self.assertEqual(len(self.lookups), 1)
+
+    def test_failed_payment_drops_the_preapproval(self):
+        self.pay = pay('ERROR')
+        self.pay_simple()
+        self.assertIsNone(self.api.cached_preapproval_details('PA-1'))
+
+    def test_concurrent_payments_are_all_counted(self):
+        threads = [
+            threading.Thread(target=self.api.count_preapproval_payment, args=('PA-1', '1.00'))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cur_payments(), 20)
+
+
+class CacheUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_update(self, cache):
+        cache.set('key', {'count': 0}, tags=['tag'])
+        self.assertIsNone(cache.update('missing', lambda value: self.fail()))
+
+        def increment():
+            for _ in range(20):
+                cache.update('key', lambda value: dict(value, count=value['count'] + 1))
+
+        threads = [threading.Thread(target=increment) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.get('key'), {'count': 100})
+
+        # Tags are kept
+        cache.invalidate('tag')
+        self.assertIsNone(cache.get('key'))
+
+    def test_memory_cache(self):
+        self.check_update(MemoryCache())
+
+    def test_sqlite_cache(self):
+        self.check_update(SQLiteCache(os.path.join(self.directory, 'cache.db')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+""" Token buckets limiting the rate of calls, on a fake clock """
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from paypal import RateLimitExceeded, RateLimits, SQLiteTokenBucket, TokenBucket
+from paypal.api import ratelimit
+
+
+class Clock(object):
+    """ Stands in for the `time` module: sleeping moves the clock """
+
+    def __init__(self):
+        self.now = 1000000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def reserve(path, key):
+    """ Reserve a token of a shared bucket from another process """
+    return SQLiteTokenBucket(path, key, rate=2, capacity=3).reserve()
+
+
+class ClockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.time, ratelimit.time = ratelimit.time, self.clock
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'limits.db')
+
+    def tearDown(self):
+        ratelimit.time = self.time
+        shutil.rmtree(self.directory)
+
+
+class TokenBucketTest(ClockTestCase):
+
+    def check_bucket(self, bucket):
+        # A full bucket, then one token every half second
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.reserve(), 0.5)
+
+        self.clock.now += 1
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0.5)
+
+        # Never more than `capacity` tokens
+        self.clock.now += 60
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0, 0, 0, 0.5])
+
+    def test_refill(self):
+        self.check_bucket(TokenBucket(rate=2, capacity=3))
+
+    def test_sqlite_refill(self):
+        self.check_bucket(SQLiteTokenBucket(self.path, 'key', rate=2, capacity=3))
+
+    def test_waiting_callers_are_served_in_order(self):
+        bucket = TokenBucket(rate=2, capacity=1)
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0, 0.5, 1, 1.5])
+
+    def test_acquire_waits_for_a_token(self):
+        bucket = TokenBucket(rate=2, capacity=1)
+        bucket.acquire()
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+
+    def test_max_wait(self):
+        for bucket in [
+            TokenBucket(rate=2, capacity=1),
+            SQLiteTokenBucket(self.path, 'key', rate=2, capacity=1),
+        ]:
+            bucket.acquire()
+            with self.assertRaises(RateLimitExceeded):
+                bucket.acquire(max_wait=0.4)
+            # The refused call did not take a token
+            bucket.acquire(max_wait=0.5)
+            self.assertEqual(self.clock.sleeps[-1], 0.5)
+
+    def test_sqlite_bucket_is_shared_between_processes(self):
+        bucket = SQLiteTokenBucket(self.path, 'key', rate=2, capacity=3)
+        bucket.reserve()
+        bucket.reserve()
+
+        pool = multiprocessing.Pool(1)
+        try:
+            self.assertEqual(pool.apply(reserve, (self.path, 'key')), 0)
+            self.assertEqual(pool.apply(reserve, (self.path, 'key')), 0.5)
+            self.assertEqual(pool.apply(reserve, (self.path, 'other')), 0)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(bucket.reserve(), 1)
+
+
+class RateLimitsTest(ClockTestCase):
+
+    def test_bucket_per_application_and_endpoint(self):
+        limits = RateLimits(rate=1)
+        bucket = limits.bucket('APP-1', 'https://example.com/Pay')
+
+        self.assertIs(limits.bucket('APP-1', 'https://example.com/Pay'), bucket)
+        self.assertIsNot(limits.bucket('APP-1', 'https://example.com/PaymentDetails'), bucket)
+        self.assertIsNot(limits.bucket('APP-2', 'https://example.com/Pay'), bucket)
+
+    def test_endpoints_can_share_a_bucket(self):
+        limits = RateLimits(rate=1, per_endpoint=False, max_wait=0)
+        limits.acquire('APP-1', 'https://example.com/Pay')
+        with self.assertRaises(RateLimitExceeded):
+            limits.acquire('APP-1', 'https://example.com/PaymentDetails')
+        limits.acquire('APP-2', 'https://example.com/Pay')
+
+    def test_buckets_stored_in_sqlite(self):
+        limits = RateLimits(rate=1, path=self.path, max_wait=0)
+        limits.acquire('APP-1', 'https://example.com/Pay')
+        self.assertIsInstance(limits.bucket('APP-1', 'https://example.com/Pay'), SQLiteTokenBucket)
+
+        # Another instance, e.g. in another process, sees the same bucket
+        with self.assertRaises(RateLimitExceeded):
+            RateLimits(rate=1, path=self.path, max_wait=0).acquire('APP-1', 'https://example.com/Pay')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+""" Responses are parsed lazily, but bodies without a response envelope are
+still refused on construction
+"""
+import unittest
+
+from paypal import Configuration, Environment, PaypalAPIError
+from paypal.api import PaypalJSONAPIResponse, PaypalNVPAPIResponse
+
+from benchmarks import stub
+
+
+CONFIG = Configuration(Environment.Sandbox, 'userid', 'password', 'signature')
+
+
+class Raw(object):
+    """ Stands in for a `requests` response """
+
+    def __init__(self, content):
+        self.content = content
+
+
+class JSONResponseTest(unittest.TestCase):
+
+    def test_valid_body_is_parsed_on_access(self):
+        response = PaypalJSONAPIResponse(CONFIG, Raw(stub.payment_details_body()))
+        self.assertIsNone(response._response)
+        self.assertEqual(response.ack, 'Success')
+
+    def test_body_without_envelope_is_refused_on_construction(self):
+        for content in [
+            b'<html><body>502 Bad Gateway</body></html>',
+            b'',
+            b'{"error": []}',
+            stub.payment_details_body()[:-10],
+        ]:
+            with self.assertRaises(PaypalAPIError):
+                PaypalJSONAPIResponse(CONFIG, Raw(content))
+
+    def test_undecodable_body_is_refused_on_access(self):
+        content = stub.payment_details_body().replace(b'"currencyCode"', b'currencyCode', 1)
+        response = PaypalJSONAPIResponse(CONFIG, Raw(content))
+        with self.assertRaises(PaypalAPIError):
+            response.response
+
+
+class NVPResponseTest(unittest.TestCase):
+
+    def test_body_without_envelope_is_refused_on_construction(self):
+        with self.assertRaises(PaypalAPIError):
+            PaypalNVPAPIResponse(CONFIG, Raw(b'<html><body>502 Bad Gateway</body></html>'))
+
+    def test_valid_body_is_parsed_on_access(self):
+        content = b'TIMESTAMP=2014%2d10%2d21T18%3a15%3a53Z&CORRELATIONID=6e4b1d2b5f1f3&ACK=Success'
+        response = PaypalNVPAPIResponse(CONFIG, Raw(content))
+        self.assertIsNone(response._response)
+        self.assertEqual(response.response['ACK'], 'Success')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+""" Retries of Pay requests against a fault-injecting stub: a Pay request
+which may have reached PayPal must never be sent twice
+"""
+import json
+import socket
+import unittest
+
+import requests
+
+from paypal import (
+    AdaptivePayments, AdaptivePaymentsError, Configuration, PaypalAPIError, Receiver,
+    RetryPolicy,
+)
+from paypal.retry import failed_to_connect
+
+from benchmarks import stub
+
+
+ENVELOPE = {
+    'ack': 'Success',
+    'correlationId': '6e4b1d2b5f1f3',
+    'timestamp': '2014-10-21T11:15:53.861-07:00',
+}
+
+PAY_FAILURE = (
+    500, 'application/json', json.dumps({
+        'responseEnvelope': dict(ENVELOPE, ack='Failure'),
+        'error': [{'errorId': '520002', 'message': 'Internal Error'}],
+    })
+)
+
+
+def pay_success(status):
+    return 200, 'application/json', json.dumps({
+        'responseEnvelope': ENVELOPE,
+        'payKey': 'AP-PAY',
+        'paymentExecStatus': status,
+    })
+
+
+def payment_details(status):
+    return 200, 'application/json', json.dumps({
+        'responseEnvelope': ENVELOPE,
+        'payKey': 'AP-DETAILS',
+        'status': status,
+        'trackingId': 'order-1',
+        'paymentInfoList': {'paymentInfo': [{
+            'receiver': {'email': 'receiver@example.com', 'amount': '10.00'},
+        }]},
+    })
+
+
+PAYMENT_NOT_FOUND = (
+    200, 'application/json', json.dumps({
+        'responseEnvelope': dict(ENVELOPE, ack='Failure'),
+        'error': [{'errorId': '580022', 'message': 'The trackingId is invalid'}],
+    })
+)
+
+DETAILS_FAILURE = (
+    200, 'application/json', json.dumps({
+        'responseEnvelope': dict(ENVELOPE, ack='Failure'),
+        'error': [{'errorId': '520002', 'message': 'Internal Error'}],
+    })
+)
+
+
+class Route(object):
+    """ Answers requests in turn, repeating the last answer """
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.bodies = []
+
+    def __call__(self, body):
+        self.bodies.append(body)
+        if len(self.answers) > 1:
+            return self.answers.pop(0)
+        return self.answers[0]
+
+
+class PayRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pay = Route(pay_success('COMPLETED'))
+        self.details = Route(PAYMENT_NOT_FOUND)
+        self.server = stub.StubServer(routes={
+            '/AdaptivePayments/Pay': self.pay,
+            '/AdaptivePayments/PaymentDetails': self.details,
+        }).start()
+        self.config = Configuration(
+            stub.environment(self.server), 'userid', 'password', 'signature',
+            retry_policy=RetryPolicy(max_attempts=3, backoff=0),
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def pay_simple(self, **kwargs):
+        kwargs.setdefault('details', AdaptivePayments.Details.NEVER)
+        return AdaptivePayments(self.config).pay_simple(
+            email='receiver@example.com', amount='10.00', **kwargs
+        )
+
+    def test_completed_payment_is_not_sent_again(self):
+        self.pay.answers = [PAY_FAILURE, pay_success('COMPLETED')]
+        self.details.answers = [payment_details('COMPLETED')]
+
+        response = self.pay_simple(tracking_id='order-1', implicit=True)
+
+        self.assertEqual(len(self.pay.bodies), 1)
+        self.assertEqual(len(self.details.bodies), 1)
+        self.assertIn('order-1', self.details.bodies[0])
+        self.assertEqual(response.paykey, 'AP-DETAILS')
+        self.assertEqual(response.redirect, '')
+
+    def test_created_payment_still_redirects(self):
+        self.pay.answers = [PAY_FAILURE, pay_success('CREATED')]
+        self.details.answers = [payment_details('CREATED')]
+
+        response = self.pay_simple(tracking_id='order-1')
+
+        self.assertEqual(len(self.pay.bodies), 1)
+        self.assertEqual(response.paykey, 'AP-DETAILS')
+        self.assertIn('paykey=AP-DETAILS', response.redirect)
+
+    def test_unknown_payment_is_sent_again(self):
+        self.pay.answers = [PAY_FAILURE, pay_success('COMPLETED')]
+
+        response = self.pay_simple(tracking_id='order-1', implicit=True)
+
+        self.assertEqual(len(self.pay.bodies), 2)
+        self.assertEqual(len(self.details.bodies), 1)
+        self.assertTrue(response.success)
+        self.assertEqual(response.paykey, 'AP-PAY')
+
+    def test_failed_lookup_is_not_sent_again(self):
+        self.pay.answers = [PAY_FAILURE, pay_success('COMPLETED')]
+        self.details.answers = [DETAILS_FAILURE]
+
+        with self.assertRaises(AdaptivePaymentsError):
+            self.pay_simple(tracking_id='order-1', implicit=True)
+        self.assertEqual(len(self.pay.bodies), 1)
+
+    def test_dropped_payment_is_looked_up(self):
+        self.pay.answers = [None, pay_success('COMPLETED')]
+        self.details.answers = [payment_details('COMPLETED')]
+
+        response = self.pay_simple(tracking_id='order-1', implicit=True)
+
+        self.assertEqual(len(self.pay.bodies), 1)
+        self.assertEqual(response.paykey, 'AP-DETAILS')
+
+    def test_payment_without_tracking_id_is_not_sent_again(self):
+        self.pay.answers = [PAY_FAILURE, pay_success('COMPLETED')]
+
+        response = self.pay_simple(implicit=True)
+
+        self.assertEqual(len(self.pay.bodies), 1)
+        self.assertEqual(len(self.details.bodies), 0)
+        self.assertFalse(response.success)
+
+    def test_dropped_payment_without_tracking_id_is_not_sent_again(self):
+        self.pay.answers = [None, pay_success('COMPLETED')]
+
+        with self.assertRaises(requests.ConnectionError):
+            self.pay_simple(implicit=True)
+        self.assertEqual(len(self.pay.bodies), 1)
+
+
+class FailedToConnectTest(unittest.TestCase):
+
+    def closed_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_refused_connection_is_resent(self):
+        url = 'http://127.0.0.1:{}/'.format(self.closed_port())
+        attempts = []
+
+        def send(timeout):
+            attempts.append(timeout)
+            if len(attempts) == 1:
+                return requests.post(url)
+            return requests.Response()
+
+        response = RetryPolicy(backoff=0).call(send, lambda response: (), idempotent=False)
+
+        self.assertEqual(len(attempts), 2)
+        self.assertIsInstance(response, requests.Response)
+
+    def test_delivered_request_is_not_resent(self):
+        attempts = []
+
+        def send(timeout):
+            attempts.append(timeout)
+            raise requests.ConnectionError('Connection reset by peer')
+
+        with self.assertRaises(requests.ConnectionError):
+            RetryPolicy(backoff=0).call(send, lambda response: (), idempotent=False)
+        self.assertEqual(len(attempts), 1)
+
+    def test_failed_to_connect(self):
+        try:
+            requests.post('http://127.0.0.1:{}/'.format(self.closed_port()))
+        except requests.ConnectionError as e:
+            self.assertTrue(failed_to_connect(e))
+        self.assertTrue(failed_to_connect(requests.ConnectTimeout()))
+        self.assertFalse(failed_to_connect(requests.ReadTimeout()))
+        self.assertFalse(failed_to_connect(requests.ConnectionError()))
+
+
+if __name__ == '__main__':
+    unittest.main()
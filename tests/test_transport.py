@@ -0,0 +1,57 @@
+""" Pooled transport: one session per host, reusing its connections """
+import unittest
+
+from paypal import Transport
+from paypal.transport import pop_connect_timings
+
+from benchmarks import stub
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub.StubServer().start()
+        self.url = self.server.url('/AdaptivePayments/PaymentDetails')
+        pop_connect_timings()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def opened(self, transport):
+        """ Post to the stub, returning whether a connection was opened """
+        response = transport.post(self.url, data=b'{}')
+        self.assertEqual(response.status_code, 200)
+        return pop_connect_timings() != (None, None)
+
+    def test_session_per_host(self):
+        transport = Transport()
+        session = transport.session('https://svcs.paypal.com/AdaptivePayments/Pay')
+
+        self.assertIs(transport.session('https://svcs.paypal.com/Permissions/GetPermissions/'), session)
+        self.assertIsNot(transport.session('https://api-3t.paypal.com/nvp'), session)
+        self.assertIsNot(transport.session('http://svcs.paypal.com/AdaptivePayments/Pay'), session)
+
+    def test_connections_are_reused(self):
+        transport = Transport()
+        self.assertEqual([self.opened(transport) for _ in range(3)], [True, False, False])
+        self.assertEqual(len(transport._sessions), 1)
+
+        # Closing drops the pooled connections
+        transport.close()
+        self.assertEqual([self.opened(transport) for _ in range(2)], [True, False])
+
+    def test_connections_are_closed_without_keep_alive(self):
+        transport = Transport(keep_alive=False)
+        self.assertEqual([self.opened(transport) for _ in range(3)], [True, True, True])
+
+    def test_connect_timings(self):
+        transport = Transport()
+        transport.post(self.url, data=b'{}')
+        connect, tls = pop_connect_timings()
+        self.assertGreaterEqual(connect, 0)
+        self.assertIsNone(tls)
+        self.assertEqual(pop_connect_timings(), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+""" Helpers shared by the API classes """
+import unittest
+import weakref
+
+from paypal import AdaptivePayments, Configuration, Environment
+
+
+class MixedMethodTest(unittest.TestCase):
+
+    def test_binds_class_or_instance(self):
+        config = Configuration(Environment.Sandbox, 'userid', 'password', 'signature')
+        api = AdaptivePayments(config)
+
+        self.assertIs(AdaptivePayments.headers.__self__, AdaptivePayments)
+        self.assertIs(AdaptivePayments.headers, AdaptivePayments.headers)
+        self.assertIs(api.headers.__self__, api)
+
+    def test_instances_are_freed_without_collection(self):
+        config = Configuration(Environment.Sandbox, 'userid', 'password', 'signature')
+        api = AdaptivePayments(config)
+        api.headers()
+        api.pay_template
+        reference = weakref.ref(api)
+
+        del api
+        self.assertIsNone(reference())
+
+
+if __name__ == '__main__':
+    unittest.main()